@@ -0,0 +1,190 @@
+"""
+Agent de nœud VMaster.
+
+Expose les opérations de VirtualBoxVMCreator et les métriques de
+l'hyperviseur local en HTTP/JSON, pour qu'une instance VMaster centrale
+pilote plusieurs hôtes VirtualBox (VMASTER_NODES). Aucune base de
+données ici : l'état des VMs reste celui de VirtualBox.
+
+Usage : VMASTER_AGENT_TOKEN=secret python agent.py [--host 0.0.0.0] [--port 5001]
+
+L'agent n'écoute que sur 127.0.0.1 par défaut et refuse de s'exposer
+sur une autre adresse sans VMASTER_AGENT_TOKEN.
+"""
+import argparse
+import hmac
+import ipaddress
+import json
+import os
+import re
+import urllib.parse
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from creator import VirtualBoxVMCreator
+from metrics import MetricsSampler, VirtualBoxMetrics
+from nodes import read_host_resources
+
+VM_ROUTE = re.compile(r"^/vms/(?P<name>[^/]+)(?P<action>/start|/stop)?$")
+
+
+class NodeAgent:
+    """Opérations du nœud, indépendantes du transport HTTP"""
+
+    def __init__(self, storage_path: str, metrics_interval: float = 5):
+        self.storage_path = storage_path
+        self.creator = VirtualBoxVMCreator()
+        self.sampler = MetricsSampler(interval=metrics_interval)
+        self.sampler.start()
+        self._on_demand = VirtualBoxMetrics()
+
+    def capacity(self) -> dict:
+        return {"host": read_host_resources(self.storage_path)}
+
+    def vm_metrics(self, vm_name: str) -> dict:
+        metrics = self.sampler.get(vm_name)
+        if metrics is None and self.sampler.available:
+            # La VM ne tourne pas sur ce nœud
+            metrics = {"success": True, "cpu_usage": 0, "memory_usage": 0, "disk_usage": 0,
+                       "network_usage": 0, "is_running": False, "timestamp": self.sampler.updated_at.isoformat()}
+        if metrics is None:
+            metrics = self._on_demand.get_vm_metrics(vm_name)
+        return {"metrics": metrics}
+
+    def create(self, payload: dict) -> dict:
+        return {"result": self.creator.create_vm(
+            payload["vm_name"], payload["os_type"], payload["cpu_count"], payload["ram_gb"],
+            payload["storage_gb"], payload.get("iso_path"), payload.get("secondary_network_type"),
+            payload.get("graphics_controller"), payload.get("vram_mb"), payload.get("vm_db_id"),
+            dry_run=payload.get("dry_run", False), linked_clone=payload.get("linked_clone", False)
+        )}
+
+    def wait_ssh(self, payload: dict) -> dict:
+        kwargs = {"timeout": payload["timeout"]} if payload.get("timeout") else {}
+        return {"result": self.creator.wait_for_ssh(int(payload["ssh_port"]), **kwargs)}
+
+
+class AgentHandler(BaseHTTPRequestHandler):
+    server_version = "VMasterAgent/1.0"
+    agent = None
+    token = ""
+
+    # ------------------ Réponses ------------------
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body, default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value))
+        encoded = data.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def _payload(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length).decode()) if length else {}
+
+    def _authorized(self) -> bool:
+        # Comparaison en temps constant : le jeton ne se devine pas octet par octet
+        supplied = self.headers.get("X-VMaster-Token", "")
+        if self.token and not hmac.compare_digest(supplied.encode(), self.token.encode()):
+            self._send(401, {"success": False, "message": "Non autorisé"})
+            return False
+        return True
+
+    def _dispatch(self, method: str):
+        if not self._authorized():
+            return
+        path = urllib.parse.urlparse(self.path).path
+        try:
+            result = self._route(method, path)
+        except (KeyError, ValueError, TypeError) as e:
+            self._send(400, {"success": False, "message": f"Requête invalide: {e}"})
+            return
+        except Exception as e:
+            print(f"❌ Erreur agent {method} {path}: {e}")
+            self._send(500, {"success": False, "message": str(e)})
+            return
+        if result is None:
+            self._send(404, {"success": False, "message": "Route inconnue"})
+        else:
+            self._send(200, {"success": True, **result})
+
+    def _route(self, method: str, path: str):
+        agent = self.agent
+        if method == "GET":
+            if path == "/health":
+                return {"vboxmanage": agent.creator.vboxmanage_path}
+            if path == "/capacity":
+                return agent.capacity()
+            if path == "/metrics":
+                return {"vms": agent.sampler.snapshot()}
+            if path.startswith("/metrics/vms/"):
+                return agent.vm_metrics(urllib.parse.unquote(path[len("/metrics/vms/"):]))
+            if path.startswith("/templates/"):
+                return {"template": agent.creator.get_template(urllib.parse.unquote(path[len("/templates/"):]))}
+        if method == "POST" and path == "/vms":
+            return agent.create(self._payload())
+        if method == "POST" and path == "/wait-ssh":
+            return agent.wait_ssh(self._payload())
+
+        match = VM_ROUTE.match(path)
+        if match is None:
+            return None
+        name, action = urllib.parse.unquote(match["name"]), match["action"]
+        if method == "GET" and not action:
+            return {"exists": agent.creator.vm_exists(name)}
+        if method == "POST" and action == "/start":
+            return {"result": agent.creator.start_vm(name, self._payload().get("ssh_port"))}
+        if method == "POST" and action == "/stop":
+            return {"result": agent.creator.stop_vm(name)}
+        if method == "DELETE" and not action:
+            return {"result": agent.creator.delete_vm(name)}
+        return None
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Agent de nœud VMaster")
+    parser.add_argument("--host", default=os.environ.get("VMASTER_AGENT_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("VMASTER_AGENT_PORT", 5001)))
+    parser.add_argument("--storage", default=os.environ.get("VMASTER_VM_STORAGE_PATH", os.getcwd()))
+    args = parser.parse_args()
+
+    token = os.environ.get("VMASTER_AGENT_TOKEN", "")
+    if not token:
+        if not _is_loopback(args.host):
+            parser.error(f"VMASTER_AGENT_TOKEN requis pour écouter sur {args.host} "
+                         f"(sans jeton, l'agent n'écoute que sur 127.0.0.1)")
+        print("⚠️  VMASTER_AGENT_TOKEN vide : l'agent accepte toutes les requêtes locales")
+
+    AgentHandler.agent = NodeAgent(args.storage, float(os.environ.get("VMASTER_METRICS_INTERVAL", 5)))
+    AgentHandler.token = token
+
+    server = ThreadingHTTPServer((args.host, args.port), AgentHandler)
+    print(f"🛰️  Agent VMaster à l'écoute sur {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("👋 Arrêt de l'agent")
+
+
+if __name__ == "__main__":
+    main()
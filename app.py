@@ -1,27 +1,346 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, Response, g, render_template, request, redirect, url_for, session, flash, jsonify
 from werkzeug.security import generate_password_hash, check_password_hash
-from database import db
-from models import User, VM
-import subprocess
-import sys
-import json
+from database import db, configure_sqlite
+from models import User, VM, Job
+from jobs import jobs
+from pool import vm_pool
+from capacity import capacity
+from nodes import LOCAL_NODE, NodeError, nodes
+from ssh_pool import SSHPoolError, ssh_pool, vm_ssh_config
+from terminal_bridge import terminal_bridge
+from provisioner import provisioner
+from shared_state import leader, shared_state
+from metrics import MetricsSampler, VirtualBoxMetrics
+from history import MetricsHistory, parse_window, METRIC_FIELDS
+from metrics_store import MetricsStore
+from events import broker
+from cache import TTLCache
+from migrations import migrate
+from pagination import CursorError, keyset_page
+from sqlalchemy.orm import load_only
+from telemetry import registry, request_duration, gauge_family, counter_family, CONTENT_TYPE
+import hmac
+import time
 from datetime import datetime
-import random
 import webbrowser
+import threading
 from threading import Timer
 import os
 
 app = Flask(__name__)
-app.secret_key = 'supersecretkey'
+# Même clé pour tous les workers : la session (cookie signé) est valable quel que soit le processus
+app.secret_key = os.environ.get('VMASTER_SECRET_KEY', 'supersecretkey')
 
-# Configuration base de données SQLite
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
+# Configuration base de données (SQLite par défaut, ex: postgresql://vmaster@localhost/vmaster)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('VMASTER_DATABASE_URI', 'sqlite:///users.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# SQLite : attente du verrou d'écriture (ms) et niveau de synchronisation en mode WAL
+app.config['VMASTER_SQLITE_BUSY_TIMEOUT'] = int(os.environ.get('VMASTER_SQLITE_BUSY_TIMEOUT', 5000))
+app.config['VMASTER_SQLITE_SYNCHRONOUS'] = os.environ.get('VMASTER_SQLITE_SYNCHRONOUS', 'NORMAL')
+# Nombre maximum d'opérations VirtualBox exécutées en parallèle
+app.config['VMASTER_JOB_WORKERS'] = int(os.environ.get('VMASTER_JOB_WORKERS', 4))
+# Relève par le leader des jobs soumis par les autres workers (secondes)
+app.config['VMASTER_JOB_POLL_INTERVAL'] = float(os.environ.get('VMASTER_JOB_POLL_INTERVAL', 1))
+# Pool de VMs pré-créées : "ubuntu=40,debian=2" (vide = désactivé)
+app.config['VMASTER_POOL'] = os.environ.get('VMASTER_POOL', '')
+app.config['VMASTER_POOL_MAX_VMS'] = int(os.environ.get('VMASTER_POOL_MAX_VMS', 50))
+app.config['VMASTER_POOL_FILL_CONCURRENCY'] = int(os.environ.get('VMASTER_POOL_FILL_CONCURRENCY', 2))
+# Intervalle d'échantillonnage des métriques de toute la flotte (secondes)
+app.config['VMASTER_METRICS_INTERVAL'] = float(os.environ.get('VMASTER_METRICS_INTERVAL', 5))
+# Surallocation admise (capacité = ressources de l'hôte × taux) et RAM réservée à l'hôte (Go)
+app.config['VMASTER_CPU_OVERCOMMIT'] = float(os.environ.get('VMASTER_CPU_OVERCOMMIT', 4))
+app.config['VMASTER_RAM_OVERCOMMIT'] = float(os.environ.get('VMASTER_RAM_OVERCOMMIT', 1))
+app.config['VMASTER_DISK_OVERCOMMIT'] = float(os.environ.get('VMASTER_DISK_OVERCOMMIT', 1.5))
+app.config['VMASTER_HOST_RESERVED_RAM'] = float(os.environ.get('VMASTER_HOST_RESERVED_RAM', 2))
+app.config['VMASTER_VM_STORAGE_PATH'] = os.environ.get('VMASTER_VM_STORAGE_PATH', os.getcwd())
+# Nœuds hyperviseurs : "local,lab2=http://10.0.0.2:5001" (agent.py sur chaque nœud distant)
+app.config['VMASTER_NODES'] = os.environ.get('VMASTER_NODES', 'local')
+app.config['VMASTER_AGENT_TOKEN'] = os.environ.get('VMASTER_AGENT_TOKEN', '')
+# Adresse SSH des nœuds distants : 'lab2=10.0.0.2' (leur agent avec VMASTER_SSH_BIND)
+app.config['VMASTER_NODE_SSH_HOSTS'] = os.environ.get('VMASTER_NODE_SSH_HOSTS', '')
+# Connexions SSH réutilisées : nombre max par VM, fermeture après inactivité et keepalive (secondes)
+app.config['VMASTER_SSH_MAX_PER_VM'] = int(os.environ.get('VMASTER_SSH_MAX_PER_VM', 2))
+app.config['VMASTER_SSH_IDLE_TIMEOUT'] = float(os.environ.get('VMASTER_SSH_IDLE_TIMEOUT', 300))
+app.config['VMASTER_SSH_KEEPALIVE'] = float(os.environ.get('VMASTER_SSH_KEEPALIVE', 30))
+# Pont WebSocket ↔ SSH du terminal web (serveur asyncio sur un port dédié)
+app.config['VMASTER_TERMINAL_HOST'] = os.environ.get('VMASTER_TERMINAL_HOST', '127.0.0.1')
+app.config['VMASTER_TERMINAL_PORT'] = int(os.environ.get('VMASTER_TERMINAL_PORT', 5002))
+app.config['VMASTER_TERMINAL_MAX_SESSIONS'] = int(os.environ.get('VMASTER_TERMINAL_MAX_SESSIONS', 200))
+# Scripts de configuration exécutés après le premier démarrage : parallélisme, délais (secondes), lignes de journal gardées
+app.config['VMASTER_PROVISION_CONCURRENCY'] = int(os.environ.get('VMASTER_PROVISION_CONCURRENCY', 8))
+app.config['VMASTER_PROVISION_READY_TIMEOUT'] = float(os.environ.get('VMASTER_PROVISION_READY_TIMEOUT', 300))
+app.config['VMASTER_PROVISION_TIMEOUT'] = float(os.environ.get('VMASTER_PROVISION_TIMEOUT', 1800))
+app.config['VMASTER_PROVISION_LOG_LINES'] = int(os.environ.get('VMASTER_PROVISION_LOG_LINES', 2000))
+# État partagé entre les workers (leader, instantané des métriques, évènements) et durée du bail du leader (secondes)
+app.config['VMASTER_STATE_DB'] = os.environ.get('VMASTER_STATE_DB', os.path.join(app.instance_path, 'state.db'))
+app.config['VMASTER_LEADER_LEASE'] = float(os.environ.get('VMASTER_LEADER_LEASE', 30))
+os.makedirs(os.path.dirname(app.config['VMASTER_STATE_DB']) or '.', exist_ok=True)
+configure_sqlite(app)
 db.init_app(app)
+shared_state.init_app(app)
+jobs.init_app(app)
+vm_pool.init_app(app)
+nodes.init_app(app)
+capacity.init_app(app)
+ssh_pool.init_app(app)
+terminal_bridge.init_app(app)
+provisioner.init_app(app)
+metrics_sampler = MetricsSampler(interval=app.config['VMASTER_METRICS_INTERVAL'])
+# Seul le leader interroge VirtualBox et exécute les jobs ; les autres workers relisent son instantané
+metrics_sampler.share(shared_state, lambda: leader.is_leader)
+jobs.share(lambda: leader.is_leader)
+broker.share(shared_state)
+# Historique récent en mémoire (secondes), taille fixe par VM
+app.config['VMASTER_METRICS_HISTORY'] = float(os.environ.get('VMASTER_METRICS_HISTORY', 900))
+metrics_history = MetricsHistory(app.config['VMASTER_METRICS_HISTORY'], app.config['VMASTER_METRICS_INTERVAL'])
+metrics_sampler.add_listener(metrics_history.record)
+# Historique persistant (fichier SQLite séparé de users.db) avec agrégats minute/heure
+app.config['VMASTER_METRICS_DB'] = os.environ.get('VMASTER_METRICS_DB', os.path.join(app.instance_path, 'metrics.db'))
+app.config['VMASTER_METRICS_RAW_RETENTION'] = float(os.environ.get('VMASTER_METRICS_RAW_RETENTION', 6 * 3600))
+os.makedirs(os.path.dirname(app.config['VMASTER_METRICS_DB']) or '.', exist_ok=True)
+metrics_store = MetricsStore(app.config['VMASTER_METRICS_DB'], raw_retention=app.config['VMASTER_METRICS_RAW_RETENTION'])
+metrics_sampler.add_listener(metrics_store.record, local_only=True)
+# Cache court des réponses /api/vms/<id>/metrics (secondes) ; les requêtes simultanées sont regroupées
+app.config['VMASTER_METRICS_CACHE_TTL'] = float(os.environ.get('VMASTER_METRICS_CACHE_TTL', 2))
+metrics_cache = TTLCache(ttl=app.config['VMASTER_METRICS_CACHE_TTL'])
+_on_demand_metrics = None
 
-# Crée la base si elle n'existe pas
-with app.app_context():
-    db.create_all()
+
+# ------------------ Évènements temps réel (SSE) ------------------
+
+_streamed_vms = set()
+
+def publish_metrics(snapshot, timestamp):
+    """Pousse l'échantillon de la flotte aux utilisateurs connectés, VM par VM"""
+    global _streamed_vms
+    users = broker.users()
+    if not users:
+        _streamed_vms = set()
+        return
+
+    # Les VMs disparues de l'échantillon viennent de s'arrêter : dernières valeurs à zéro
+    names = set(snapshot) | _streamed_vms
+    with app.app_context():
+        owned = VM.query.filter(VM.name.in_(names), VM.user_id.in_(users)).all() if names else []
+
+    streamed = set()
+    for vm in owned:
+        metrics = snapshot.get(vm.name)
+        if metrics is None:
+            metrics = {'cpu_usage': 0, 'memory_usage': 0, 'disk_usage': 0, 'network_usage': 0, 'is_running': False}
+        else:
+            streamed.add(vm.name)
+        # Chaque worker pousse l'instantané à ses propres onglets : rien à relayer
+        broker.publish(vm.user_id, 'metrics', {
+            'vm_id': vm.id,
+            'metrics': {field: metrics.get(field, 0) for field in METRIC_FIELDS + ('is_running', 'memory_source')},
+            'timestamp': datetime.fromtimestamp(timestamp).isoformat()
+        }, relay=False)
+    _streamed_vms = streamed
+
+def publish_job(job, vm):
+    """Pousse l'état du job et de sa VM à son propriétaire"""
+    if job.user_id is None:
+        return
+    # Relecture : la VM peut avoir été supprimée par le job
+    current = VM.query.get(job.vm_id) if job.vm_id else None
+    broker.publish(job.user_id, 'status', {
+        'vm_id': job.vm_id,
+        'status': current.status if current else 'deleted',
+        'job': job.to_dict()
+    })
+
+metrics_sampler.add_listener(publish_metrics)
+jobs.add_listener(publish_job)
+# Un changement d'état rend les métriques en cache obsolètes
+jobs.add_listener(lambda job, vm: metrics_cache.invalidate(job.vm_id))
+# Une VM arrêtée ou supprimée ne garde pas de connexions SSH ouvertes
+jobs.add_listener(lambda job, vm: ssh_pool.evict(job.vm_id) if job.action in ('stop', 'delete') and job.vm_id else None)
+
+def provision_after_boot(job, vm):
+    """Premier démarrage réussi d'une VM avec un script : on l'exécute dans le guest"""
+    if job.action == 'start' and job.status == 'succeeded' and vm is not None \
+            and (vm.script or '').strip() and vm.provision_status is None:
+        provisioner.submit(vm)
+
+def publish_provision(vm):
+    broker.publish(vm.user_id, 'provision', {
+        'vm_id': vm.id,
+        'status': vm.provision_status,
+        'exit_code': vm.provision_exit_code
+    })
+
+jobs.add_listener(provision_after_boot)
+provisioner.add_listener(publish_provision)
+
+# ------------------ Télémétrie (/metrics) ------------------
+
+# Jeton optionnel exigé par /metrics (en-tête "Authorization: Bearer <jeton>") ;
+# sans jeton, l'export est public et ne contient pas les noms des VMs
+app.config['VMASTER_METRICS_TOKEN'] = os.environ.get('VMASTER_METRICS_TOKEN', '')
+
+def collect_vm_telemetry():
+    """Métriques par VM depuis l'instantané de l'échantillonneur, identifiées par UUID"""
+    snapshot = metrics_sampler.snapshot()
+    with_names = bool(app.config['VMASTER_METRICS_TOKEN'])
+    info, cpu, memory, disk, disk_used, disk_capacity, network = [], [], [], [], [], [], []
+    for name, metrics in snapshot.items():
+        if not metrics.get('uuid') and not with_names:
+            # Pas d'UUID : seul le nom identifierait la VM
+            continue
+        key = (metrics.get('uuid') or name,)
+        info.append(((key[0], name) if with_names else key, 1))
+        cpu.append((key, metrics.get('cpu_usage')))
+        memory.append((key, metrics.get('memory_usage')))
+        disk.append((key, metrics.get('disk_usage')))
+        disk_used.append((key, metrics.get('disk_used_bytes')))
+        disk_capacity.append((key, metrics.get('disk_capacity_bytes')))
+        rate = metrics.get('network_usage')
+        network.append((key, round(rate * 1024 ** 2) if rate is not None else None))
+
+    labels = ('uuid',)
+    info_labels = ('uuid', 'name') if with_names else labels
+    lines = gauge_family('vmaster_vm_info', 'VM en cours d\'exécution (nom en label si /metrics exige un jeton)',
+                         info_labels, info)
+    lines += gauge_family('vmaster_vm_cpu_usage_percent', 'Charge CPU de la VM', labels, cpu)
+    lines += gauge_family('vmaster_vm_memory_usage_percent', 'Mémoire utilisée par la VM', labels, memory)
+    lines += gauge_family('vmaster_vm_disk_usage_percent', 'Occupation des disques de la VM', labels, disk)
+    lines += gauge_family('vmaster_vm_disk_used_bytes', 'Taille réelle des disques de la VM', labels, disk_used)
+    lines += gauge_family('vmaster_vm_disk_capacity_bytes', 'Taille logique des disques de la VM', labels, disk_capacity)
+    lines += gauge_family('vmaster_vm_network_bytes_per_second', 'Débit réseau (rx + tx) de la VM', labels, network)
+    age = (datetime.now() - metrics_sampler.updated_at).total_seconds() if metrics_sampler.available else None
+    lines += gauge_family('vmaster_metrics_sample_age_seconds', 'Âge du dernier échantillon', (), [((), age)])
+    return lines
+
+def collect_control_plane_telemetry():
+    """File de jobs et pool de VMs, lus en base : identiques quel que soit le worker"""
+    job_counts = dict(db.session.query(Job.status, db.func.count(Job.id))
+                      .filter(Job.status.in_(['queued', 'running'])).group_by(Job.status).all())
+    lines = gauge_family('vmaster_job_queue_depth', 'Jobs en attente d\'un worker', (), [((), job_counts.get('queued', 0))])
+    lines += gauge_family('vmaster_jobs_running', 'Jobs en cours d\'exécution', (), [((), job_counts.get('running', 0))])
+
+    stats = vm_pool.stats()
+    pool_sizes = [((os_type, status), count)
+                  for os_type, counts in stats['pools'].items() for status, count in counts.items()]
+    lines += gauge_family('vmaster_pool_vms', 'VMs du pool par OS et état', ('os', 'status'), pool_sizes)
+    lines += gauge_family('vmaster_pool_target', 'Taille cible du pool par OS', ('os',),
+                          [((os_type,), target) for os_type, target in stats['targets'].items()])
+    return lines
+
+def collect_process_telemetry():
+    """Compteurs et jauges propres à ce worker (additionnés entre workers par le registre)"""
+    # Sans requête SQL : appelé aussi hors contexte Flask, par le thread de publication
+    lines = counter_family('vmaster_pool_claims', 'Attributions depuis le pool', ('result',),
+                           [(('hit',), vm_pool.hits), (('miss',), vm_pool.misses)])
+
+    lines += gauge_family('vmaster_event_subscribers', 'Onglets abonnés au flux SSE', (), [((), broker.subscriber_count)])
+    cache = metrics_cache.stats()
+    lines += counter_family('vmaster_metrics_cache_requests', 'Requêtes du cache de métriques', ('result',),
+                          [(('hit',), cache['hits']), (('miss',), cache['misses']), (('coalesced',), cache['coalesced'])])
+
+    ssh = ssh_pool.stats()
+    lines += gauge_family('vmaster_ssh_connections', 'Connexions SSH du pool', ('state',),
+                          [(('open',), ssh['open']), (('idle',), ssh['idle'])])
+    lines += counter_family('vmaster_ssh_checkouts', 'Prêts de connexions SSH', ('result',),
+                          [(('handshake',), ssh['opened']), (('reused',), ssh['reused'])])
+
+    provisioning = provisioner.stats()
+    lines += gauge_family('vmaster_provisioning', 'Scripts de configuration en cours ou en attente', ('state',),
+                          [(('running',), provisioning['running']), (('queued',), provisioning['queued'])])
+
+    lines += gauge_family('vmaster_worker_leader', 'Workers qui font tourner les services de fond', (),
+                          [((), 1 if leader.is_leader else 0)])
+
+    terminal = terminal_bridge.stats()
+    lines += gauge_family('vmaster_terminal_sessions', 'Sessions du terminal web ouvertes', (), [((), terminal['sessions'])])
+    lines += counter_family('vmaster_terminal_bytes', 'Octets relayés par le terminal web', ('direction',),
+                          [(('out',), terminal['bytes_out']), (('in',), terminal['bytes_in'])])
+    return lines
+
+registry.share(shared_state)
+registry.add_collector(collect_vm_telemetry)
+registry.add_collector(collect_control_plane_telemetry)
+registry.add_collector(collect_process_telemetry, per_process=True)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_duration(response):
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        # Le motif de la route (et non l'URL) borne le nombre de séries
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_duration.observe(time.perf_counter() - started, route, request.method, str(response.status_code))
+    return response
+
+def prepare_database():
+    """
+    Une fois par démarrage du serveur, avant les workers (python app.py,
+    hook on_starting de gunicorn) : crée la base, applique les migrations
+    en attente et solde les opérations coupées par l'arrêt précédent.
+    """
+    migrate(app)
+    jobs.fail_interrupted()
+    provisioner.reset_interrupted()
+    with app.app_context():
+        # Les connexions ouvertes ici ne doivent pas être héritées par les workers
+        db.engine.dispose()
+
+# Services de fond démarrés à la première requête (ou au démarrage du worker sous
+# gunicorn), dans le processus qui sert réellement l'application
+_background_started = False
+
+@app.before_request
+def start_background_services():
+    global _background_started
+    if not _background_started:
+        _background_started = True
+        leader.start()
+        metrics_sampler.start()
+        registry.start()
+
+# Thread de maintenance du leader : un seul, même après plusieurs réélections
+_maintenance_thread = None
+
+def lead():
+    """Services qui ne tournent que dans un seul worker, le leader"""
+    global _maintenance_thread
+    vm_pool.start()
+    metrics_store.start()
+    terminal_bridge.start()
+    # Jobs et scripts restés en attente (arrêt précédent, worker disparu), puis
+    # relève continue des jobs soumis par les autres workers
+    jobs.requeue()
+    jobs.start()
+    provisioner.recover()
+    # Réélu pendant la pause du thread précédent : il reprend simplement son travail
+    if _maintenance_thread is None or not _maintenance_thread.is_alive():
+        _maintenance_thread = threading.Thread(target=leader_maintenance, name="vmaster-leader-maintenance", daemon=True)
+        _maintenance_thread.start()
+
+def step_down():
+    """Bail de leader perdu : un autre worker fait désormais tourner ces services"""
+    jobs.stop()
+    vm_pool.stop()
+    metrics_store.stop()
+    terminal_bridge.stop()
+    if metrics_sampler.guest:
+        metrics_sampler.guest.stop()
+
+def leader_maintenance():
+    while True:
+        time.sleep(30)
+        if not leader.is_leader:
+            return
+        try:
+            shared_state.prune()
+        except Exception as e:
+            print(f"❌ Erreur maintenance du leader: {e}")
+
+leader.on_elected(lead)
+leader.on_demoted(step_down)
 
 # ------------------ Routes ------------------
 
@@ -87,13 +406,106 @@ def profile():
 
     return render_template('profile.html', user=user)
 
+# Tris proposés pour la liste des VMs : colonne + sens (pagination par clé sur (colonne, id))
+VM_SORTS = {
+    '-created_at': (VM.created_at, True),
+    'created_at': (VM.created_at, False),
+    'name': (VM.name, False),
+    '-name': (VM.name, True),
+}
+# Champs exposés par /api/vms (?fields=...) et champs renvoyés par défaut
+VM_FIELDS = ('id', 'name', 'os', 'cpu', 'ram', 'storage', 'status', 'node', 'network_type',
+             'template_name', 'boot_seconds', 'provision_status', 'provision_exit_code', 'created_at')
+VM_DEFAULT_FIELDS = ('id', 'name', 'os', 'status', 'created_at')
+VM_PAGE_SIZE = 50
+VM_PAGE_MAX = 200
+
+def query_user_vms(args, user_id, fields=None):
+    """
+    Page de VMs d'un utilisateur selon ?status=running,stopped&os=ubuntu&sort=-created_at
+    &limit=50&after=<curseur>|before=<curseur>. Lève CursorError/ValueError si invalide.
+    """
+    sort = args.get('sort', '-created_at')
+    if sort not in VM_SORTS:
+        raise ValueError(f"Tri inconnu: {sort}")
+    column, descending = VM_SORTS[sort]
+    limit = min(max(args.get('limit', VM_PAGE_SIZE, type=int) or VM_PAGE_SIZE, 1), VM_PAGE_MAX)
+
+    query = VM.query.filter(VM.user_id == user_id)
+    statuses = [item for item in args.get('status', '').split(',') if item]
+    if statuses:
+        query = query.filter(VM.status.in_(statuses))
+    if args.get('os'):
+        query = query.filter(VM.os == args['os'])
+    if fields is not None:
+        # Seules les colonnes demandées (et celles du tri) sont lues
+        columns = {'id', column.key} | {field for field in fields if field in VM_FIELDS}
+        query = query.options(load_only(*[getattr(VM, name) for name in columns]))
+
+    return keyset_page(query, column, VM.id, sort, descending, limit,
+                       after=args.get('after') or None, before=args.get('before') or None)
+
 @app.route('/vms')
 def my_vms():
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    vms = VM.query.filter_by(user_id=session['user_id']).all()
-    return render_template('vms.html', vms=vms)
+    try:
+        page = query_user_vms(request.args, session['user_id'])
+    except (CursorError, ValueError) as e:
+        flash(f"⚠️ {e}", "error")
+        return redirect(url_for('my_vms'))
+    vms = page.items
+
+    # Dernier job en cours par VM, pour que la page suive son avancement
+    pending_jobs = {}
+    active_jobs = Job.query.filter(
+        Job.user_id == session['user_id'],
+        Job.status.in_(['queued', 'running']),
+        Job.vm_id.in_([vm.id for vm in vms])
+    ).order_by(Job.id).all()
+    for job in active_jobs:
+        if job.vm_id:
+            pending_jobs[job.vm_id] = job.id
+
+    # Valeurs proposées par les filtres (requête agrégée, pas de chargement des VMs)
+    os_choices = [row[0] for row in db.session.query(VM.os).filter(VM.user_id == session['user_id']).distinct().order_by(VM.os)]
+    filters = {key: request.args.get(key, '') for key in ('status', 'os', 'sort', 'limit')}
+    # Filtres repris par les liens de pagination
+    page_args = {key: value for key, value in filters.items() if value}
+    return render_template('vms.html', vms=vms, pending_jobs=pending_jobs, page=page,
+                           filters=filters, page_args=page_args, os_choices=os_choices)
+
+@app.route('/api/vms')
+def api_list_vms():
+    """Liste paginée des VMs (mêmes filtres que /vms) ; ?fields=id,name,status pour une réponse compacte"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Non connecté'})
+
+    fields = [field for field in request.args.get('fields', ','.join(VM_DEFAULT_FIELDS)).split(',') if field]
+    unknown = [field for field in fields if field not in VM_FIELDS]
+    if unknown:
+        return jsonify({'success': False, 'message': f"Champs inconnus: {', '.join(unknown)}"}), 400
+
+    try:
+        page = query_user_vms(request.args, session['user_id'], fields)
+    except (CursorError, ValueError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    def serialize(vm):
+        item = {}
+        for field in fields:
+            value = getattr(vm, field)
+            item[field] = value.isoformat() if isinstance(value, datetime) else value
+        return item
+
+    return jsonify({
+        'success': True,
+        'vms': [serialize(vm) for vm in page.items],
+        'count': len(page.items),
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor
+    })
 
 @app.route('/vms/<int:vm_id>/start', methods=['POST'])
 def start_vm(vm_id):
@@ -103,9 +515,14 @@ def start_vm(vm_id):
         return redirect(url_for('my_vms'))
 
     try:
-        subprocess.Popen([sys.executable, "creator.py", "start", vm.name])
-        vm.status = 'running'
-        db.session.commit()
+        # Vérification et réservation atomiques : deux démarrages simultanés ne peuvent pas dépasser la capacité
+        with capacity.lock:
+            refusal = capacity.check_start(vm) if vm.status not in ('running', 'starting') else None
+            if refusal:
+                flash(f"⛔ {refusal}", "danger")
+                return redirect(request.referrer or url_for('my_vms'))
+            vm.status = 'starting'
+            jobs.submit('start', vm)
         flash(f"✅ La machine {vm.name} est en cours de démarrage.", "success")
     except Exception as e:
         flash(f"⚠️ Erreur lors du démarrage : {e}", "danger")
@@ -120,9 +537,8 @@ def stop_vm(vm_id):
         return redirect(url_for('my_vms'))
 
     try:
-        subprocess.Popen([sys.executable, "creator.py", "stop", vm.name])
-        vm.status = 'stopped'
-        db.session.commit()
+        vm.status = 'stopping'
+        jobs.submit('stop', vm)
         flash(f"🛑 La machine {vm.name} est en cours d'arrêt.", "success")
     except Exception as e:
         flash(f"⚠️ Erreur lors de l'arrêt : {e}", "danger")
@@ -137,9 +553,8 @@ def delete_vm(vm_id):
         return redirect(url_for('my_vms'))
 
     try:
-        subprocess.Popen([sys.executable, "creator.py", "delete", vm.name])
-        db.session.delete(vm)
-        db.session.commit()
+        vm.status = 'deleting'
+        jobs.submit('delete', vm)
         flash(f"🗑 La machine {vm.name} est en cours de suppression.", "success")
     except Exception as e:
         flash(f"⚠️ Erreur lors de la suppression : {e}", "danger")
@@ -185,6 +600,7 @@ def create_vm():
             network_type = request.form.get('network_type', 'nat')
             graphics_controller = request.form.get('graphics_controller', 'vmsvga')
             vram = request.form.get('vram', '128')
+            mode = request.form.get('mode', 'linked')
 
             # Validation des champs obligatoires
             if not all([name, os_type, cpu, ram, storage]):
@@ -244,66 +660,65 @@ def create_vm():
             else:
                 print(f"ℹ️ Aucun ISO automatique pour: {os_type}")
 
-            # Création de la VM dans la base
-            new_vm = VM(
-                user_id=session['user_id'],
-                name=name,
-                os=os_type,
-                cpu=cpu_int,
-                ram=ram_int,
-                storage=storage_int,
-                script=script,
-                network_type=network_type,
-                graphics_controller=graphics_controller,
-                vram=vram_int,
-                status='creating'
-            )
-            
-            db.session.add(new_vm)
-            db.session.commit()
+            # Capacité de l'hôte (disque engagé, taille maximale d'une VM) ; avec
+            # plusieurs nœuds, la VM va sur celui qui a le plus de marge. Vérification
+            # et réservation atomiques : la VM est en base avant que le verrou ne soit rendu
+            with capacity.lock:
+                if len(nodes.names()) > 1:
+                    node_name, refusal = capacity.place(cpu_int, ram_int, storage_int)
+                else:
+                    node_name, refusal = LOCAL_NODE, capacity.check_create(cpu_int, ram_int, storage_int)
+                if refusal:
+                    flash(f"⛔ {refusal}", "error")
+                    return redirect(url_for('create_vm'))
+
+                # Création de la VM dans la base
+                new_vm = VM(
+                    user_id=session['user_id'],
+                    name=name,
+                    os=os_type,
+                    cpu=cpu_int,
+                    ram=ram_int,
+                    storage=storage_int,
+                    script=script,
+                    network_type=network_type,
+                    graphics_controller=graphics_controller,
+                    vram=vram_int,
+                    node=node_name,
+                    status='creating'
+                )
+
+                db.session.add(new_vm)
+                db.session.commit()
             vm_id = new_vm.id
 
             # ✅ CALCUL SIMPLE DU PORT SSH
             ssh_port = 2200 + vm_id
             print(f"🔧 Port SSH calculé: 2200 + {vm_id} = {ssh_port}")
 
-            # Appel du script Python pour créer la VM
+            # Création de la VM par le pool de workers (VM pré-créée si disponible)
             try:
-                command = [
-                    sys.executable,
-                    "creator.py",
-                    "create",
-                    name,
-                    os_type,
-                    str(cpu_int),
-                    str(ram_int),
-                    str(storage_int),
-                    iso_path if iso_path else "",
-                    network_type,
-                    graphics_controller,
-                    str(vram_int),
-                    str(vm_id)  # ✅ ENVOYER L'ID DE LA VM
-                ]
-
-                # Nettoyer les arguments vides
-                command = [arg for arg in command if arg != ""]
-                
-                # Lancer le script en arrière-plan
-                subprocess.Popen(command)
+                # Le pool de VMs pré-créées n'existe que sur le nœud local
+                pool_vm = vm_pool.claim(os_type) if mode == 'linked' and node_name == LOCAL_NODE else None
+                if pool_vm:
+                    jobs.submit('adopt', new_vm, pool_vm_id=pool_vm.id, iso_path=iso_path, mode=mode)
+                    print(f"♻️  VM du pool attribuée: {pool_vm.name} → {name}")
+                else:
+                    jobs.submit('create', new_vm, iso_path=iso_path, mode=mode)
                 
                 if iso_path:
                     flash(f"✅ Votre machine virtuelle {os_type} est en cours de création avec l'ISO automatique...", "success")
                 else:
                     flash(f"✅ Votre machine virtuelle {os_type} est en cours de création (sans ISO)...", "success")
                 
-                print(f"🚀 Lancement création VM: {name} (ID: {vm_id}, Port SSH: {ssh_port})")
+                print(f"🚀 Lancement création VM: {name} (ID: {vm_id}, Port SSH: {ssh_port}, nœud: {node_name})")
                 print(f"📋 Configuration: {os_type}, {cpu_int} CPU, {ram_int} Go RAM, {storage_int} Go stockage")
 
             except Exception as e:
                 new_vm.status = 'error'
                 db.session.commit()
-                flash(f"❌ Erreur lors du lancement du script: {e}", "danger")
-                print(f"❌ Erreur script VM: {e}")
+                flash(f"❌ Erreur lors de la mise en file de la création: {e}", "danger")
+                print(f"❌ Erreur job création VM: {e}")
 
             return redirect('/vms')
 
@@ -321,6 +736,35 @@ def dashboard():
         return redirect(url_for('login'))
     return render_template('dashboard.html')
 
+@app.route('/api/jobs/<int:job_id>')
+def get_job(job_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Non connecté'})
+
+    job = Job.query.get_or_404(job_id)
+    if job.user_id != session['user_id']:
+        return jsonify({'success': False, 'message': 'Non autorisé'})
+
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+@app.route('/api/capacity')
+def get_capacity():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Non connecté'})
+
+    node_name = request.args.get('node', LOCAL_NODE)
+    if node_name not in nodes.names():
+        return jsonify({'success': False, 'message': 'Nœud inconnu'})
+
+    return jsonify({'success': True, 'nodes': nodes.names(), **capacity.headroom(node_name)})
+
+@app.route('/api/pool')
+def get_pool_stats():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Non connecté'})
+
+    return jsonify({'success': True, 'pool': vm_pool.stats()})
+
 @app.route('/api/vms/<int:vm_id>/vnc-info')
 def get_vnc_info(vm_id):
     vm = VM.query.get_or_404(vm_id)
@@ -349,48 +793,9 @@ def get_ssh_info(vm_id):
         return jsonify({'success': False, 'message': 'Non autorisé'})
 
     try:
-        # Mapping utilisateur/OS
-        os_username_map = {
-            'ubuntu': 'ubuntu',
-            'debian': 'debian',
-            'centos': 'centos',
-            'fedora': 'fedora',
-            'archlinux': 'arch',
-            'opensuse': 'opensuse',
-            'gentoo': 'gentoo',
-            'linux': 'linux',
-            'windows': 'administrator',
-            'windows10': 'administrator',
-            'windows11': 'administrator',
-            'freebsd': 'freebsd',
-            'solaris': 'solaris',
-            'oracle': 'oracle'
-        }
-        
-        username = os_username_map.get(vm.os.lower(), 'user')
-        
-        # ✅ CALCUL SIMPLE : Port = 2200 + ID_VM
-        base_ssh_port = 2200
-        ssh_port = base_ssh_port + vm.id
-        
-        ssh_config = {
-            'success': True,
-            'vm_name': vm.name,
-            'os': vm.os,
-            'username': username,
-            'password': '123456',
-            'host': '127.0.0.1',
-            'port': ssh_port,
-            'vm_ip': '10.0.2.15',
-            'vm_db_id': vm.id,
-            'base_port': base_ssh_port,
-            'command': f'ssh {username}@127.0.0.1 -p {ssh_port}',
-            'status': vm.status
-        }
-        
-        print(f"🔧 App.py - VM: {vm.name}, ID: {vm.id}, Port: {ssh_port}")
-        
-        return jsonify(ssh_config)
+        ssh_config = vm_ssh_config(vm)
+        print(f"🔧 App.py - VM: {vm.name}, ID: {vm.id}, Port: {ssh_config['port']}")
+        return jsonify({'success': True, **ssh_config})
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erreur: {str(e)}'})
@@ -405,47 +810,16 @@ def test_ssh_connection(vm_id):
         return jsonify({'success': False, 'message': 'Non autorisé'})
 
     try:
-        import paramiko
-        import socket
-        
-        ssh_info_response = get_ssh_info(vm_id)
-        ssh_info = ssh_info_response.get_json()
-        
-        if not ssh_info['success']:
-            return jsonify({'success': False, 'message': 'Impossible de récupérer les infos SSH'})
-        
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        
-        try:
-            ssh.connect(
-                hostname=ssh_info['host'],
-                port=ssh_info['port'],
-                username=ssh_info['username'],
-                password=ssh_info['password'],
-                timeout=10
-            )
-            
-            stdin, stdout, stderr = ssh.exec_command('whoami')
-            user_output = stdout.read().decode().strip()
-            
-            ssh.close()
-            
-            return jsonify({
-                'success': True,
-                'message': f'Connexion SSH réussie! Utilisateur: {user_output}',
-                'user': user_output
-            })
-            
-        except paramiko.AuthenticationException:
-            return jsonify({'success': False, 'message': 'Échec de l\'authentification SSH'})
-        except paramiko.SSHException as e:
-            return jsonify({'success': False, 'message': f'Erreur SSH: {str(e)}'})
-        except socket.timeout:
-            return jsonify({'success': False, 'message': 'Timeout de connexion'})
-        except Exception as e:
-            return jsonify({'success': False, 'message': f'Erreur de connexion: {str(e)}'})
-            
+        # Connexion du pool : pas de nouvelle poignée de main si la VM a déjà répondu
+        exit_code, user_output, _ = ssh_pool.run(vm.id, vm_ssh_config(vm), 'whoami', timeout=10)
+        user_output = user_output.strip()
+        return jsonify({
+            'success': True,
+            'message': f'Connexion SSH réussie! Utilisateur: {user_output}',
+            'user': user_output
+        })
+    except SSHPoolError as e:
+        return jsonify({'success': False, 'message': str(e)})
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erreur lors du test SSH: {str(e)}'})
 
@@ -461,22 +835,134 @@ def start_ssh_session(vm_id):
     try:
         if vm.status != 'running':
             return jsonify({'success': False, 'message': 'La VM doit être en cours d\'exécution'})
-        
-        ssh_info_response = get_ssh_info(vm_id)
-        ssh_info = ssh_info_response.get_json()
-        
-        if not ssh_info['success']:
-            return jsonify({'success': False, 'message': 'Impossible de récupérer les infos SSH'})
-        
+        if not terminal_bridge.available:
+            return jsonify({'success': False, 'message': 'Terminal web indisponible (pip install websockets asyncssh)'})
+
+        ssh_config = vm_ssh_config(vm)
+        # Jeton à usage unique : le pont WebSocket n'a pas accès à la session Flask
         return jsonify({
             'success': True,
             'message': 'Session SSH prête',
-            'ssh_config': ssh_info
+            'ssh_config': {'success': True, **ssh_config},
+            'terminal': {
+                'token': terminal_bridge.issue_token(vm.id, ssh_config),
+                'port': terminal_bridge.port,
+                'path': '/terminal'
+            }
         })
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erreur lors du démarrage de la session SSH: {str(e)}'})
 
+@app.route('/api/vms/<int:vm_id>/provision', methods=['GET', 'POST'])
+def vm_provision(vm_id):
+    """État et journal du script de configuration (?after=<seq> : lignes suivantes) ; POST : le relancer"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Non connecté'})
+
+    vm = VM.query.get_or_404(vm_id)
+    if vm.user_id != session['user_id']:
+        return jsonify({'success': False, 'message': 'Non autorisé'})
+
+    if request.method == 'POST':
+        if not (vm.script or '').strip():
+            return jsonify({'success': False, 'message': 'Aucun script de configuration'})
+        if vm.status != 'running':
+            return jsonify({'success': False, 'message': 'La VM doit être en cours d\'exécution'})
+        if vm.provision_status in ('pending', 'running'):
+            return jsonify({'success': False, 'message': 'Script déjà en cours d\'exécution'})
+        provisioner.submit(vm)
+
+    log = provisioner.log(vm.id)
+    if log is not None:
+        lines, seq = log.since(request.args.get('after', 0, type=int)), log.seq
+    else:
+        # Exécution terminée, ou en cours dans un autre worker : journal recopié sur la VM
+        lines = [{'seq': i + 1, 'stream': 'stderr' if line.startswith('! ') else 'stdout',
+                  'text': line[2:] if line.startswith('! ') else line}
+                 for i, line in enumerate((vm.provision_log or '').splitlines())]
+        lines, seq = lines[request.args.get('after', 0, type=int):], len(lines)
+
+    return jsonify({
+        'success': True,
+        'status': vm.provision_status,
+        'exit_code': vm.provision_exit_code,
+        'started_at': vm.provision_started_at.isoformat() if vm.provision_started_at else None,
+        'finished_at': vm.provision_finished_at.isoformat() if vm.provision_finished_at else None,
+        'seq': seq,
+        'lines': lines
+    })
+
+def collect_vm_metrics(vm_name, vm_status, vm_storage=None, vm_node=LOCAL_NODE):
+    """Métriques d'une VM : instantané de l'échantillonneur, sinon collecte à la demande"""
+    global _on_demand_metrics
+
+    metrics_data = None
+    if vm_node != LOCAL_NODE:
+        # VM distante : l'agent du nœud répond depuis son propre échantillonneur
+        try:
+            collected = nodes.get(vm_node).vm_metrics(vm_name)
+            if collected.get('success'):
+                metrics_data = collected
+        except NodeError as e:
+            print(f"⚠️ Métriques de {vm_name} indisponibles: {e}")
+    else:
+        # Lecture de l'instantané partagé : aucun processus lancé par requête
+        metrics_data = metrics_sampler.get(vm_name)
+
+    if metrics_data is None and vm_node == LOCAL_NODE and metrics_sampler.available:
+        # La VM ne tourne pas : métriques à zéro
+        metrics_data = {
+            'cpu_usage': 0,
+            'memory_usage': 0,
+            'disk_usage': 0,
+            'network_usage': 0,
+            'is_running': False,
+            'timestamp': metrics_sampler.updated_at.isoformat()
+        }
+
+    if metrics_data is None and vm_node == LOCAL_NODE and vm_status == 'running':
+        # Pas encore d'échantillon : une seule collecte pour toutes les requêtes en attente
+        if _on_demand_metrics is None:
+            _on_demand_metrics = VirtualBoxMetrics()
+        collected = _on_demand_metrics.get_vm_metrics(vm_name)
+        if collected['success']:
+            metrics_data = collected
+
+    if metrics_data is None:
+        # VirtualBox ne répond pas : valeurs inconnues (None) plutôt qu'inventées
+        running = vm_status == 'running'
+        metrics_data = {
+            'cpu_usage': None if running else 0,
+            'memory_usage': None if running else 0,
+            'disk_usage': None if running else 0,
+            'network_usage': None if running else 0,
+            'is_running': running,
+            'timestamp': datetime.now().isoformat()
+        }
+
+    # Capacité du média inconnue : on compare à la taille demandée à la création
+    disk_used = metrics_data.get('disk_used_bytes')
+    disk_capacity = metrics_data.get('disk_capacity_bytes') or (vm_storage * 1024 ** 3 if vm_storage else None)
+    if disk_used and not metrics_data.get('disk_capacity_bytes') and disk_capacity:
+        metrics_data['disk_usage'] = round(min(disk_used / disk_capacity * 100, 100), 1)
+
+    return {
+        'success': True,
+        'metrics': {
+            'cpu_usage': metrics_data.get('cpu_usage', 0),
+            'memory_usage': metrics_data.get('memory_usage', 0),
+            'disk_usage': metrics_data.get('disk_usage', 0),
+            'network_usage': metrics_data.get('network_usage', 0),
+            'is_running': metrics_data.get('is_running', False),
+            'disk_used_bytes': disk_used,
+            'disk_capacity_bytes': disk_capacity,
+            'memory_source': metrics_data.get('memory_source'),
+            'guest': metrics_data.get('guest')
+        },
+        'timestamp': metrics_data.get('timestamp')
+    }
+
 # ✅ ROUTE MÉTRIQUES SIMPLIFIÉE (4 MÉTRIQUES SEULEMENT)
 @app.route('/api/vms/<int:vm_id>/metrics')
 def get_vm_metrics(vm_id):
@@ -487,64 +973,140 @@ def get_vm_metrics(vm_id):
     if vm.user_id != session['user_id']:
         return jsonify({'success': False, 'message': 'Non autorisé'})
 
-    try:
-        # Récupérer les métriques depuis metrics.py
-        result = subprocess.run(
-            [sys.executable, "metrics.py", vm.name],
-            capture_output=True,
-            text=True,
-            timeout=10,
-            encoding='utf-8'
-        )
-        
-        if result.returncode == 0 and result.stdout:
-            metrics_data = json.loads(result.stdout)
-            
-            return jsonify({
-                'success': True,
-                'metrics': {
-                    'cpu_usage': metrics_data.get('cpu_usage', 0),
-                    'memory_usage': metrics_data.get('memory_usage', 0),
-                    'disk_usage': metrics_data.get('disk_usage', 0),
-                    'network_usage': metrics_data.get('network_usage', 0),
-                    'is_running': metrics_data.get('is_running', False)
-                },
-                'timestamp': datetime.now().isoformat()
-            })
+    vm_name, vm_status, vm_storage, vm_node = vm.name, vm.status, vm.storage, vm.node
+    payload = metrics_cache.get_or_load(vm.id, lambda: collect_vm_metrics(vm_name, vm_status, vm_storage, vm_node))
+
+    # ETag sur le contenu : le navigateur revalide avec If-None-Match et reçoit un 304
+    response = jsonify(payload)
+    response.cache_control.private = True
+    response.cache_control.max_age = int(metrics_cache.ttl)
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/api/metrics')
+def get_fleet_metrics():
+    """Métriques et état de toutes les VMs de l'utilisateur (?vm=all ou ?vm=1,2,3), depuis l'instantané partagé"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Non connecté'})
+
+    query = VM.query.filter_by(user_id=session['user_id'])
+    selector = request.args.get('vm', 'all')
+    if selector != 'all':
+        ids = [int(item) for item in selector.split(',') if item.strip().isdigit()]
+        query = query.filter(VM.id.in_(ids))
+
+    # Une seule lecture de l'instantané : aucun processus lancé, quel que soit le nombre de VMs
+    snapshot = metrics_sampler.snapshot()
+    vms = []
+    for vm in query.order_by(VM.id).all():
+        if vm.node != LOCAL_NODE:
+            # Une requête à l'agent du nœud, mise en cache comme /api/vms/<id>/metrics
+            data = metrics_cache.get_or_load(
+                vm.id, lambda vm=vm: collect_vm_metrics(vm.name, vm.status, vm.storage, vm.node))['metrics']
         else:
-            # Métriques simulées en cas d'erreur
-            return jsonify({
-                'success': True,
-                'metrics': {
-                    'cpu_usage': round(random.uniform(5, 25), 1) if vm.status == 'running' else 0,
-                    'memory_usage': round(random.uniform(15, 45), 1) if vm.status == 'running' else 0,
-                    'disk_usage': round(random.uniform(10, 35), 1) if vm.status == 'running' else 0,
-                    'network_usage': round(random.uniform(0.1, 2.5), 2) if vm.status == 'running' else 0,
-                    'is_running': vm.status == 'running'
-                },
-                'timestamp': datetime.now().isoformat()
-            })
-            
-    except Exception as e:
-        # Métriques simulées en cas d'erreur
-        return jsonify({
-            'success': True,
-            'metrics': {
-                'cpu_usage': round(random.uniform(5, 25), 1) if vm.status == 'running' else 0,
-                'memory_usage': round(random.uniform(15, 45), 1) if vm.status == 'running' else 0,
-                'disk_usage': round(random.uniform(10, 35), 1) if vm.status == 'running' else 0,
-                'network_usage': round(random.uniform(0.1, 2.5), 2) if vm.status == 'running' else 0,
-                'is_running': vm.status == 'running'
-            },
-            'timestamp': datetime.now().isoformat()
+            data = snapshot.get(vm.name)
+        if data is None:
+            # Arrêtée d'après l'échantillonneur ; inconnue s'il n'a encore rien collecté
+            known = metrics_sampler.available or vm.status != 'running'
+            data = {field: 0 if known else None for field in METRIC_FIELDS}
+            data['is_running'] = not known
+        vms.append({
+            'id': vm.id,
+            'name': vm.name,
+            'status': vm.status,
+            'metrics': {field: data.get(field) for field in METRIC_FIELDS + ('is_running', 'memory_source')}
         })
 
+    response = jsonify({
+        'success': True,
+        'timestamp': metrics_sampler.updated_at.isoformat() if metrics_sampler.available else None,
+        'vms': vms
+    })
+    response.cache_control.private = True
+    response.cache_control.max_age = int(metrics_sampler.interval)
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/api/metrics/cache')
+def get_metrics_cache_stats():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Non connecté'})
+
+    return jsonify({'success': True, 'cache': metrics_cache.stats()})
+
+@app.route('/api/vms/<int:vm_id>/metrics/history')
+def get_vm_metrics_history(vm_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Non connecté'})
+
+    vm = VM.query.get_or_404(vm_id)
+    if vm.user_id != session['user_id']:
+        return jsonify({'success': False, 'message': 'Non autorisé'})
+
+    window = min(parse_window(request.args.get('window')), metrics_history.retention)
+    return jsonify({
+        'success': True,
+        'window': window,
+        'interval': metrics_history.interval,
+        'history': metrics_history.window(vm.name, window)
+    })
+
+@app.route('/api/vms/<int:vm_id>/metrics/range')
+def get_vm_metrics_range(vm_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Non connecté'})
+
+    vm = VM.query.get_or_404(vm_id)
+    if vm.user_id != session['user_id']:
+        return jsonify({'success': False, 'message': 'Non autorisé'})
+
+    metric = request.args.get('metric', 'cpu_usage')
+    if metric not in METRIC_FIELDS:
+        return jsonify({'success': False, 'message': f'Métrique inconnue: {metric}'})
+
+    # Plage : start/end en secondes epoch, ou une fenêtre relative (?window=7d)
+    end = request.args.get('end', type=float) or datetime.now().timestamp()
+    start = request.args.get('start', type=float) or end - parse_window(request.args.get('window'), 86400)
+    step = request.args.get('step', type=float)
+
+    return jsonify({
+        'success': True,
+        'metric': metric,
+        'start': start,
+        'end': end,
+        **metrics_store.query(vm.name, metric, start, end, step)
+    })
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Export OpenMetrics pour Prometheus"""
+    token = app.config['VMASTER_METRICS_TOKEN']
+    supplied = request.headers.get('Authorization', '')
+    if token and not hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+        return Response('Non autorisé\n', status=401, mimetype='text/plain')
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+@app.route('/api/events')
+def event_stream():
+    """Flux SSE de l'utilisateur : métriques et changements d'état de ses VMs"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Non connecté'}), 401
+
+    subscription = broker.subscribe(session['user_id'])
+    return Response(
+        broker.stream(subscription),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 def open_browser():
     # Ouvre automatiquement le navigateur sur ton IP locale
     webbrowser.open_new("http://127.0.0.1:5000")
 
 
 if __name__ == '__main__':
+    # Serveur de développement (un seul processus) ; en production : gunicorn -c gunicorn.conf.py wsgi:application
+    prepare_database()
     if not os.environ.get("WERKZEUG_RUN_MAIN"):
         Timer(1, open_browser).start()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,74 @@
+"""
+Temps de démarrage du CLI (creator.py, metrics.py) jusqu'à VBoxManage localisé.
+
+Chaque mesure lance un processus Python neuf, à froid (cache de la
+sonde `VBoxManage --version` supprimé, comme avant la mise en cache)
+puis à chaud (cache disque présent). Sans VirtualBox installé,
+fake_vboxmanage.py sert de binaire.
+
+Usage : python benchmarks/cli_startup.py [lancements]
+Code de sortie 1 si une médiane à chaud dépasse BUDGET_MS.
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from vboxmanage import find_vboxmanage  # noqa: E402
+
+# Budget de démarrage à chaud d'une commande du CLI (ms)
+BUDGET_MS = 150
+RUNS = 15
+
+COMMANDS = {
+    "creator.py": [sys.executable, os.path.join(ROOT, "creator.py")],
+    "metrics.py": [sys.executable, "-c", "import metrics; assert metrics.VirtualBoxMetrics().vboxmanage_path"],
+}
+
+
+def run_once(command: list, env: dict) -> float:
+    started = time.perf_counter()
+    subprocess.run(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, check=True)
+    return (time.perf_counter() - started) * 1000
+
+
+def measure(command: list, env: dict, runs: int, cold: bool) -> list:
+    timings = []
+    for _ in range(runs):
+        if cold and os.path.exists(env["VMASTER_VBOXMANAGE_CACHE"]):
+            os.remove(env["VMASTER_VBOXMANAGE_CACHE"])
+        timings.append(run_once(command, env))
+    return timings
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else RUNS
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env["VMASTER_VBOXMANAGE_CACHE"] = os.path.join(tmp, "vboxmanage.json")
+        found = find_vboxmanage()
+        if found is None:
+            env["VMASTER_VBOXMANAGE"] = os.path.join(ROOT, "fake_vboxmanage.py")
+            env["VMASTER_FAKE_VBOX_HOME"] = tmp
+        binary = found.path if found else env["VMASTER_VBOXMANAGE"]
+        print(f"VBoxManage : {binary}  ({runs} lancements, budget à chaud {BUDGET_MS} ms)")
+
+        over_budget = False
+        for name, command in COMMANDS.items():
+            run_once(command, env)  # Préchauffage : fichiers en cache de l'OS, cache de la sonde rempli
+            cold = statistics.median(measure(command, env, runs, cold=True))
+            warm = statistics.median(measure(command, env, runs, cold=False))
+            status = "OK" if warm <= BUDGET_MS else "HORS BUDGET"
+            over_budget |= warm > BUDGET_MS
+            print(f"{name:>11}  froid {cold:7.1f} ms   chaud {warm:7.1f} ms   "
+                  f"gain {cold - warm:6.1f} ms   {status}")
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
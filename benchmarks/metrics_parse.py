@@ -0,0 +1,71 @@
+"""
+Micro-benchmark du parseur de 'VBoxManage metrics query'.
+
+Les sorties enregistrées de benchmarks/samples/ sont dupliquées pour
+simuler une flotte de N VMs (objets renommés vm-0001, vm-0002, ...),
+puis analysées et résumées comme le fait MetricsSampler.
+
+Usage : python benchmarks/metrics_parse.py [nombre de VMs ...]
+"""
+import glob
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from metrics import parse_metrics_query, summarize_vm  # noqa: E402
+
+SAMPLES = os.path.join(ROOT, "benchmarks", "samples", "metrics_query_*.txt")
+REPEAT = 20
+
+
+def load_vm_blocks(path: str):
+    """En-tête et lignes de chaque VM d'une sortie enregistrée (l'hôte est ignoré)"""
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    header, rows = lines[:2], lines[2:]
+    parsed = parse_metrics_query("\n".join(lines))
+    blocks = []
+    for name in parsed:
+        if name == "host":
+            continue
+        blocks.append([row[len(name):] for row in rows if row.startswith(name + " ")])
+    return header, blocks
+
+
+def build_fleet(header, blocks, count: int) -> str:
+    lines = list(header)
+    for i in range(count):
+        block = blocks[i % len(blocks)]
+        name = f"vm-{i + 1:04d}"
+        lines.extend(f"{name:<15}{row}" for row in block)
+    return "\n".join(lines)
+
+
+def bench(output: str) -> float:
+    timings = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        for values in parse_metrics_query(output).values():
+            summarize_vm(values, 2048)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [1, 10, 100, 500]
+    for path in sorted(glob.glob(SAMPLES)):
+        header, blocks = load_vm_blocks(path)
+        print(f"📄 {os.path.basename(path)} ({len(blocks)} VMs enregistrées)")
+        for count in counts:
+            output = build_fleet(header, blocks, count)
+            elapsed = bench(output)
+            print(f"   {count:>5} VMs  {output.count(chr(10)) - 1:>6} lignes  "
+                  f"{elapsed * 1000:8.2f} ms  ({elapsed / count * 1e6:6.1f} µs/VM)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import threading
+import time
+
+
+class _Flight:
+    """Chargement en cours d'une clé, partagé par toutes les requêtes qui l'attendent"""
+
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """
+    Cache mémoire à durée de vie courte avec regroupement des requêtes.
+
+    Pour une clé absente ou expirée, un seul appelant exécute le
+    chargement ; les appels simultanés pour la même clé attendent son
+    résultat au lieu de relancer VBoxManage.
+    """
+
+    def __init__(self, ttl: float = 2, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, loader):
+        """Valeur en cache pour `key`, sinon résultat de loader() (un seul appel à la fois)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+            with self._lock:
+                if len(self._entries) >= self.max_entries:
+                    self._purge()
+                self._entries[key] = (time.monotonic() + self.ttl, flight.value)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def _purge(self):
+        """Retire les entrées expirées puis, si le cache reste plein, celles qui expirent le plus tôt"""
+        now = time.monotonic()
+        entries = {key: entry for key, entry in self._entries.items() if entry[0] > now}
+        excess = len(entries) - self.max_entries + 1
+        if excess > 0:
+            for key in sorted(entries, key=lambda key: entries[key][0])[:excess]:
+                del entries[key]
+        self._entries = entries
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests = self.hits + self.misses + self.coalesced
+            return {
+                'ttl': self.ttl,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'hit_rate': round((self.hits + self.coalesced) / requests, 3) if requests else None
+            }
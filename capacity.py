@@ -0,0 +1,153 @@
+import os
+from typing import Optional
+
+from database import db
+from models import VM
+from nodes import LOCAL_NODE, NodeError, nodes, read_host_resources
+from shared_state import shared_state
+
+GB = 1024 ** 3
+
+# États dans lesquels une VM occupe CPU et RAM de l'hôte
+ACTIVE_STATUSES = ('running', 'starting', 'stopping')
+
+
+class CapacityModel:
+    """
+    Contrôle d'admission selon la capacité de l'hôte.
+
+    Capacité = ressources de l'hôte × taux de surallocation ; engagé =
+    somme des ressources déclarées dans la table VM (CPU et RAM des VMs
+    actives, disque de toutes les VMs). Une création ou un démarrage qui
+    dépasse la marge restante est refusé avec un message explicite.
+    Chaque nœud hyperviseur a sa propre capacité et ses propres VMs.
+    """
+
+    def __init__(self, app=None):
+        self.cpu_overcommit = 4.0
+        self.ram_overcommit = 1.0
+        self.disk_overcommit = 1.5
+        self.reserved_ram_gb = 2.0
+        self.storage_path = os.getcwd()
+        # Vérification + changement d'état atomiques entre tous les workers
+        self.lock = shared_state.lock('capacity')
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.cpu_overcommit = app.config.get('VMASTER_CPU_OVERCOMMIT', self.cpu_overcommit)
+        self.ram_overcommit = app.config.get('VMASTER_RAM_OVERCOMMIT', self.ram_overcommit)
+        self.disk_overcommit = app.config.get('VMASTER_DISK_OVERCOMMIT', self.disk_overcommit)
+        self.reserved_ram_gb = app.config.get('VMASTER_HOST_RESERVED_RAM', self.reserved_ram_gb)
+        self.storage_path = app.config.get('VMASTER_VM_STORAGE_PATH') or self.storage_path
+        app.extensions['vmaster_capacity'] = self
+
+    def _committed(self, node: str = LOCAL_NODE, exclude_vm_id: Optional[int] = None) -> dict:
+        active = db.session.query(db.func.coalesce(db.func.sum(VM.cpu), 0), db.func.coalesce(db.func.sum(VM.ram), 0)) \
+            .filter(VM.node == node, VM.status.in_(ACTIVE_STATUSES))
+        if exclude_vm_id is not None:
+            active = active.filter(VM.id != exclude_vm_id)
+        cpu, ram = active.one()
+        storage = db.session.query(db.func.coalesce(db.func.sum(VM.storage), 0)).filter(VM.node == node).scalar()
+        return {"cpu": int(cpu), "ram_gb": float(ram), "storage_gb": float(storage)}
+
+    def _host_resources(self, node: str) -> dict:
+        if node == LOCAL_NODE:
+            return read_host_resources(self.storage_path)
+        try:
+            return nodes.get(node).host_resources()
+        except NodeError as e:
+            # Nœud injoignable : aucune capacité connue, l'admission y est refusée
+            print(f"⚠️ {e}")
+            return {"cores": 0, "ram_total": 0, "ram_available": 0, "disk_total": 0, "disk_free": 0}
+
+    def headroom(self, node: str = LOCAL_NODE, exclude_vm_id: Optional[int] = None) -> dict:
+        """Capacité, engagement et marge restante (None si la ressource est illisible)"""
+        host = self._host_resources(node)
+        committed = self._committed(node, exclude_vm_id)
+
+        cpu_capacity = host["cores"] * self.cpu_overcommit if host["cores"] else None
+        ram_capacity = max(host["ram_total"] / GB - self.reserved_ram_gb, 0) * self.ram_overcommit \
+            if host["ram_total"] else None
+        disk_capacity = host["disk_total"] / GB * self.disk_overcommit if host["disk_total"] else None
+
+        disk_headroom = None
+        if disk_capacity is not None:
+            # Le disque peut aussi être rempli par d'autres fichiers que les VMs
+            disk_headroom = min(disk_capacity - committed["storage_gb"], host["disk_free"] / GB * self.disk_overcommit)
+
+        return {
+            "node": node,
+            "host": {
+                "cores": host["cores"],
+                "ram_total_gb": round(host["ram_total"] / GB, 1) if host["ram_total"] else None,
+                "ram_available_gb": round(host["ram_available"] / GB, 1) if host["ram_available"] else None,
+                "disk_total_gb": round(host["disk_total"] / GB, 1) if host["disk_total"] else None,
+                "disk_free_gb": round(host["disk_free"] / GB, 1) if host["disk_free"] else None,
+            },
+            "overcommit": {"cpu": self.cpu_overcommit, "ram": self.ram_overcommit, "disk": self.disk_overcommit},
+            "committed": committed,
+            "headroom": {
+                "cpu": int(cpu_capacity - committed["cpu"]) if cpu_capacity is not None else None,
+                "ram_gb": round(ram_capacity - committed["ram_gb"], 1) if ram_capacity is not None else None,
+                "storage_gb": round(disk_headroom, 1) if disk_headroom is not None else None,
+            },
+            # Taille maximale d'une VM : bornée par l'hôte, pas par la surallocation
+            "max_vm": {
+                "cpu": host["cores"],
+                "ram_gb": round(max(host["ram_total"] / GB - self.reserved_ram_gb, 0), 1) if host["ram_total"] else None,
+            }
+        }
+
+    def check_create(self, cpu: int, ram_gb: float, storage_gb: float, node: str = LOCAL_NODE) -> Optional[str]:
+        """Message d'erreur si la VM ne peut pas être créée sur ce nœud, sinon None"""
+        return self._check_create(self.headroom(node), cpu, ram_gb, storage_gb)
+
+    @staticmethod
+    def _check_create(capacity: dict, cpu: int, ram_gb: float, storage_gb: float) -> Optional[str]:
+        max_vm, headroom = capacity["max_vm"], capacity["headroom"]
+        if max_vm["cpu"] is not None and cpu > max_vm["cpu"]:
+            return f"L'hôte n'a que {max_vm['cpu']} cœurs : impossible de créer une VM à {cpu} CPU"
+        if max_vm["ram_gb"] is not None and ram_gb > max_vm["ram_gb"]:
+            return f"L'hôte ne peut pas allouer plus de {max_vm['ram_gb']} Go de RAM à une VM"
+        if headroom["storage_gb"] is not None and storage_gb > headroom["storage_gb"]:
+            return f"Espace disque insuffisant : {max(headroom['storage_gb'], 0)} Go disponibles, {storage_gb} Go demandés"
+        return None
+
+    def check_start(self, vm) -> Optional[str]:
+        """Message d'erreur si la VM ne peut pas démarrer sans surcharger l'hôte, sinon None"""
+        headroom = self.headroom(vm.node, exclude_vm_id=vm.id)["headroom"]
+        if headroom["cpu"] is not None and vm.cpu > headroom["cpu"]:
+            return f"CPU insuffisants : {max(headroom['cpu'], 0)} vCPU disponibles, {vm.cpu} demandés"
+        if headroom["ram_gb"] is not None and vm.ram > headroom["ram_gb"]:
+            return f"RAM insuffisante : {max(headroom['ram_gb'], 0)} Go disponibles, {vm.ram} Go demandés"
+        return None
+
+    def place(self, cpu: int, ram_gb: float, storage_gb: float):
+        """
+        Choisit le nœud d'une nouvelle VM : parmi ceux où elle tient, celui
+        qui garde le plus de RAM libre (puis de CPU). Retourne (nœud, None)
+        ou (None, message du refus sur le nœud local).
+        """
+        candidates, refusals = [], {}
+        for name in nodes.names():
+            capacity = self.headroom(name)
+            refusal = self._check_create(capacity, cpu, ram_gb, storage_gb)
+            headroom = capacity["headroom"]
+            if refusal is None and headroom["ram_gb"] is not None and ram_gb > headroom["ram_gb"]:
+                refusal = f"RAM insuffisante sur {name}"
+            if refusal is None and headroom["cpu"] is not None and cpu > headroom["cpu"]:
+                refusal = f"CPU insuffisants sur {name}"
+            if refusal:
+                refusals[name] = refusal
+                continue
+            ram_left = (headroom["ram_gb"] if headroom["ram_gb"] is not None else float("inf")) - ram_gb
+            cpu_left = (headroom["cpu"] if headroom["cpu"] is not None else float("inf")) - cpu
+            candidates.append((ram_left, cpu_left, name))
+        if not candidates:
+            message = refusals.get(LOCAL_NODE) or next(iter(refusals.values()), "Aucun nœud disponible")
+            return None, message
+        return max(candidates)[2], None
+
+
+capacity = CapacityModel()
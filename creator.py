@@ -1,26 +1,113 @@
 import subprocess
 import sys
 import os
-import sqlite3
+import time
 from typing import Optional
+from inventory import get_inventory
+from telemetry import vboxmanage_call
+from vboxmanage import find_vboxmanage
+
+# Bibliothèque de modèles : une VM de base par OS, figée par un snapshot
+TEMPLATE_PREFIX = "vmaster-base-"
+TEMPLATE_SNAPSHOT = "golden"
+
+# Délais maximums d'attente des changements d'état (secondes)
+STATE_TIMEOUT = float(os.environ.get("VMASTER_STATE_TIMEOUT", 30))
+STOP_TIMEOUT = float(os.environ.get("VMASTER_STOP_TIMEOUT", 30))
+SSH_READY_TIMEOUT = float(os.environ.get("VMASTER_SSH_READY_TIMEOUT", 180))
+
+# Adresse d'écoute des redirections SSH sur l'hôte : 127.0.0.1 par défaut,
+# l'adresse du nœud (ou 0.0.0.0) sur un nœud distant joint par VMaster
+SSH_BIND_ADDRESS = os.environ.get("VMASTER_SSH_BIND", "127.0.0.1")
+SSH_PROBE_HOST = "127.0.0.1" if SSH_BIND_ADDRESS in ("", "0.0.0.0") else SSH_BIND_ADDRESS
+
+STOPPED_STATES = {"poweroff", "saved", "aborted"}
+
+class ProvisioningPlan:
+    """
+    Plan de provisionnement d'une VM.
+
+    Les réglages modifyvm sont regroupés en lots (obligatoires puis
+    optionnels) envoyés en un seul appel VBoxManage chacun ; les étapes
+    de stockage restent des commandes distinctes, regroupées en fin de plan.
+    """
+
+    def __init__(self, vm_name: str):
+        self.vm_name = vm_name
+        self.steps = []
+        self._batches = {}
+
+    def command(self, label: str, args: list, required: bool = True):
+        """Ajoute une commande VBoxManage autonome"""
+        self.steps.append({"label": label, "args": args, "required": required, "settings": None})
+
+    def modify(self, label: str, flags: list, required: bool = True):
+        """Ajoute un réglage au lot modifyvm obligatoire ou optionnel"""
+        step = self._batches.get(required)
+        if step is None:
+            batch_label = "configuration matérielle" if required else "configurations supplémentaires"
+            step = {"label": batch_label, "args": None, "required": required, "settings": []}
+            self.steps.append(step)
+            self._batches[required] = step
+        step["settings"].append((label, flags))
+
+    def compile(self) -> list:
+        """Retourne la liste ordonnée (libellé, arguments VBoxManage) du plan"""
+        commands = []
+        for step in self.steps:
+            if step["settings"] is None:
+                commands.append((step["label"], step["args"]))
+            else:
+                args = ["modifyvm", self.vm_name]
+                for _, flags in step["settings"]:
+                    args.extend(flags)
+                commands.append((step["label"], args))
+        return commands
+
+    def describe(self, vboxmanage_path: str = "VBoxManage"):
+        """Affiche le plan compilé (mode --dry-run)"""
+        commands = self.compile()
+        print(f"\n🧾 Plan de provisionnement pour '{self.vm_name}':")
+        for i, (label, args) in enumerate(commands, 1):
+            print(f"   {i:2}. [{label}] {vboxmanage_path} {' '.join(args)}")
+        print(f"🧮 {len(commands)} appels VBoxManage")
+
+    def execute(self, run_command) -> None:
+        """
+        Exécute le plan avec run_command (VirtualBoxVMCreator._run_command).
+        Si un lot modifyvm échoue, ses réglages sont rejoués un par un
+        pour indiquer précisément lequel est en cause.
+        """
+        for step, (label, args) in zip(self.steps, self.compile()):
+            if run_command(args):
+                continue
+
+            if step["settings"] is None:
+                if step["required"]:
+                    raise Exception(f"Échec {label}")
+                print(f"⚠️  Impossible d'appliquer: {label}")
+                continue
+
+            print(f"⚠️  Lot '{label}' en échec, application réglage par réglage")
+            for setting_label, flags in step["settings"]:
+                if run_command(["modifyvm", self.vm_name] + flags):
+                    continue
+                if step["required"]:
+                    raise Exception(f"Échec {setting_label}")
+                print(f"⚠️  Impossible d'appliquer: {setting_label}")
+
 
 class VirtualBoxVMCreator:
-    def __init__(self):
-        self.vboxmanage_path = self._find_vboxmanage()
+    def __init__(self, vboxmanage_path: Optional[str] = None):
+        self.vboxmanage_path = vboxmanage_path or self._find_vboxmanage()
+        self.inventory = get_inventory(self.vboxmanage_path)
         
     def _find_vboxmanage(self) -> str:
-        possible_paths = [
-            "C:\\Program Files\\Oracle\\VirtualBox\\VBoxManage.exe"
-        ]
-        
-        for path in possible_paths:
-            try:
-                subprocess.run([path, "--version"], capture_output=True, check=True)
-                return path
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                continue
-        
-        raise Exception("VBoxManage non trouvé. Assurez-vous que VirtualBox est installé.")
+        # VMASTER_VBOXMANAGE, PATH puis emplacements habituels ; sonde --version en cache disque
+        found = find_vboxmanage()
+        if found is None:
+            raise Exception("VBoxManage non trouvé. Assurez-vous que VirtualBox est installé.")
+        return found.path
     
     def _get_os_template(self, os_type: str) -> dict:
         templates = {
@@ -42,61 +129,239 @@ class VirtualBoxVMCreator:
         return templates.get(os_type.lower(), templates["ubuntu"])
     
     def _run_command(self, command: list) -> bool:
-        try:
-            result = subprocess.run(
-                [self.vboxmanage_path] + command,
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            print(f"✓ {' '.join(command)}")
-            return True
-        except subprocess.CalledProcessError as e:
-            print(f"✗ {' '.join(command)}")
-            print(f"Erreur: {e.stderr}")
-            return False
+        with vboxmanage_call(command) as call:
+            try:
+                result = subprocess.run(
+                    [self.vboxmanage_path] + command,
+                    capture_output=True,
+                    text=True,
+                    check=True
+                )
+                print(f"✓ {' '.join(command)}")
+                return True
+            except subprocess.CalledProcessError as e:
+                call["ok"] = False
+                print(f"✗ {' '.join(command)}")
+                print(f"Erreur: {e.stderr}")
+                return False
     
     def _vm_exists(self, vm_name: str) -> bool:
+        return self.inventory.exists(vm_name)
+
+    def vm_exists(self, vm_name: str) -> bool:
+        return self._vm_exists(vm_name)
+
+    def _is_vm_running(self, vm_name: str) -> bool:
+        return self.inventory.is_running(vm_name)
+
+    def _vm_state(self, vm_name: str) -> Optional[str]:
+        """État VMState courant (running, poweroff, ...) via showvminfo --machinereadable"""
         try:
-            result = subprocess.run(
-                [self.vboxmanage_path, "list", "vms"],
-                capture_output=True, text=True
-            )
-            return f'"{vm_name}"' in result.stdout
-        except:
+            with vboxmanage_call(["showvminfo"]) as call:
+                result = subprocess.run(
+                    [self.vboxmanage_path, "showvminfo", vm_name, "--machinereadable"],
+                    capture_output=True, text=True, timeout=15
+                )
+                call["ok"] = result.returncode == 0
+        except (OSError, subprocess.SubprocessError):
+            return None
+        for line in result.stdout.splitlines():
+            if line.startswith("VMState="):
+                return line.split("=", 1)[1].strip().strip('"')
+        return None
+
+    def _wait_for_state(self, vm_name: str, states: set, timeout: float) -> Optional[str]:
+        """
+        Attend que la VM atteigne l'un des états demandés, avec un
+        intervalle de sondage croissant (0.25 s → 5 s). Retourne l'état
+        atteint, ou None à l'échéance.
+        """
+        deadline = time.monotonic() + timeout
+        delay = 0.25
+        while True:
+            state = self._vm_state(vm_name)
+            if state in states:
+                return state
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 5)
+
+    def wait_for_ssh(self, ssh_port: int, timeout: float = SSH_READY_TIMEOUT, host: str = SSH_PROBE_HOST) -> bool:
+        """
+        Attend que le serveur SSH du guest réponde sur le port redirigé.
+        La redirection NAT accepte la connexion TCP avant que le guest
+        n'écoute : seule la bannière "SSH-" prouve que le guest est prêt.
+        """
+        # Importé ici : seul le démarrage en a besoin, pas chaque lancement du CLI
+        import socket
+
+        deadline = time.monotonic() + timeout
+        delay = 0.5
+        while True:
+            try:
+                with socket.create_connection((host, ssh_port), timeout=3) as sock:
+                    sock.settimeout(3)
+                    if sock.recv(4) == b"SSH-":
+                        return True
+            except OSError:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 10)
+
+    def _template_name(self, os_type: str) -> str:
+        return f"{TEMPLATE_PREFIX}{os_type.lower()}"
+
+    def get_template(self, os_type: str) -> Optional[dict]:
+        """
+        Retourne le modèle prêt pour cet OS ({name, snapshot}),
+        ou None si la VM de base ou son snapshot n'existe pas
+        """
+        record = self.inventory.get(self._template_name(os_type))
+        if record is None or TEMPLATE_SNAPSHOT not in record["snapshots"]:
+            return None
+        return {"name": record["name"], "snapshot": TEMPLATE_SNAPSHOT}
+
+    def create_template(self, os_type: str, iso_path: Optional[str] = None,
+                        cpu_count: int = 2, ram_gb: int = 2, storage_gb: int = 20) -> bool:
+        """
+        Crée la VM de base d'un OS. L'OS doit ensuite y être installé
+        avant de la figer avec seal_template.
+        """
+        base_name = self._template_name(os_type)
+        if not self.create_vm(base_name, os_type, cpu_count, ram_gb, storage_gb, iso_path, "none"):
             return False
+        # Les clones reçoivent leur propre redirection SSH
+        self._run_command(["modifyvm", base_name, "--natpf1", "delete", "ssh"])
+        print(f"📀 Installez l'OS dans '{base_name}', arrêtez-la puis lancez: python creator.py template seal {os_type}")
+        return True
 
-    def _is_vm_running(self, vm_name: str) -> bool:
+    def seal_template(self, os_type: str) -> bool:
+        """Prend le snapshot de référence de la VM de base"""
+        base_name = self._template_name(os_type)
+        if not self._vm_exists(base_name):
+            print(f"❌ La VM de base '{base_name}' n'existe pas")
+            return False
+        if self._is_vm_running(base_name):
+            print(f"❌ Arrêtez '{base_name}' avant de la figer")
+            return False
+        
+        sealed = self._run_command(["snapshot", base_name, "take", TEMPLATE_SNAPSHOT,
+                                    "--description", "Modèle VMaster pour les clones liés"])
+        self.inventory.invalidate()
+        if sealed:
+            print(f"✅ Modèle '{base_name}' prêt (snapshot {TEMPLATE_SNAPSHOT})")
+        return sealed
+
+    def list_templates(self):
+        print("\n📚 Modèles:")
+        for record in self.inventory.all():
+            if record["name"].startswith(TEMPLATE_PREFIX):
+                ready = "✅ prêt" if TEMPLATE_SNAPSHOT in record["snapshots"] else "⏳ non figé"
+                print(f"   - {record['name']}: {ready}")
+
+    def _plan_optional_settings(self, plan: "ProvisioningPlan", secondary_network_type: Optional[str],
+                                graphics: str, vram) -> None:
+        """Ajoute au lot optionnel l'interface réseau 2 et les réglages d'affichage"""
+        # INTERFACE RÉSEAU 2: OPTIONNELLE
+        if secondary_network_type and secondary_network_type != "none":
+            print(f"📡 Interface réseau 2: {secondary_network_type} (optionnel)")
+            plan.modify(f"interface {secondary_network_type}", ["--nic2", secondary_network_type], required=False)
+            
+            if secondary_network_type == "bridged":
+                plan.modify("adaptateur bridge", ["--bridgeadapter2", "en0"], required=False)
+            elif secondary_network_type == "hostonly":
+                plan.modify("adaptateur host-only", ["--hostonlyadapter2", "VirtualBox Host-Only Ethernet Adapter"], required=False)
+            elif secondary_network_type == "natnetwork":
+                plan.modify("NatNetwork", ["--nat-network2", "NatNetwork"], required=False)
+        
+        plan.modify("contrôleur graphique", ["--graphicscontroller", graphics], required=False)
+        plan.modify("mémoire vidéo", ["--vram", str(vram)], required=False)
+        plan.modify("USB", ["--usb", "on", "--usbehci", "on"], required=False)
+        plan.modify("audio", ["--audio", "none"], required=False)
+        plan.modify("VRDE", ["--vrde", "off"], required=False)
+
+    def adopt_vm(self, pool_name: str, vm_name: str, cpu_count: int, ram_gb: int, vm_db_id: int,
+                 secondary_network_type: Optional[str] = None,
+                 graphics_controller: Optional[str] = None,
+                 vram_mb: Optional[str] = None) -> bool:
+        """
+        Attribue une VM pré-créée du pool : renommage et ressources
+        de l'utilisateur en deux modifyvm, sans reconstruire la VM
+        """
+        print(f"\n♻️  Attribution de la VM du pool '{pool_name}' → '{vm_name}'")
+        
+        if self._vm_exists(vm_name):
+            print(f"⚠️  La VM '{vm_name}' existe déjà")
+            return False
+        if not self._vm_exists(pool_name):
+            print(f"❌ La VM du pool '{pool_name}' n'existe pas")
+            return False
+        
+        ssh_host_port = 2200 + vm_db_id
+        
+        # Renommage et ressources sur l'ancien nom...
+        rename = ProvisioningPlan(pool_name)
+        rename.modify("renommage", ["--name", vm_name])
+        rename.modify("configuration mémoire", ["--memory", str(ram_gb * 1024)])
+        rename.modify("configuration CPU", ["--cpus", str(cpu_count)])
+        
+        # ... puis redirection SSH et options sur le nouveau nom
+        settings = ProvisioningPlan(vm_name)
+        settings.modify("suppression redirection SSH du pool", ["--natpf1", "delete", "ssh"], required=False)
+        settings.modify("redirection SSH", ["--natpf1", f"ssh,tcp,{SSH_BIND_ADDRESS},{ssh_host_port},10.0.2.15,22"], required=False)
+        self._plan_optional_settings(settings, secondary_network_type, graphics_controller or "vmsvga", vram_mb or "128")
+        
         try:
-            result = subprocess.run(
-                [self.vboxmanage_path, "list", "runningvms"],
-                capture_output=True, text=True
-            )
-            return f'"{vm_name}"' in result.stdout
-        except:
+            rename.execute(self._run_command)
+            settings.execute(self._run_command)
+            print(f"✅ VM '{vm_name}' prête (SSH: {SSH_BIND_ADDRESS}:{ssh_host_port})")
+            return True
+        except Exception as e:
+            print(f"❌ Erreur attribution VM: {e}")
             return False
+        finally:
+            self.inventory.invalidate()
 
     def create_vm(self, vm_name: str, os_type: str, cpu_count: int, ram_gb: int, 
                   storage_gb: int, iso_path: Optional[str] = None,
                   secondary_network_type: Optional[str] = None, 
                   graphics_controller: Optional[str] = None,
                   vram_mb: Optional[str] = None,
-                  vm_db_id: Optional[int] = None) -> bool:
+                  vm_db_id: Optional[int] = None,
+                  dry_run: bool = False,
+                  linked_clone: bool = False) -> bool:
         """
         Crée une machine virtuelle dans VirtualBox
+        (dry_run : affiche le plan VBoxManage sans rien exécuter,
+        linked_clone : clone lié du modèle de l'OS au lieu d'un disque vierge)
         """
         
         print(f"\n🎯 Création VM: {vm_name}")
         print(f"📋 {os_type}, {cpu_count} CPU, {ram_gb} Go RAM, {storage_gb} Go stockage")
         print(f"⚙️  Config: nat (obligatoire) + {secondary_network_type} (optionnel)")
 
-        if self._vm_exists(vm_name):
+        if not dry_run and self._vm_exists(vm_name):
             error_msg = f"La VM '{vm_name}' existe déjà"
             print(f"⚠️  {error_msg}")
             return False
         
         template = self._get_os_template(os_type)
         
+        base = None
+        if linked_clone:
+            base = self.get_template(os_type) if not dry_run else {
+                "name": self._template_name(os_type), "snapshot": TEMPLATE_SNAPSHOT
+            }
+            if base is None:
+                print(f"❌ Aucun modèle prêt pour {os_type} ({self._template_name(os_type)})")
+                return False
+            print(f"🧬 Clone lié de {base['name']} (snapshot {base['snapshot']})")
+        
         graphics = graphics_controller or "vmsvga"
         vram = vram_mb or "128"
         
@@ -115,101 +380,68 @@ class VirtualBoxVMCreator:
         
         vm_ip = "10.0.2.15"
         
-        try:
-            # 1. Créer la VM
-            if not self._run_command(["createvm", "--name", vm_name, "--register"]):
-                raise Exception("Échec création VM")
-            
-            # 2. Configurer l'OS
-            if not self._run_command(["modifyvm", vm_name, "--ostype", template["ostype"]]):
-                raise Exception("Échec configuration OS")
-            
-            # 3. Configurer la mémoire
-            ram_mb = ram_gb * 1024
-            if not self._run_command(["modifyvm", vm_name, "--memory", str(ram_mb)]):
-                raise Exception("Échec configuration mémoire")
-            
-            # 4. Configurer les CPUs
-            if not self._run_command(["modifyvm", vm_name, "--cpus", str(cpu_count)]):
-                raise Exception("Échec configuration CPU")
-            
-            # 5. INTERFACE RÉSEAU 1: NAT OBLIGATOIRE
-            print(f"\n📡 Configuration interface réseau 1 (NAT obligatoire)")
-            if not self._run_command(["modifyvm", vm_name, "--nic1", "nat"]):
-                raise Exception("Échec configuration interface nat")
-            
-            # 6. REDIRECTION PORT SSH
-            print(f"🔗 Configuration SSH: 127.0.0.1:{ssh_host_port} → {vm_ip}:22")
-            print(f"   - Source: {port_source}")
-            if not self._run_command(["modifyvm", vm_name, "--natpf1", f"ssh,tcp,127.0.0.1,{ssh_host_port},{vm_ip},22"]):
-                print("⚠️  Impossible de configurer la redirection SSH")
-            
-            # 7. INTERFACE RÉSEAU 2: OPTIONNELLE
-            if secondary_network_type and secondary_network_type != "none":
-                print(f"\n📡 Configuration interface réseau 2 ({secondary_network_type} optionnel)")
-                if not self._run_command(["modifyvm", vm_name, "--nic2", secondary_network_type]):
-                    print(f"⚠️  Impossible de configurer l'interface {secondary_network_type}")
-                
-                if secondary_network_type == "bridged":
-                    if not self._run_command(["modifyvm", vm_name, "--bridgeadapter2", "en0"]):
-                        print("⚠️  Impossible de configurer l'adaptateur bridge")
-                
-                elif secondary_network_type == "hostonly":
-                    if not self._run_command(["modifyvm", vm_name, "--hostonlyadapter2", "VirtualBox Host-Only Ethernet Adapter"]):
-                        print("⚠️  Impossible de configurer l'adaptateur host-only")
-                
-                elif secondary_network_type == "natnetwork":
-                    if not self._run_command(["modifyvm", vm_name, "--nat-network2", "NatNetwork"]):
-                        print("⚠️  Impossible de configurer NatNetwork")
-            
-            # 8. Créer le disque dur
+        # 1. Création de la VM (l'OS est fixé dès createvm)
+        plan = ProvisioningPlan(vm_name)
+        if base:
+            # Le clone partage le disque du modèle et n'écrit qu'une image différentielle
+            plan.command("clonage lié", ["clonevm", base["name"], "--snapshot", base["snapshot"],
+                                         "--options", "link", "--name", vm_name, "--register"])
+        else:
+            plan.command("création VM", ["createvm", "--name", vm_name, "--ostype", template["ostype"], "--register"])
+        
+        # 2. Réglages obligatoires : un seul modifyvm
+        ram_mb = ram_gb * 1024
+        plan.modify("configuration mémoire", ["--memory", str(ram_mb)])
+        plan.modify("configuration CPU", ["--cpus", str(cpu_count)])
+        # INTERFACE RÉSEAU 1: NAT OBLIGATOIRE
+        plan.modify("configuration interface nat", ["--nic1", "nat"])
+        
+        iso_attached = bool(not base and iso_path and os.path.exists(iso_path))
+        if iso_attached:
+            plan.modify("configuration boot", ["--boot1", "dvd", "--boot2", "disk"])
+        else:
+            plan.modify("configuration boot", ["--boot1", "disk"])
+        
+        # 3. Réglages optionnels : un second modifyvm
+        # REDIRECTION PORT SSH
+        print(f"🔗 Configuration SSH: {SSH_BIND_ADDRESS}:{ssh_host_port} → {vm_ip}:22")
+        print(f"   - Source: {port_source}")
+        plan.modify("redirection SSH", ["--natpf1", f"ssh,tcp,{SSH_BIND_ADDRESS},{ssh_host_port},{vm_ip},22"], required=False)
+        
+        self._plan_optional_settings(plan, secondary_network_type, graphics, vram)
+        
+        # 4. Stockage : disque, contrôleur SATA, ISO éventuel (hérités du modèle pour un clone lié)
+        if not base:
             storage_mb = storage_gb * 1024
             vdi_path = os.path.join(os.getcwd(), f"{vm_name}.vdi")
             
-            if not self._run_command(["createmedium", "disk", "--filename", vdi_path, 
-                                    "--size", str(storage_mb), "--format", "VDI"]):
-                raise Exception("Échec création disque")
-            
-            # 9. Attacher le contrôleur SATA
-            if not self._run_command(["storagectl", vm_name, "--name", "SATA Controller", 
-                                    "--add", "sata", "--controller", "IntelAHCI"]):
-                raise Exception("Échec configuration contrôleur SATA")
-            
-            # 10. Attacher le disque dur
-            if not self._run_command(["storageattach", vm_name, "--storagectl", "SATA Controller",
-                                    "--port", "0", "--device", "0", "--type", "hdd", 
-                                    "--medium", vdi_path]):
-                raise Exception("Échec attachement disque")
-            
-            # 11. Gérer l'ISO si fourni
-            if iso_path and os.path.exists(iso_path):
-                if not self._run_command(["storagectl", vm_name, "--name", "IDE Controller", 
-                                        "--add", "ide", "--controller", "PIIX4"]):
-                    raise Exception("Échec configuration contrôleur IDE")
-                
-                if not self._run_command(["storageattach", vm_name, "--storagectl", "IDE Controller",
-                                        "--port", "0", "--device", "0", "--type", "dvddrive", 
-                                        "--medium", iso_path]):
-                    raise Exception("Échec attachement ISO")
-                
-                if not self._run_command(["modifyvm", vm_name, "--boot1", "dvd", "--boot2", "disk"]):
-                    raise Exception("Échec configuration boot")
-            else:
-                if not self._run_command(["modifyvm", vm_name, "--boot1", "disk"]):
-                    raise Exception("Échec configuration boot")
-            
-            # 12. Configurations supplémentaires
-            self._run_command(["modifyvm", vm_name, "--graphicscontroller", graphics])
-            self._run_command(["modifyvm", vm_name, "--vram", str(vram)])
-            self._run_command(["modifyvm", vm_name, "--usb", "on", "--usbehci", "on"])
-            self._run_command(["modifyvm", vm_name, "--audio", "none"])
-            self._run_command(["modifyvm", vm_name, "--vrde", "off"])
+            plan.command("création disque", ["createmedium", "disk", "--filename", vdi_path,
+                                             "--size", str(storage_mb), "--format", "VDI"])
+            plan.command("configuration contrôleur SATA", ["storagectl", vm_name, "--name", "SATA Controller",
+                                                           "--add", "sata", "--controller", "IntelAHCI"])
+            plan.command("attachement disque", ["storageattach", vm_name, "--storagectl", "SATA Controller",
+                                                "--port", "0", "--device", "0", "--type", "hdd",
+                                                "--medium", vdi_path])
+        
+        if iso_attached:
+            plan.command("configuration contrôleur IDE", ["storagectl", vm_name, "--name", "IDE Controller",
+                                                          "--add", "ide", "--controller", "PIIX4"])
+            plan.command("attachement ISO", ["storageattach", vm_name, "--storagectl", "IDE Controller",
+                                             "--port", "0", "--device", "0", "--type", "dvddrive",
+                                             "--medium", iso_path])
+        
+        if dry_run:
+            plan.describe(self.vboxmanage_path)
+            return True
+        
+        try:
+            plan.execute(self._run_command)
             
             print(f"\n✅ VM '{vm_name}' créée avec succès!")
             print(f"📊 Configuration réseau:")
             print(f"   - Interface 1: NAT (obligatoire)")
             print(f"   - IP VM: {vm_ip}")
-            print(f"   - SSH: 127.0.0.1:{ssh_host_port} → {vm_ip}:22")
+            print(f"   - SSH: {SSH_BIND_ADDRESS}:{ssh_host_port} → {vm_ip}:22")
             print(f"   - Port source: {port_source}")
             
             if secondary_network_type and secondary_network_type != "none":
@@ -218,6 +450,8 @@ class VirtualBoxVMCreator:
                 print(f"   - Interface 2: Aucune")
             
             print(f"🔧 Autres paramètres:")
+            if base:
+                print(f"   - Modèle: {base['name']} (snapshot {base['snapshot']}, clone lié)")
             print(f"   - CPU: {cpu_count}, RAM: {ram_gb}GB, Stockage: {storage_gb}GB")
             print(f"   - Graphics: {graphics}, VRAM: {vram}MB")
             
@@ -227,8 +461,14 @@ class VirtualBoxVMCreator:
             error_msg = str(e)
             print(f"❌ Erreur création VM: {error_msg}")
             return False
+        finally:
+            self.inventory.invalidate()
 
-    def start_vm(self, vm_name: str) -> bool:
+    def start_vm(self, vm_name: str, ssh_port: Optional[int] = None) -> bool:
+        """
+        Démarre la VM et attend l'état running ; si ssh_port est donné,
+        attend aussi que SSH réponde (voir wait_for_ssh)
+        """
         print(f"\n🚀 Démarrage de la VM: {vm_name}")
         
         if not self._vm_exists(vm_name):
@@ -237,22 +477,34 @@ class VirtualBoxVMCreator:
             return False
         
         try:
-            # Calcul simple du port pour l'affichage
-            simple_id = sum(ord(c) for c in vm_name) % 100 + 10
-            ssh_port = 2200 + simple_id
-            
-            if self._run_command(["startvm", vm_name, "--type", "headless"]):
-                print(f"✅ VM '{vm_name}' démarrée!")
-                print(f"📡 Accès SSH: ssh utilisateur@127.0.0.1 -p {ssh_port}")
-                print(f"🌐 IP VM: 10.0.2.15 (NAT)")
-                print(f"🔢 Port SSH estimé: {ssh_port}")
-                
-                import time
-                time.sleep(60)
-                
-                return True
+            if ssh_port is None:
+                # Calcul simple du port pour l'affichage
+                simple_id = sum(ord(c) for c in vm_name) % 100 + 10
+                ssh_port_hint = 2200 + simple_id
             else:
+                ssh_port_hint = ssh_port
+            
+            started_at = time.monotonic()
+            started = self._run_command(["startvm", vm_name, "--type", "headless"])
+            self.inventory.invalidate()
+            if not started:
                 raise Exception("Échec du démarrage")
+            
+            if self._wait_for_state(vm_name, {"running"}, STATE_TIMEOUT) is None:
+                raise Exception(f"La VM n'est pas passée à l'état running en {STATE_TIMEOUT:.0f}s")
+            self.inventory.invalidate()
+            
+            print(f"✅ VM '{vm_name}' démarrée!")
+            print(f"📡 Accès SSH: ssh utilisateur@127.0.0.1 -p {ssh_port_hint}")
+            print(f"🌐 IP VM: 10.0.2.15 (NAT)")
+            
+            if ssh_port is not None:
+                if self.wait_for_ssh(ssh_port):
+                    print(f"🔑 SSH prêt en {time.monotonic() - started_at:.1f}s")
+                else:
+                    print(f"⚠️  SSH ne répond pas après {SSH_READY_TIMEOUT:.0f}s")
+            
+            return True
                 
         except Exception as e:
             error_msg = str(e)
@@ -270,14 +522,16 @@ class VirtualBoxVMCreator:
         try:
             if self._run_command(["controlvm", vm_name, "acpipowerbutton"]):
                 print("✓ Signal d'arrêt envoyé (ACPI)")
-                import time
-                time.sleep(10)
                 
-                if self._is_vm_running(vm_name):
-                    print("⚠️  Forçage de l'arrêt...")
+                if self._wait_for_state(vm_name, STOPPED_STATES, STOP_TIMEOUT) is None:
+                    print(f"⚠️  Pas d'arrêt après {STOP_TIMEOUT:.0f}s, forçage de l'arrêt...")
                     if self._run_command(["controlvm", vm_name, "poweroff"]):
+                        if self._wait_for_state(vm_name, STOPPED_STATES, STATE_TIMEOUT) is None:
+                            raise Exception("La VM ne s'arrête pas")
                         print("✓ Arrêt forcé réussi")
             
+            self.inventory.invalidate()
+            
             print(f"✅ VM '{vm_name}' arrêtée avec succès!")
             return True
             
@@ -298,10 +552,11 @@ class VirtualBoxVMCreator:
             if self._is_vm_running(vm_name):
                 print("🛑 Arrêt de la VM en cours...")
                 self._run_command(["controlvm", vm_name, "poweroff"])
-                import time
-                time.sleep(5)
+                self._wait_for_state(vm_name, STOPPED_STATES, STATE_TIMEOUT)
             
-            if self._run_command(["unregistervm", vm_name, "--delete"]):
+            deleted = self._run_command(["unregistervm", vm_name, "--delete"])
+            self.inventory.invalidate()
+            if deleted:
                 vdi_file = f"{vm_name}.vdi"
                 if os.path.exists(vdi_file):
                     os.remove(vdi_file)
@@ -352,11 +607,21 @@ class VirtualBoxVMCreator:
             print(f"❌ La VM '{vm_name}' n'existe pas")
 
 def main():
+    dry_run = "--dry-run" in sys.argv
+    if dry_run:
+        sys.argv.remove("--dry-run")
+    linked_clone = "--linked" in sys.argv
+    if linked_clone:
+        sys.argv.remove("--linked")
+    
     try:
         creator = VirtualBoxVMCreator()
     except Exception as e:
-        print(f"❌ {e}")
-        sys.exit(1)
+        if not dry_run:
+            print(f"❌ {e}")
+            sys.exit(1)
+        # Le plan peut être affiché sans VirtualBox installé
+        creator = VirtualBoxVMCreator("VBoxManage")
     
     if len(sys.argv) > 1:
         action = sys.argv[1]
@@ -377,13 +642,15 @@ def main():
             
             success = creator.create_vm(
                 vm_name, os_type, cpu_count, ram_gb, storage_gb,
-                iso_path, network_type, graphics_controller, vram_mb, vm_db_id
+                iso_path, network_type, graphics_controller, vram_mb, vm_db_id,
+                dry_run=dry_run, linked_clone=linked_clone
             )
             sys.exit(0 if success else 1)
             
         elif action == "start" and len(sys.argv) >= 3:
             vm_name = sys.argv[2]
-            success = creator.start_vm(vm_name)
+            ssh_port = int(sys.argv[3]) if len(sys.argv) > 3 else None
+            success = creator.start_vm(vm_name, ssh_port)
             sys.exit(0 if success else 1)
             
         elif action == "stop" and len(sys.argv) >= 3:
@@ -405,15 +672,28 @@ def main():
         elif action == "list":
             creator.list_vms()
             
+        elif action == "template" and len(sys.argv) >= 3:
+            sub_action = sys.argv[2]
+            if sub_action == "create" and len(sys.argv) >= 4:
+                iso_path = sys.argv[4] if len(sys.argv) > 4 and sys.argv[4] else None
+                sys.exit(0 if creator.create_template(sys.argv[3], iso_path) else 1)
+            elif sub_action == "seal" and len(sys.argv) >= 4:
+                sys.exit(0 if creator.seal_template(sys.argv[3]) else 1)
+            else:
+                creator.list_templates()
+            
         else:
             print("Usage:")
             print("  Créer: python creator.py create <name> <os> <cpu> <ram> <storage> [iso] [network] [graphics] [vram] [vm_db_id]")
-            print("  Démarrer: python creator.py start <vm_name>")
+            print("  Plan seul: python creator.py create ... --dry-run")
+            print("  Clone lié: python creator.py create ... --linked")
+            print("  Démarrer: python creator.py start <vm_name> [ssh_port]")
             print("  Arrêter: python creator.py stop <vm_name>")
             print("  Supprimer: python creator.py delete <vm_name>")
             print("  Info: python creator.py info <vm_name>")
             print("  SSH Info: python creator.py ssh <vm_name>")
             print("  Lister: python creator.py list")
+            print("  Modèles: python creator.py template create <os> [iso] | template seal <os> | template list")
             print("\nCalcul du port SSH:")
             print("  - Port SSH = 2200 + ID_VM (depuis la base de données)")
             sys.exit(1)
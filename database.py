@@ -1,3 +1,35 @@
+import sqlite3
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 db = SQLAlchemy()
+
+# Réglages appliqués à chaque connexion SQLite (voir configure_sqlite)
+SQLITE_PRAGMAS = {
+    # Les lectures ne bloquent plus les écritures des workers (et inversement)
+    'journal_mode': 'WAL',
+    # Attente du verrou d'écriture au lieu de "database is locked" immédiat (ms)
+    'busy_timeout': 5000,
+    # Sûr en WAL : seul un arrêt brutal de l'OS peut perdre les dernières transactions
+    'synchronous': 'NORMAL',
+    'temp_store': 'MEMORY',
+}
+
+
+def configure_sqlite(app):
+    """Reprend VMASTER_SQLITE_BUSY_TIMEOUT / VMASTER_SQLITE_SYNCHRONOUS de la configuration"""
+    SQLITE_PRAGMAS['busy_timeout'] = app.config.get('VMASTER_SQLITE_BUSY_TIMEOUT', SQLITE_PRAGMAS['busy_timeout'])
+    SQLITE_PRAGMAS['synchronous'] = app.config.get('VMASTER_SQLITE_SYNCHRONOUS', SQLITE_PRAGMAS['synchronous'])
+
+
+@event.listens_for(Engine, "connect")
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    # Les autres bases (PostgreSQL...) gardent leurs propres réglages
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
@@ -0,0 +1,137 @@
+import itertools
+import json
+import queue
+import threading
+import time
+
+
+class Subscription:
+    """File bornée d'un abonné ; les plus anciens évènements sont perdus si le client est trop lent"""
+
+    def __init__(self, user_id: int, maxsize: int):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def put(self, message: str):
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+
+class EventBroker:
+    """
+    Diffusion d'évènements (Server-Sent Events) aux navigateurs connectés.
+
+    Un seul producteur (échantillonneur de métriques, file de jobs)
+    publie ; chaque onglet ouvert reçoit les évènements de son
+    utilisateur dans sa propre file bornée. Le coût côté serveur dépend
+    du nombre de VMs, pas du nombre d'onglets.
+
+    Avec plusieurs workers (share), un évènement publié dans un processus
+    est aussi écrit dans l'état partagé ; un thread de chaque processus
+    le relaie à ses propres onglets.
+    """
+
+    def __init__(self, queue_size: int = 100, heartbeat: float = 15, relay_interval: float = 0.25):
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self.relay_interval = relay_interval
+        self._subscribers = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._state = None
+        self._relay = None
+
+    def share(self, state):
+        """Relaie les évènements entre les processus workers via state (SharedState)"""
+        self._state = state
+
+    def subscribe(self, user_id: int) -> Subscription:
+        subscription = Subscription(user_id, self.queue_size)
+        with self._lock:
+            self._subscribers[id(subscription)] = subscription
+        self._ensure_relay()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscribers.pop(id(subscription), None)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def users(self) -> set:
+        """Utilisateurs ayant au moins un onglet abonné"""
+        with self._lock:
+            return {subscription.user_id for subscription in self._subscribers.values()}
+
+    def publish(self, user_id: int, event: str, data: dict, relay: bool = True):
+        """
+        Envoie un évènement à tous les onglets d'un utilisateur, y compris
+        ceux servis par les autres workers sauf si relay est faux
+        (évènement que chaque processus produit lui-même).
+        """
+        if relay and self._state is not None:
+            try:
+                self._state.append_event(user_id, event, data)
+            except Exception as e:
+                print(f"❌ Relais de l'évènement {event} impossible: {e}")
+        self._deliver(user_id, event, data)
+
+    def _deliver(self, user_id: int, event: str, data: dict):
+        with self._lock:
+            targets = [s for s in self._subscribers.values() if s.user_id == user_id]
+        if not targets:
+            return
+        message = f"id: {next(self._ids)}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+        for subscription in targets:
+            subscription.put(message)
+
+    def stream(self, subscription: Subscription):
+        """Générateur de la réponse text/event-stream ; se désabonne à la déconnexion"""
+        try:
+            # Délai de reconnexion conseillé au navigateur (ms)
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    yield subscription.queue.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    # Commentaire SSE : garde la connexion ouverte à travers les proxys
+                    yield ": ping\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+    # ------------------ Relais entre workers ------------------
+
+    def _ensure_relay(self):
+        # Démarré au premier abonné : un processus sans onglet ouvert n'a rien à relayer
+        with self._lock:
+            if self._state is None or self._relay is not None:
+                return
+            self._relay = threading.Thread(target=self._relay_loop, name="vmaster-events-relay", daemon=True)
+            self._relay.start()
+
+    def _relay_loop(self):
+        last_id = None
+        while True:
+            try:
+                if last_id is None:
+                    last_id = self._state.last_event_id()
+                last_id, events = self._state.events_after(last_id)
+                for user_id, event, data in events:
+                    self._deliver(user_id, event, data)
+            except Exception as e:
+                print(f"❌ Erreur relais des évènements: {e}")
+            time.sleep(self.relay_interval)
+
+
+broker = EventBroker()
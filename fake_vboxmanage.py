@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Faux VBoxManage pour tester VMaster sans VirtualBox (Linux).
+
+Implémente le sous-ensemble de commandes utilisé par creator.py,
+inventory.py et metrics.py ; l'état des VMs est conservé dans un
+fichier JSON sous VMASTER_FAKE_VBOX_HOME (un dossier par "nœud").
+
+Usage : VMASTER_VBOXMANAGE=/chemin/fake_vboxmanage.py python agent.py
+"""
+import fcntl
+import json
+import math
+import os
+import sys
+import time
+import uuid
+
+HOME = os.environ.get("VMASTER_FAKE_VBOX_HOME", os.path.expanduser("~/.vmaster-fake-vbox"))
+STATE_FILE = os.path.join(HOME, "state.json")
+STOPPED = "powered off"
+
+
+def fail(message: str, code: int = 1):
+    print(f"VBoxManage: error: {message}", file=sys.stderr)
+    sys.exit(code)
+
+
+def option(args: list, name: str, default=None):
+    """Valeur de '--name valeur' dans args"""
+    if name in args:
+        index = args.index(name)
+        if index + 1 < len(args):
+            return args[index + 1]
+    return default
+
+
+class State:
+    """État JSON verrouillé pendant toute la commande (fcntl)"""
+
+    def __enter__(self):
+        os.makedirs(HOME, exist_ok=True)
+        self._lock = open(STATE_FILE + ".lock", "w")
+        fcntl.flock(self._lock, fcntl.LOCK_EX)
+        try:
+            with open(STATE_FILE) as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {"vms": {}, "media": {}}
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            with open(STATE_FILE + ".tmp", "w") as f:
+                json.dump(self.data, f, indent=1)
+            os.replace(STATE_FILE + ".tmp", STATE_FILE)
+        fcntl.flock(self._lock, fcntl.LOCK_UN)
+        self._lock.close()
+
+    def find(self, name_or_uuid: str):
+        vms = self.data["vms"]
+        if name_or_uuid in vms:
+            return vms[name_or_uuid]
+        for vm in vms.values():
+            if vm["name"] == name_or_uuid:
+                return vm
+        return None
+
+    def require(self, name_or_uuid: str) -> dict:
+        vm = self.find(name_or_uuid)
+        if vm is None:
+            fail(f"Could not find a registered machine named '{name_or_uuid}'")
+        return vm
+
+
+def new_vm(name: str, ostype: str) -> dict:
+    return {"uuid": str(uuid.uuid4()), "name": name, "ostype": ostype, "memory": 512, "cpus": 1,
+            "state": STOPPED, "since": time.time(), "disks": [], "snapshots": []}
+
+
+# ------------------ Commandes ------------------
+
+def cmd_list(state, args):
+    vms = state.data["vms"].values()
+    if args[:1] == ["runningvms"]:
+        vms = [vm for vm in vms if vm["state"] == "running"]
+    if "-l" in args or "--long" in args:
+        for vm in vms:
+            print(f"Name:                        {vm['name']}")
+            print(f"Guest OS:                    {vm['ostype']}")
+            print(f"UUID:                        {vm['uuid']}")
+            print(f"Memory size:                 {vm['memory']}MB")
+            print(f"Number of CPUs:              {vm['cpus']}")
+            since = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(vm["since"]))
+            print(f"State:                       {vm['state']} (since {since}.000000000)")
+            for port, disk in enumerate(vm["disks"]):
+                print(f"SATA Controller ({port}, 0): {disk['path']} (UUID: {disk['uuid']})")
+            if vm["snapshots"]:
+                print("Snapshots:")
+                for snapshot in vm["snapshots"]:
+                    print(f"   Name: {snapshot['name']} (UUID: {snapshot['uuid']}) *")
+            print()
+    else:
+        for vm in vms:
+            print(f"\"{vm['name']}\" {{{vm['uuid']}}}")
+
+
+def cmd_createvm(state, args):
+    name = option(args, "--name")
+    if state.find(name):
+        fail(f"Machine settings file already exists for '{name}'")
+    vm = new_vm(name, option(args, "--ostype", "Other"))
+    state.data["vms"][vm["uuid"]] = vm
+    print(f"Virtual machine '{name}' is created and registered.\nUUID: {vm['uuid']}")
+
+
+def cmd_clonevm(state, args):
+    base = state.require(args[0])
+    snapshot = option(args, "--snapshot")
+    if snapshot and snapshot not in [s["name"] for s in base["snapshots"]]:
+        fail(f"Could not find a snapshot named '{snapshot}'")
+    name = option(args, "--name")
+    if state.find(name):
+        fail(f"Machine settings file already exists for '{name}'")
+    vm = new_vm(name, base["ostype"])
+    vm.update(memory=base["memory"], cpus=base["cpus"])
+    # Clone lié : une image différentielle vide qui pointe vers le disque du modèle
+    for disk in base["disks"]:
+        path = os.path.join(HOME, name, "Snapshots", f"{{{uuid.uuid4()}}}.vdi")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"\0" * 2 * 1024 * 1024)
+        medium = {"uuid": str(uuid.uuid4()), "path": path, "capacity_mb": disk["capacity_mb"]}
+        state.data["media"][medium["uuid"]] = medium
+        vm["disks"].append(medium)
+    state.data["vms"][vm["uuid"]] = vm
+    print("0%...10%...20%...30%...40%...50%...60%...70%...80%...90%...100%")
+    print(f"Machine has been successfully cloned as \"{name}\"")
+
+
+def cmd_modifyvm(state, args):
+    vm = state.require(args[0])
+    if vm["state"] == "running" and any(flag in args for flag in ("--memory", "--cpus", "--name")):
+        fail(f"The machine '{vm['name']}' is already locked for a session (or being unlocked)")
+    if "--name" in args:
+        new_name = option(args, "--name")
+        if state.find(new_name):
+            fail(f"Machine settings file already exists for '{new_name}'")
+        vm["name"] = new_name
+    if "--memory" in args:
+        vm["memory"] = int(option(args, "--memory"))
+    if "--cpus" in args:
+        vm["cpus"] = int(option(args, "--cpus"))
+
+
+def cmd_createmedium(state, args):
+    path = option(args, "--filename")
+    size = int(option(args, "--size", 1024))
+    if os.path.exists(path):
+        fail(f"Could not create the medium storage unit '{path}'")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # Disque dynamique : seules les métadonnées sont écrites
+    with open(path, "wb") as f:
+        f.write(b"\0" * 1024 * 1024)
+    medium = {"uuid": str(uuid.uuid4()), "path": path, "capacity_mb": size}
+    state.data["media"][medium["uuid"]] = medium
+    print(f"Medium created. UUID: {medium['uuid']}")
+
+
+def cmd_storageattach(state, args):
+    vm = state.require(args[0])
+    path = option(args, "--medium")
+    if option(args, "--type") != "hdd":
+        return
+    for medium in state.data["media"].values():
+        if medium["path"] == path:
+            vm["disks"].append(medium)
+            return
+    fail(f"Could not find file for the medium '{path}'")
+
+
+def cmd_snapshot(state, args):
+    vm = state.require(args[0])
+    if args[1:2] == ["take"]:
+        vm["snapshots"].append({"name": args[2], "uuid": str(uuid.uuid4())})
+        print(f"Snapshot taken. UUID: {vm['snapshots'][-1]['uuid']}")
+
+
+def cmd_startvm(state, args):
+    vm = state.require(args[0])
+    if vm["state"] == "running":
+        fail(f"The machine '{vm['name']}' is already locked by a session (or being locked or unlocked)")
+    vm.update(state="running", since=time.time())
+    print(f"VM \"{vm['name']}\" has been successfully started.")
+
+
+def cmd_controlvm(state, args):
+    vm = state.require(args[0])
+    if vm["state"] != "running":
+        fail(f"Machine '{vm['name']}' is not currently running")
+    if args[1] in ("poweroff", "acpipowerbutton", "savestate"):
+        vm.update(state=STOPPED if args[1] != "savestate" else "saved", since=time.time())
+
+
+def cmd_unregistervm(state, args):
+    vm = state.require(args[0])
+    if vm["state"] == "running":
+        fail(f"Cannot unregister the machine '{vm['name']}' while it is locked")
+    del state.data["vms"][vm["uuid"]]
+    if "--delete" in args:
+        for disk in vm["disks"]:
+            state.data["media"].pop(disk["uuid"], None)
+            try:
+                os.remove(disk["path"])
+            except OSError:
+                pass
+
+
+def cmd_showvminfo(state, args):
+    vm = state.require(args[0])
+    if "--machinereadable" in args:
+        state_name = {"running": "running", STOPPED: "poweroff", "saved": "saved"}[vm["state"]]
+        print(f"name=\"{vm['name']}\"\nUUID=\"{vm['uuid']}\"\nmemory={vm['memory']}\n"
+              f"cpus={vm['cpus']}\nVMState=\"{state_name}\"")
+    else:
+        print(f"Name:            {vm['name']}\nState:           {vm['state']}")
+
+
+def cmd_showmediuminfo(state, args):
+    key = args[-1]
+    for medium in state.data["media"].values():
+        if key in (medium["uuid"], medium["path"]):
+            size = os.path.getsize(medium["path"]) if os.path.exists(medium["path"]) else 0
+            print(f"UUID:           {medium['uuid']}\nLocation:       {medium['path']}\n"
+                  f"Capacity:       {medium['capacity_mb']} MBytes\nSize on disk:   {size // 1024 ** 2} MBytes")
+            return
+    fail(f"Could not find file for the medium '{key}'")
+
+
+def cmd_metrics(state, args):
+    if args[:1] != ["query"]:
+        return
+    print("Object          Metric                                   Values")
+    print("--------------- ---------------------------------------- --------------------------------------------")
+    now = time.time()
+    for vm in state.data["vms"].values():
+        if vm["state"] != "running":
+            continue
+        # Valeurs pseudo-aléatoires mais stables pour une VM et un instant donnés
+        phase = (int(vm["uuid"][:8], 16) % 360) + now / 30
+        load = 20 + 15 * math.sin(phase)
+        rows = [
+            ("CPU/Load/User", f"{load:.2f}%"),
+            ("CPU/Load/Kernel", f"{load / 5:.2f}%"),
+            ("RAM/Usage/Used", f"{int(vm['memory'] * 1024 * (0.4 + 0.1 * math.cos(phase)))} kB"),
+            ("Net/Rate/Rx", f"{int(40000 + 30000 * math.sin(phase * 2))} B/s"),
+            ("Net/Rate/Tx", f"{int(8000 + 6000 * math.cos(phase * 2))} B/s"),
+        ]
+        for metric, value in rows:
+            print(f"{vm['name']:<15} {metric:<40} {value}")
+
+
+def cmd_guestproperty(state, args):
+    state.require(args[1])
+    # Pas de Guest Additions dans les fausses VMs
+    print("No properties found.")
+
+
+COMMANDS = {
+    "list": cmd_list,
+    "createvm": cmd_createvm,
+    "clonevm": cmd_clonevm,
+    "modifyvm": cmd_modifyvm,
+    "createmedium": cmd_createmedium,
+    "storagectl": lambda state, args: state.require(args[0]),
+    "storageattach": cmd_storageattach,
+    "snapshot": cmd_snapshot,
+    "startvm": cmd_startvm,
+    "controlvm": cmd_controlvm,
+    "unregistervm": cmd_unregistervm,
+    "showvminfo": cmd_showvminfo,
+    "showmediuminfo": cmd_showmediuminfo,
+    "metrics": cmd_metrics,
+    "guestproperty": cmd_guestproperty,
+}
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0] in ("--version", "-v"):
+        print("7.0.99_FAKEr0")
+        return
+    command = COMMANDS.get(args[0])
+    if command is None:
+        fail(f"Unknown command '{args[0]}'")
+    with State() as state:
+        command(state, args[1:])
+
+
+if __name__ == "__main__":
+    main()
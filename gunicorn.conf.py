@@ -0,0 +1,34 @@
+"""
+Configuration gunicorn (production, Linux) :
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+Plusieurs processus workers servent les requêtes ; la base SQL et
+l'état partagé (instance/state.db) les gardent cohérents, et un seul
+d'entre eux, le leader, fait tourner les services de fond.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('VMASTER_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('VMASTER_WEB_WORKERS', multiprocessing.cpu_count()))
+# Threads par worker : chaque onglet abonné au flux SSE en occupe un
+worker_class = 'gthread'
+threads = int(os.environ.get('VMASTER_WEB_THREADS', 32))
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
+# Pas de max_requests : un worker recyclé couperait les jobs VirtualBox qu'il exécute
+
+
+def on_starting(server):
+    # Processus maître, avant le fork des workers : une seule fois par démarrage
+    from app import prepare_database
+    prepare_database()
+
+
+def post_worker_init(worker):
+    # Élection du leader dès le démarrage du worker, sans attendre une requête
+    from app import start_background_services
+    start_background_services()
@@ -0,0 +1,115 @@
+import math
+import threading
+import time
+from array import array
+
+# Métriques conservées, telles que produites par VirtualBoxMetrics.get_vm_metrics
+METRIC_FIELDS = ("cpu_usage", "memory_usage", "disk_usage", "network_usage")
+
+
+class MetricRing:
+    """
+    Tampon circulaire de taille fixe pour une VM : une array('d') pour
+    les horodatages et une array('f') par métrique, allouées une fois.
+    Une métrique absente de l'échantillon (requête en échec, RAM ou
+    réseau pas encore remontés) est stockée en NaN et relue en None,
+    jamais comme un 0 mesuré.
+    """
+
+    __slots__ = ("capacity", "timestamps", "values", "_next", "_count")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.timestamps = array('d', [0.0]) * capacity
+        self.values = {field: array('f', [0.0]) * capacity for field in METRIC_FIELDS}
+        self._next = 0
+        self._count = 0
+
+    def append(self, timestamp: float, metrics: dict):
+        i = self._next
+        self.timestamps[i] = timestamp
+        for field in METRIC_FIELDS:
+            value = metrics.get(field)
+            self.values[field][i] = math.nan if value is None else value
+        self._next = (i + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    @property
+    def last_timestamp(self) -> float:
+        return self.timestamps[self._next - 1] if self._count else 0.0
+
+    @property
+    def nbytes(self) -> int:
+        return self.capacity * (self.timestamps.itemsize + len(METRIC_FIELDS) * array('f').itemsize)
+
+    def since(self, min_timestamp: float) -> dict:
+        """Points dont l'horodatage est >= min_timestamp, du plus ancien au plus récent"""
+        start = (self._next - self._count) % self.capacity
+        indexes = [(start + k) % self.capacity for k in range(self._count)]
+        indexes = [i for i in indexes if self.timestamps[i] >= min_timestamp]
+
+        result = {"timestamps": [round(self.timestamps[i], 3) for i in indexes]}
+        for field in METRIC_FIELDS:
+            column = self.values[field]
+            result[field] = [None if math.isnan(column[i]) else round(column[i], 2) for i in indexes]
+        return result
+
+
+class MetricsHistory:
+    """
+    Historique récent des métriques de chaque VM, en mémoire.
+
+    La capacité de chaque tampon est fixée par la rétention et
+    l'intervalle d'échantillonnage : la mémoire par VM est constante
+    (~24 octets par point). Les VMs absentes des échantillons depuis
+    plus d'une rétention sont oubliées.
+    """
+
+    def __init__(self, retention: float = 900, interval: float = 5):
+        self.retention = retention
+        self.interval = interval
+        self.capacity = max(int(math.ceil(retention / interval)), 1)
+        self._rings = {}
+        self._lock = threading.Lock()
+
+    def record(self, snapshot: dict, timestamp: float = None):
+        """Ajoute un échantillon de la flotte ({nom VM: métriques})"""
+        timestamp = timestamp or time.time()
+        with self._lock:
+            for name, metrics in snapshot.items():
+                ring = self._rings.get(name)
+                if ring is None:
+                    ring = self._rings[name] = MetricRing(self.capacity)
+                ring.append(timestamp, metrics)
+
+            expired = [name for name, ring in self._rings.items()
+                       if timestamp - ring.last_timestamp > self.retention]
+            for name in expired:
+                del self._rings[name]
+
+    def window(self, vm_name: str, seconds: float) -> dict:
+        """Points des `seconds` dernières secondes (listes vides si aucun)"""
+        seconds = min(seconds, self.retention)
+        with self._lock:
+            ring = self._rings.get(vm_name)
+            if ring is None:
+                return {"timestamps": [], **{field: [] for field in METRIC_FIELDS}}
+            return ring.since(time.time() - seconds)
+
+    def memory_bytes(self) -> int:
+        with self._lock:
+            return sum(ring.nbytes for ring in self._rings.values())
+
+
+def parse_window(value: str, default: float = 900) -> float:
+    """'30s', '15m', '1h', '7d' ou un nombre de secondes → secondes"""
+    if not value:
+        return default
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    value = value.strip().lower()
+    try:
+        if value[-1] in units:
+            return float(value[:-1]) * units[value[-1]]
+        return float(value)
+    except (ValueError, IndexError):
+        return default
@@ -0,0 +1,184 @@
+import os
+import re
+import subprocess
+import threading
+import time
+from typing import Optional
+
+from telemetry import vboxmanage_call
+
+# États VirtualBox pour lesquels la VM a un processus actif (équivalent de "list runningvms")
+RUNNING_STATES = {
+    "running", "paused", "stuck", "starting", "stopping", "saving",
+    "restoring", "teleporting", "livesnapshotting", "onlinesnapshotting",
+}
+
+_NAME_RE = re.compile(r"^Name:\s+(.*?)\s*$")
+_UUID_RE = re.compile(r"^UUID:\s+([0-9a-fA-F-]{36})\s*$")
+_STATE_RE = re.compile(r"^State:\s+(.+?)(?:\s+\(since .*\))?\s*$")
+# "Name: 'partage', Host path: ..." : ligne de dossier partagé, pas une nouvelle VM
+_SHARED_FOLDER_RE = re.compile(r"^'.*', Host path:")
+_MEMORY_RE = re.compile(r"^Memory size:\s+(\d+)\s*MB", re.IGNORECASE)
+_CPUS_RE = re.compile(r"^Number of CPUs:\s+(\d+)")
+# Disques attachés : "SATA Controller (0, 0): /chemin/vm.vdi (UUID: ...)" (VirtualBox 6)
+# ou "  Port 0, Unit 0: UUID: ..., Location: \"/chemin/vm.vdi\"" (VirtualBox 7)
+_ATTACHMENT_RE = re.compile(r"^.+? \(\d+, \d+\): (.+?) \(UUID: ([0-9a-fA-F-]{36})\)\s*$")
+_ATTACHMENT_V7_RE = re.compile(r"^\s*Port \d+, Unit \d+: UUID: ([0-9a-fA-F-]{36}), Location: \"(.+)\"\s*$")
+DISK_EXTENSIONS = (".vdi", ".vmdk", ".vhd", ".vhdx", ".hdd", ".qcow", ".qed")
+# Ligne indentée de l'arbre des snapshots : "   Name: golden (UUID: ...) *"
+_SNAPSHOT_RE = re.compile(r"^\s+Name:\s+(.+?)\s+\(UUID:\s+([0-9a-fA-F-]{36})\)")
+
+
+def _normalize_state(text: str) -> str:
+    """'powered off' → 'poweroff', 'guru meditation' → 'gurumeditation', etc."""
+    return text.strip().lower().replace("powered ", "power").replace(" ", "")
+
+
+def parse_vm_list(output: str) -> list:
+    """
+    Analyse la sortie de 'VBoxManage list -l vms' en une liste de
+    dictionnaires {name, uuid, state, memory_mb, cpus, disks, snapshots},
+    un par VM ; disks est la liste des disques durs attachés {uuid, path}.
+    """
+    records = []
+    current = None
+
+    for line in output.splitlines():
+        name_match = _NAME_RE.match(line)
+        if name_match and not _SHARED_FOLDER_RE.match(name_match.group(1)):
+            current = {"name": name_match.group(1), "uuid": None, "state": "unknown",
+                       "memory_mb": None, "cpus": None, "disks": [], "snapshots": []}
+            records.append(current)
+            continue
+
+        if current is None:
+            continue
+
+        uuid_match = _UUID_RE.match(line)
+        if uuid_match and current["uuid"] is None:
+            current["uuid"] = uuid_match.group(1).lower()
+            continue
+
+        state_match = _STATE_RE.match(line)
+        if state_match and current["state"] == "unknown":
+            current["state"] = _normalize_state(state_match.group(1))
+            continue
+
+        memory_match = _MEMORY_RE.match(line)
+        if memory_match and current["memory_mb"] is None:
+            current["memory_mb"] = int(memory_match.group(1))
+            continue
+
+        cpus_match = _CPUS_RE.match(line)
+        if cpus_match and current["cpus"] is None:
+            current["cpus"] = int(cpus_match.group(1))
+            continue
+
+        attachment_match = _ATTACHMENT_RE.match(line)
+        if attachment_match:
+            path, uuid = attachment_match.groups()
+        else:
+            attachment_match = _ATTACHMENT_V7_RE.match(line)
+            if attachment_match:
+                uuid, path = attachment_match.groups()
+        if attachment_match:
+            # Les images ISO et disquettes sont ignorées
+            if path.lower().endswith(DISK_EXTENSIONS):
+                current["disks"].append({"uuid": uuid.lower(), "path": path})
+            continue
+
+        snapshot_match = _SNAPSHOT_RE.match(line)
+        if snapshot_match:
+            current["snapshots"].append(snapshot_match.group(1))
+
+    return [record for record in records if record["uuid"]]
+
+
+class VMInventory:
+    """
+    Inventaire des VMs VirtualBox mis en cache.
+
+    Un seul 'list -l vms' alimente un index UUID → VM et un index
+    nom → UUID ; le cache expire après `ttl` secondes et doit être
+    invalidé explicitement après chaque opération de cycle de vie.
+    """
+
+    def __init__(self, vboxmanage_path: str, ttl: Optional[float] = None):
+        self.vboxmanage_path = vboxmanage_path
+        self.ttl = ttl if ttl is not None else float(os.environ.get("VMASTER_INVENTORY_TTL", 5))
+        self._by_uuid = {}
+        self._by_name = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            with vboxmanage_call(["list"]) as call:
+                result = subprocess.run(
+                    [self.vboxmanage_path, "list", "-l", "vms"],
+                    capture_output=True,
+                    text=True,
+                    encoding="utf-8",
+                    timeout=30
+                )
+                call["ok"] = result.returncode == 0
+            if result.returncode == 0:
+                records = parse_vm_list(result.stdout)
+                self._by_uuid = {record["uuid"]: record for record in records}
+                self._by_name = {record["name"]: record["uuid"] for record in records}
+            else:
+                print(f"⚠️  Inventaire VirtualBox indisponible: {result.stderr.strip()}")
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"⚠️  Inventaire VirtualBox indisponible: {e}")
+        # Même en cas d'échec, on attend le prochain TTL avant de réessayer
+        self._loaded_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+                self._refresh()
+
+    def invalidate(self):
+        """Force un rechargement au prochain accès"""
+        with self._lock:
+            self._loaded_at = None
+
+    def get(self, name_or_uuid: str) -> Optional[dict]:
+        """Retourne la VM par UUID ou par nom exact, ou None"""
+        self._ensure_fresh()
+        record = self._by_uuid.get(name_or_uuid.lower())
+        if record is None:
+            uuid = self._by_name.get(name_or_uuid)
+            record = self._by_uuid.get(uuid) if uuid else None
+        return record
+
+    def exists(self, name_or_uuid: str) -> bool:
+        return self.get(name_or_uuid) is not None
+
+    def state(self, name_or_uuid: str) -> Optional[str]:
+        record = self.get(name_or_uuid)
+        return record["state"] if record else None
+
+    def is_running(self, name_or_uuid: str) -> bool:
+        return self.state(name_or_uuid) in RUNNING_STATES
+
+    def all(self) -> list:
+        self._ensure_fresh()
+        return list(self._by_uuid.values())
+
+    def running(self) -> list:
+        return [record for record in self.all() if record["state"] in RUNNING_STATES]
+
+
+_inventories = {}
+_inventories_lock = threading.Lock()
+
+
+def get_inventory(vboxmanage_path: str) -> VMInventory:
+    """Inventaire partagé par tous les appelants du processus"""
+    with _inventories_lock:
+        inventory = _inventories.get(vboxmanage_path)
+        if inventory is None:
+            inventory = VMInventory(vboxmanage_path)
+            _inventories[vboxmanage_path] = inventory
+        return inventory
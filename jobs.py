@@ -0,0 +1,314 @@
+import json
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from database import db
+from models import Job, VM
+from nodes import LOCAL_NODE, nodes
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+
+
+class JobError(Exception):
+    """Échec métier d'un job (message affiché tel quel à l'utilisateur)"""
+
+
+class JobQueue:
+    """
+    File de jobs VirtualBox exécutée dans le processus Flask.
+
+    Un nombre borné de workers consomme la file et appelle les méthodes
+    de VirtualBoxVMCreator sur le nœud de la VM (directement en local, via
+    l'agent du nœud sinon) ; l'état de chaque job est
+    persisté dans la table Job (queued → running → succeeded/failed).
+
+    Avec plusieurs workers WSGI (share), seul le leader exécute les jobs :
+    les autres processus enregistrent la ligne Job, que le leader relève
+    toutes les poll_interval secondes. VMASTER_JOB_WORKERS borne ainsi
+    les opérations VirtualBox simultanées de tout le serveur.
+    """
+
+    def __init__(self, app=None, max_workers=4, poll_interval=1):
+        self.app = None
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self._is_leader = None
+        self._poller = None
+        self._stop = None
+        self._queue = queue.Queue()
+        # Jobs déjà dans la file de ce processus (pas de doublon lors d'une reprise)
+        self._queued_ids = set()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._handlers = {}
+        self._listeners = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.max_workers = app.config.get('VMASTER_JOB_WORKERS', self.max_workers)
+        self.poll_interval = app.config.get('VMASTER_JOB_POLL_INTERVAL', self.poll_interval)
+        app.extensions['vmaster_jobs'] = self
+
+    def share(self, is_leader):
+        """Mode multi-processus : les jobs ne s'exécutent que si is_leader()"""
+        self._is_leader = is_leader
+
+    def handler(self, action):
+        """Décorateur : enregistre la fonction qui exécute une action"""
+        def decorator(func):
+            self._handlers[action] = func
+            return func
+        return decorator
+
+    def add_listener(self, callback):
+        """callback(job, vm) est appelé à chaque changement d'état d'un job ou de sa VM"""
+        self._listeners.append(callback)
+
+    def notify(self, job, vm=None):
+        """Prévient les abonnés (état déjà commité en base)"""
+        for callback in self._listeners:
+            try:
+                callback(job, vm)
+            except Exception as e:
+                print(f"❌ Erreur abonné jobs: {e}")
+
+    def dispatch(self, action: str, creator, job, vm, params: dict):
+        """Exécute directement le handler d'une action (utilisé aussi en repli par d'autres handlers)"""
+        return self._handlers[action](creator, job, vm, params)
+
+    @property
+    def depth(self) -> int:
+        """Nombre de jobs en attente d'un worker"""
+        return self._queue.qsize()
+
+    def submit(self, action: str, vm=None, user_id=None, **params) -> Job:
+        """Enregistre un job en base puis le place dans la file"""
+        if action not in self._handlers:
+            raise ValueError(f"Action de job inconnue: {action}")
+
+        job = Job(
+            user_id=user_id if user_id is not None else (vm.user_id if vm else None),
+            vm_id=vm.id if vm else None,
+            action=action,
+            params=json.dumps(params),
+            status=JOB_QUEUED
+        )
+        db.session.add(job)
+        db.session.commit()
+        self.notify(job, vm)
+
+        # Hors du leader, la ligne en base suffit : le leader la relève (start)
+        if self._is_leader is None or self._is_leader():
+            self._enqueue([job.id])
+        return job
+
+    def fail_interrupted(self):
+        """
+        Au démarrage du serveur, avant tout worker : les jobs restés en
+        cours d'exécution ont été interrompus par l'arrêt, ils sont marqués en échec.
+        """
+        with self.app.app_context():
+            interrupted = Job.query.filter_by(status=JOB_RUNNING).all()
+            for job in interrupted:
+                job.status = JOB_FAILED
+                job.error = "Interrompu par un redémarrage du serveur"
+                job.finished_at = datetime.utcnow()
+            db.session.commit()
+
+    def requeue(self, older_than: float = 0) -> int:
+        """
+        Place dans la file de ce processus les jobs en attente en base
+        depuis plus de older_than secondes : laissés par un arrêt
+        précédent, ou soumis par un worker mort ou débordé. La prise
+        atomique du job empêche toute double exécution.
+        """
+        with self.app.app_context():
+            cutoff = datetime.utcnow() - timedelta(seconds=older_than)
+            pending = [job_id for (job_id,) in db.session.query(Job.id).filter(
+                Job.status == JOB_QUEUED, Job.created_at <= cutoff).order_by(Job.id).all()]
+        return self._enqueue(pending)
+
+    def _enqueue(self, job_ids: list) -> int:
+        with self._lock:
+            job_ids = [job_id for job_id in job_ids if job_id not in self._queued_ids]
+            self._queued_ids.update(job_ids)
+        if job_ids:
+            self._ensure_workers()
+            for job_id in job_ids:
+                self._queue.put(job_id)
+        return len(job_ids)
+
+    def start(self):
+        """Leader : relève en continu les jobs en attente en base (jusqu'à stop())"""
+        with self._lock:
+            if self._poller is not None:
+                return
+            self._stop = threading.Event()
+            self._poller = threading.Thread(target=self._poll_loop, args=(self._stop,),
+                                            name="vmaster-job-poll", daemon=True)
+            self._poller.start()
+
+    def stop(self):
+        """Le leader a perdu son bail : les jobs pas encore pris restent en base pour le suivant"""
+        with self._lock:
+            if self._poller is None:
+                return
+            self._stop.set()
+            self._poller = None
+        while True:
+            try:
+                job_id = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._queued_ids.discard(job_id)
+            self._queue.task_done()
+
+    def _poll_loop(self, stop: threading.Event):
+        while not stop.wait(self.poll_interval):
+            try:
+                self.requeue()
+            except Exception as e:
+                print(f"❌ Erreur relève des jobs: {e}")
+
+    # ------------------ Workers ------------------
+
+    def _ensure_workers(self):
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.max_workers):
+                worker = threading.Thread(target=self._worker_loop, name=f"vmaster-job-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _get_creator(self, node_name: str = LOCAL_NODE):
+        # Nœud local : VirtualBoxVMCreator est construit au premier appel
+        return nodes.get(node_name)
+
+    def _worker_loop(self):
+        while True:
+            job_id = self._queue.get()
+            with self._lock:
+                self._queued_ids.discard(job_id)
+            try:
+                with self.app.app_context():
+                    self._run(job_id)
+            except Exception as e:
+                print(f"❌ Erreur worker job {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id: int):
+        # Prise du job atomique : un seul worker (ou processus) peut le passer à running
+        claimed = Job.query.filter_by(id=job_id, status=JOB_QUEUED).update(
+            {'status': JOB_RUNNING, 'started_at': datetime.utcnow()}
+        )
+        db.session.commit()
+        if not claimed:
+            return
+
+        job = Job.query.get(job_id)
+
+        vm = VM.query.get(job.vm_id) if job.vm_id else None
+        params = json.loads(job.params) if job.params else {}
+
+        try:
+            self.dispatch(job.action, self._get_creator(vm.node if vm else LOCAL_NODE), job, vm, params)
+            job.status = JOB_SUCCEEDED
+        except Exception as e:
+            db.session.rollback()
+            job = Job.query.get(job_id)
+            vm = VM.query.get(job.vm_id) if job.vm_id else None
+            job.status = JOB_FAILED
+            job.error = str(e)
+            if vm is not None:
+                vm.status = 'error'
+            print(f"❌ Job {job.id} ({job.action}) en échec: {e}")
+
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        self.notify(job, vm)
+
+
+jobs = JobQueue()
+
+
+# ------------------ Actions ------------------
+
+@jobs.handler('create')
+def _create(creator, job, vm, params):
+    if vm is None:
+        raise JobError("VM introuvable")
+
+    # Clone lié si un modèle est prêt pour cet OS, sinon installation complète
+    base = creator.get_template(vm.os) if params.get('mode') == 'linked' else None
+    if params.get('mode') == 'linked' and base is None:
+        print(f"ℹ️ Aucun modèle prêt pour {vm.os}, installation complète")
+
+    if not creator.create_vm(
+        vm.name, vm.os, vm.cpu, vm.ram, vm.storage,
+        params.get('iso_path'), vm.network_type, vm.graphics_controller,
+        vm.vram, vm.id, linked_clone=base is not None
+    ):
+        raise JobError("Échec de la création de la VM")
+
+    if base:
+        vm.template_name = base['name']
+        vm.template_snapshot = base['snapshot']
+    vm.status = 'stopped'
+
+
+@jobs.handler('start')
+def _start(creator, job, vm, params):
+    if vm is None:
+        raise JobError("VM introuvable")
+    started_at = time.monotonic()
+    if not creator.start_vm(vm.name):
+        raise JobError("Échec du démarrage")
+    vm.status = 'running'
+    db.session.commit()
+
+    # Le temps boot → SSH se mesure hors du pool de workers : le job se termine ici
+    threading.Thread(target=_measure_boot, args=(jobs.app, creator, vm.id, vm.name, started_at),
+                     name=f"vmaster-boot-{vm.id}", daemon=True).start()
+
+
+def _measure_boot(app, creator, vm_id, vm_name, started_at):
+    """Attend la bannière SSH du guest puis enregistre boot_seconds"""
+    try:
+        if not creator.wait_for_ssh(2200 + vm_id):
+            return
+        boot_seconds = round(time.monotonic() - started_at, 1)
+        with app.app_context():
+            VM.query.filter_by(id=vm_id).update({'boot_seconds': boot_seconds})
+            db.session.commit()
+        print(f"🔑 {vm_name}: SSH prêt en {boot_seconds}s")
+    except Exception as e:
+        print(f"⚠️  {vm_name}: mesure du démarrage impossible: {e}")
+
+
+@jobs.handler('stop')
+def _stop(creator, job, vm, params):
+    if vm is None:
+        raise JobError("VM introuvable")
+    if not creator.stop_vm(vm.name):
+        raise JobError("Échec de l'arrêt")
+    vm.status = 'stopped'
+
+
+@jobs.handler('delete')
+def _delete(creator, job, vm, params):
+    if vm is None:
+        return
+    # VM jamais créée dans VirtualBox (ex: création en échec) : on retire juste la ligne
+    if creator.vm_exists(vm.name) and not creator.delete_vm(vm.name):
+        raise JobError("Échec de la suppression")
+    db.session.delete(vm)
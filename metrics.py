@@ -1,59 +1,356 @@
+import os
 import subprocess
 import sys
 import json
 import re
-import random
+import threading
+import time
 from datetime import datetime
+from typing import NamedTuple, Optional
+from inventory import get_inventory
+from telemetry import vboxmanage_call
+from vboxmanage import find_vboxmanage
+
+# Unités affichées par VBoxManage → (unité normalisée, facteur)
+UNITS = {
+    "%": ("%", 1.0),
+    "B": ("B", 1.0),
+    "kB": ("B", 1024.0),
+    "KB": ("B", 1024.0),
+    "MB": ("B", 1024.0 ** 2),
+    "GB": ("B", 1024.0 ** 3),
+    "B/s": ("B/s", 1.0),
+    "kB/s": ("B/s", 1024.0),
+    "KB/s": ("B/s", 1024.0),
+    "MB/s": ("B/s", 1024.0 ** 2),
+    "GB/s": ("B/s", 1024.0 ** 3),
+}
+
+# Ligne de 'metrics query' : objet (peut contenir des espaces et dépasser sa
+# colonne de 15 caractères), nom de métrique sans espace, puis les valeurs
+_QUERY_LINE_RE = re.compile(
+    r"^(\S.*?)\s+((?:Guest/)?(?:CPU|RAM|Net|Disk|Pagefile)/[\w/]+(?::\w+)?)\s+(.*?)\s*$"
+)
+_CAPACITY_RE = re.compile(r"^Capacity:\s+(\d+)\s*MBytes", re.MULTILINE)
+# Propriétés invitées (Guest Additions) : "Name: /VirtualBox/..., value: ..., timestamp: ..." (VirtualBox 6)
+# ou "/VirtualBox/... = 'valeur' @ 2024-..." (VirtualBox 7)
+_GUEST_PROPERTY_RE = re.compile(r"^Name: (/VirtualBox/\S+), value: (.*?), timestamp:")
+_GUEST_PROPERTY_V7_RE = re.compile(r"^(/VirtualBox/\S+)\s+=\s+'(.*)'(?: @ .*)?$")
+# Lecture des propriétés invitées, plus lente que l'échantillonnage (0 = désactivée)
+GUEST_INTERVAL = float(os.environ.get("VMASTER_GUEST_INTERVAL", 60))
+# Occupation disque : mesurée moins souvent que CPU/réseau (stat et showmediuminfo coûteux)
+DISK_INTERVAL = float(os.environ.get("VMASTER_DISK_INTERVAL", 300))
+_VALUE_RE = re.compile(r"(-?\d+(?:\.\d+)?)\s*([^\s,\d][^\s,]*)?")
+
+
+class MetricValue(NamedTuple):
+    """Valeur d'une métrique, convertie en unité normalisée (%, B, B/s)"""
+    value: float
+    unit: str
+    samples: tuple
+
+
+def parse_value(text: str) -> Optional[MetricValue]:
+    """'12.50%', '1048576 kB' ou '1.00%, 2.00%' → MetricValue (dernier échantillon)"""
+    samples = []
+    unit = ""
+    for number, raw_unit in _VALUE_RE.findall(text):
+        unit, factor = UNITS.get(raw_unit, (raw_unit, 1.0))
+        samples.append(float(number) * factor)
+    if not samples:
+        return None
+    return MetricValue(samples[-1], unit, tuple(samples))
+
+
+def parse_metrics_query(output: str) -> dict:
+    """
+    Analyse en une passe la sortie complète de 'VBoxManage metrics query'.
+
+    Retourne {objet: {(métrique, sous-métrique): MetricValue}}, où
+    l'objet est 'host' ou le nom d'une VM et la sous-métrique est
+    l'agrégat ('avg', 'min', 'max') ou None pour la dernière valeur.
+    """
+    result = {}
+    match = _QUERY_LINE_RE.match
+    for line in output.splitlines():
+        parts = match(line)
+        if parts is None:
+            continue
+        name, metric, values = parts.groups()
+        value = parse_value(values)
+        if value is None:
+            continue
+        base, _, submetric = metric.partition(":")
+        metrics = result.get(name)
+        if metrics is None:
+            metrics = result[name] = {}
+        metrics[(base, submetric or None)] = value
+    return result
+
+
+def _latest(values: dict, metric: str) -> Optional[float]:
+    entry = values.get((metric, None)) or values.get((metric, "avg"))
+    return entry.value if entry else None
+
+
+def summarize_vm(values: dict, memory_mb: Optional[float] = None) -> dict:
+    """
+    Les 4 métriques affichées à partir des valeurs typées d'une VM :
+    - CPU : CPU/Load/User + CPU/Load/Kernel (%)
+    - RAM : vue de l'invité (Guest/RAM/Usage, hors cache) si les Guest
+      Additions la publient, sinon RAM/Usage/Used rapporté à la mémoire
+      configurée de la VM (%)
+    - Réseau : Net/Rate/Rx + Net/Rate/Tx (MB/s)
+    Une métrique absente de la sortie vaut None.
+    """
+    summary = {"cpu_usage": None, "memory_usage": None, "network_usage": None,
+               "memory_source": None, "guest_cpu_usage": None, "guest_memory_usage": None}
+
+    user, kernel = _latest(values, "CPU/Load/User"), _latest(values, "CPU/Load/Kernel")
+    if user is not None or kernel is not None:
+        summary["cpu_usage"] = round(min((user or 0) + (kernel or 0), 100), 1)
+
+    used = _latest(values, "RAM/Usage/Used")
+    if used is not None and memory_mb:
+        summary["memory_usage"] = round(min(used / (memory_mb * 1024 ** 2) * 100, 100), 1)
+        summary["memory_source"] = "host"
+
+    # Métriques publiées par les Guest Additions (absentes sinon)
+    guest_user, guest_kernel = _latest(values, "Guest/CPU/Load/User"), _latest(values, "Guest/CPU/Load/Kernel")
+    if guest_user is not None or guest_kernel is not None:
+        summary["guest_cpu_usage"] = round(min((guest_user or 0) + (guest_kernel or 0), 100), 1)
+
+    total, free = _latest(values, "Guest/RAM/Usage/Total"), _latest(values, "Guest/RAM/Usage/Free")
+    if total and free is not None:
+        cache = _latest(values, "Guest/RAM/Usage/Cache") or 0
+        summary["guest_memory_usage"] = round(max(min((total - free - cache) / total * 100, 100), 0), 1)
+        summary["memory_usage"] = summary["guest_memory_usage"]
+        summary["memory_source"] = "guest"
+
+    rx, tx = _latest(values, "Net/Rate/Rx"), _latest(values, "Net/Rate/Tx")
+    if rx is not None or tx is not None:
+        summary["network_usage"] = round(((rx or 0) + (tx or 0)) / 1024 ** 2, 2)
+
+    return summary
+
+
+def _allocated_bytes(path: str) -> Optional[int]:
+    """Taille réellement occupée par un fichier (blocs alloués si disponibles)"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    blocks = getattr(st, "st_blocks", None)
+    return blocks * 512 if blocks is not None else st.st_size
+
+
+class DiskUsage:
+    """
+    Occupation des disques de chaque VM : taille réelle des fichiers
+    (os.stat) rapportée à la taille logique des médias (showmediuminfo).
+
+    Chaque VM est mesurée au plus une fois par `interval` secondes ; la
+    capacité d'un média est conservée aussi longtemps, puis relue pour
+    suivre les redimensionnements et les médias supprimés.
+    """
+
+    def __init__(self, collector, interval: float = DISK_INTERVAL):
+        self.collector = collector
+        self.interval = interval
+        self._usage = {}
+        self._capacity = {}
+        self._lock = threading.Lock()
+
+    def get(self, vm_name: str) -> dict:
+        """{disk_usage (%), disk_used_bytes, disk_capacity_bytes} de la VM"""
+        with self._lock:
+            cached = self._usage.get(vm_name)
+        if cached and time.monotonic() - cached[0] < self.interval:
+            return cached[1]
+
+        usage = self._measure(vm_name)
+        with self._lock:
+            self._usage[vm_name] = (time.monotonic(), usage)
+        return usage
+
+    def prune(self, vm_names: set):
+        """Oublie les VMs qui ne sont plus suivies"""
+        with self._lock:
+            for name in set(self._usage) - vm_names:
+                del self._usage[name]
+            expired = time.monotonic() - self.interval
+            self._capacity = {medium: entry for medium, entry in self._capacity.items() if entry[0] > expired}
+
+    def _measure(self, vm_name: str) -> dict:
+        record = self.collector.inventory.get(vm_name) if self.collector.inventory else None
+        disks = record.get("disks") if record else None
+        if not disks:
+            # Emplacement utilisé par creator.py pour les installations complètes
+            disks = [{"uuid": None, "path": os.path.join(os.getcwd(), f"{vm_name}.vdi")}]
+
+        used = capacity = 0
+        for disk in disks:
+            allocated = _allocated_bytes(disk["path"])
+            if allocated is None:
+                continue
+            used += allocated
+            capacity += self._medium_capacity(disk["uuid"] or disk["path"]) or 0
+
+        return {
+            "disk_usage": round(min(used / capacity * 100, 100), 1) if capacity else None,
+            "disk_used_bytes": used,
+            "disk_capacity_bytes": capacity
+        }
+
+    def _medium_capacity(self, medium: str) -> Optional[int]:
+        """Taille logique du média en octets (showmediuminfo), mise en cache `interval` secondes"""
+        with self._lock:
+            cached = self._capacity.get(medium)
+        if cached and time.monotonic() - cached[0] < self.interval:
+            return cached[1]
+
+        success, output = self.collector._run_command(["showmediuminfo", "disk", medium])
+        match = _CAPACITY_RE.search(output) if success and output else None
+        capacity = int(match.group(1)) * 1024 ** 2 if match else None
+        if capacity is not None:
+            with self._lock:
+                self._capacity[medium] = (time.monotonic(), capacity)
+        return capacity
+
+
+def parse_guest_properties(output: str) -> dict:
+    """Sortie de 'guestproperty enumerate' → {chemin: valeur}"""
+    properties = {}
+    for line in output.splitlines():
+        line = line.strip()
+        match = _GUEST_PROPERTY_RE.match(line) or _GUEST_PROPERTY_V7_RE.match(line)
+        if match:
+            properties[match.group(1)] = match.group(2)
+    return properties
+
+
+def summarize_guest(properties: dict) -> Optional[dict]:
+    """Informations utiles des Guest Additions, ou None si elles ne sont pas actives"""
+    version = properties.get("/VirtualBox/GuestAdd/Version")
+    if not version:
+        return None
+
+    addresses = []
+    for i in range(int(properties.get("/VirtualBox/GuestInfo/Net/Count") or 0)):
+        address = properties.get(f"/VirtualBox/GuestInfo/Net/{i}/V4/IP")
+        if address:
+            addresses.append(address)
+
+    users = properties.get("/VirtualBox/GuestInfo/OS/LoggedInUsers")
+    return {
+        "additions_version": version,
+        "os": properties.get("/VirtualBox/GuestInfo/OS/Product"),
+        "os_release": properties.get("/VirtualBox/GuestInfo/OS/Release"),
+        "ip_addresses": addresses,
+        "logged_in_users": int(users) if users and users.isdigit() else None
+    }
+
+
+class GuestProperties:
+    """
+    Propriétés invitées de chaque VM en cours d'exécution, lues par
+    'guestproperty enumerate' dans un thread séparé toutes les
+    `interval` secondes. Une VM sans Guest Additions vaut None.
+    """
+
+    def __init__(self, collector, interval: float = GUEST_INTERVAL):
+        self.collector = collector
+        self.interval = interval
+        self._guests = {}
+        self._lock = threading.Lock()
+        self._stop = None
+        self._thread = None
+
+    def start(self):
+        """Démarre la lecture périodique (une seule fois, jusqu'à stop())"""
+        with self._lock:
+            if self._thread is not None or self.interval <= 0:
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._loop, args=(self._stop,),
+                                            name="vmaster-guest", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Arrête la lecture (le leader a perdu son bail) ; start() la relance"""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._stop.set()
+            self._thread = None
+
+    def get(self, vm_name: str) -> Optional[dict]:
+        return self._guests.get(vm_name)
+
+    def _loop(self, stop: threading.Event):
+        while not stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"❌ Erreur lecture des propriétés invitées: {e}")
+            stop.wait(self.interval)
+
+    def refresh(self):
+        guests = {}
+        for record in self.collector.inventory.running():
+            success, output = self.collector._run_command(["guestproperty", "enumerate", record["uuid"]])
+            guests[record["name"]] = summarize_guest(parse_guest_properties(output)) if success and output else None
+        # Remplacement atomique, comme l'instantané des métriques
+        self._guests = guests
+
 
 class VirtualBoxMetrics:
     def __init__(self):
         self.vboxmanage_path = self._find_vboxmanage()
+        self.inventory = get_inventory(self.vboxmanage_path) if self.vboxmanage_path else None
+        self.disks = DiskUsage(self)
         
     def _find_vboxmanage(self) -> str:
-        """Trouve le chemin de VBoxManage"""
-        possible_paths = [
-            "C:\\Program Files\\Oracle\\VirtualBox\\VBoxManage.exe",
-            "VBoxManage.exe",
-            "/usr/bin/VBoxManage"
-        ]
-        
-        for path in possible_paths:
-            try:
-                subprocess.run([path, "--version"], capture_output=True, check=True, encoding='utf-8')
-                return path
-            except:
-                continue
-        return None
+        """Trouve le chemin de VBoxManage (sonde --version en cache disque, voir vboxmanage.py)"""
+        found = find_vboxmanage()
+        return found.path if found else None
     
     def _run_command(self, command: list):
         """Exécute une commande VBoxManage"""
         try:
-            result = subprocess.run(
-                [self.vboxmanage_path] + command,
-                capture_output=True,
-                text=True,
-                encoding='utf-8',
-                timeout=10
-            )
+            with vboxmanage_call(command) as call:
+                result = subprocess.run(
+                    [self.vboxmanage_path] + command,
+                    capture_output=True,
+                    text=True,
+                    encoding='utf-8',
+                    timeout=10
+                )
+                call["ok"] = result.returncode == 0
             return result.returncode == 0, result.stdout
         except:
             return False, None
     
     def _vm_exists(self, vm_name: str) -> bool:
         """Vérifie si la VM existe"""
-        try:
-            success, output = self._run_command(["list", "vms"])
-            return success and f'"{vm_name}"' in output
-        except:
-            return False
+        return self.inventory is not None and self.inventory.exists(vm_name)
 
     def _is_vm_running(self, vm_name: str) -> bool:
         """Vérifie si la VM est en cours d'exécution"""
-        try:
-            success, output = self._run_command(["list", "runningvms"])
-            return success and f'"{vm_name}"' in output
-        except:
-            return False
+        return self.inventory is not None and self.inventory.is_running(vm_name)
+
+    def _memory_mb(self, vm_name: str) -> Optional[float]:
+        """Mémoire configurée de la VM (MB), d'après l'inventaire"""
+        record = self.inventory.get(vm_name) if self.inventory else None
+        return record.get("memory_mb") if record else None
+
+    def _apply_summary(self, values: dict, vm_name: str, metrics: dict):
+        """Reporte dans `metrics` les valeurs mesurées de la VM"""
+        for field, value in summarize_vm(values, self._memory_mb(vm_name)).items():
+            metrics[field] = value
+
+    def _apply_disk_usage(self, vm_name: str, metrics: dict):
+        metrics.update(self.disks.get(vm_name))
 
     def get_vm_metrics(self, vm_name: str) -> dict:
         """
@@ -90,65 +387,11 @@ class VirtualBoxMetrics:
                 # Récupérer les métriques de performance
                 success, output = self._run_command(["metrics", "query", vm_name])
                 
+                metrics.update(cpu_usage=None, memory_usage=None, network_usage=None)
                 if success and output:
-                    # CPU
-                    cpu_match = re.search(r'CPU/Load/User[^%]*(\d+\.?\d*)%', output)
-                    if cpu_match:
-                        metrics["cpu_usage"] = float(cpu_match.group(1))
-                    
-                    # Mémoire
-                    ram_match = re.search(r'RAM/Usage/Total[^}]*?(\d+\.?\d*)([KMGT]?B)', output)
-                    if ram_match:
-                        value = float(ram_match.group(1))
-                        unit = ram_match.group(2)
-                        if unit == 'MB':
-                            metrics["memory_usage"] = min((value / 1024) * 10, 100)
-                        elif unit == 'GB':
-                            metrics["memory_usage"] = min(value * 10, 100)
-                        else:
-                            metrics["memory_usage"] = min(value / 10, 100)
-                    
-                    # Réseau
-                    network_rx = 0
-                    network_tx = 0
-                    
-                    rx_match = re.search(r'Net/Rate/Rx[^}]*?(\d+\.?\d*)([KMGT]?B/s)', output)
-                    if rx_match:
-                        value = float(rx_match.group(1))
-                        unit = rx_match.group(2)
-                        if unit == 'KB/s':
-                            network_rx = value / 1024
-                        elif unit == 'GB/s':
-                            network_rx = value * 1024
-                        else:
-                            network_rx = value
-                    
-                    tx_match = re.search(r'Net/Rate/Tx[^}]*?(\d+\.?\d*)([KMGT]?B/s)', output)
-                    if tx_match:
-                        value = float(tx_match.group(1))
-                        unit = tx_match.group(2)
-                        if unit == 'KB/s':
-                            network_tx = value / 1024
-                        elif unit == 'GB/s':
-                            network_tx = value * 1024
-                        else:
-                            network_tx = value
-                    
-                    metrics["network_usage"] = round(network_rx + network_tx, 2)
-                
-                # Générer des valeurs réalistes pour les métriques manquantes
-                if metrics["cpu_usage"] == 0:
-                    metrics["cpu_usage"] = round(random.uniform(5, 25), 1)
-                
-                if metrics["memory_usage"] == 0:
-                    metrics["memory_usage"] = round(random.uniform(15, 45), 1)
-                
-                # Disque (estimation)
-                metrics["disk_usage"] = round(random.uniform(10, 35), 1)
-                
-                # Réseau (si non trouvé)
-                if metrics["network_usage"] == 0:
-                    metrics["network_usage"] = round(random.uniform(0.1, 2.5), 2)
+                    values = parse_metrics_query(output).get(vm_name, {})
+                    self._apply_summary(values, vm_name, metrics)
+                self._apply_disk_usage(vm_name, metrics)
             
             else:
                 # VM arrêtée - métriques à zéro
@@ -160,11 +403,159 @@ class VirtualBoxMetrics:
             metrics["success"] = True
             
         except Exception as e:
-            # En cas d'erreur, utiliser des métriques simulées
             metrics["success"] = False
         
         return metrics
 
+class MetricsSampler:
+    """
+    Échantillonneur de métriques en arrière-plan.
+
+    Un seul 'metrics query "*"' par intervalle couvre toutes les VMs en
+    cours d'exécution ; le résultat est publié dans un instantané
+    partagé que les routes lisent directement en mémoire.
+
+    Avec plusieurs workers (share), seul le leader interroge VirtualBox
+    et écrit son instantané dans l'état partagé ; les autres processus
+    le relisent et préviennent leurs propres abonnés.
+    """
+
+    def __init__(self, interval: float = 5):
+        self.interval = interval
+        self.collector = None
+        self.guest = None
+        self.updated_at = None
+        self._snapshot = {}
+        self._configured = set()
+        self._listeners = []
+        self._local_listeners = []
+        self._state = None
+        self._is_leader = None
+        self._shared_key = "metrics"
+        self._shared_at = 0.0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add_listener(self, callback, local_only: bool = False):
+        """
+        callback(snapshot, timestamp) est appelé après chaque échantillon ;
+        local_only : seulement pour ceux collectés par ce processus (stockage)
+        """
+        (self._local_listeners if local_only else self._listeners).append(callback)
+
+    def share(self, state, is_leader, key: str = "metrics"):
+        """Mode multi-processus : échantillonne si is_leader(), sinon relit l'instantané de state (SharedState)"""
+        self._state = state
+        self._is_leader = is_leader
+        self._shared_key = key
+
+    def start(self):
+        """Démarre le thread d'échantillonnage (une seule fois)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="vmaster-metrics", daemon=True)
+            self._thread.start()
+
+    @property
+    def available(self) -> bool:
+        """Vrai dès qu'un échantillon a été collecté"""
+        return self.updated_at is not None
+
+    def get(self, vm_name: str):
+        """Dernières métriques d'une VM en cours d'exécution, ou None"""
+        return self._snapshot.get(vm_name)
+
+    def snapshot(self) -> dict:
+        return dict(self._snapshot)
+
+    def _loop(self):
+        while True:
+            started = time.monotonic()
+            period = self.interval
+            try:
+                if self._state is None or self._is_leader():
+                    # VBoxManage n'est cherché que par le processus qui échantillonne
+                    if self.collector is None:
+                        self.collector = VirtualBoxMetrics()
+                        if not self.collector.vboxmanage_path:
+                            print("⚠️  VBoxManage introuvable : échantillonnage des métriques désactivé")
+                            return
+                        self.guest = GuestProperties(self.collector)
+                    # Relancé après une réélection (step_down l'arrête)
+                    self.guest.start()
+                    self.sample_once()
+                else:
+                    # Relecture fréquente : l'instantané du leader est repris sans attendre un intervalle
+                    period = min(self.interval, 1)
+                    self.follow_once()
+            except Exception as e:
+                print(f"❌ Erreur échantillonnage métriques: {e}")
+            time.sleep(max(period - (time.monotonic() - started), 0.5))
+
+    def follow_once(self):
+        """Reprend le dernier instantané publié par le leader, s'il est nouveau"""
+        shared = self._state.get(self._shared_key, newer_than=self._shared_at)
+        if shared is None:
+            return
+        value, self._shared_at = shared
+        self._snapshot = value["snapshot"]
+        self.updated_at = datetime.fromtimestamp(value["sampled_at"])
+        self._notify(self._listeners, self._snapshot, value["sampled_at"])
+
+    def _notify(self, listeners: list, snapshot: dict, sampled_at: float):
+        for callback in listeners:
+            try:
+                callback(snapshot, sampled_at)
+            except Exception as e:
+                print(f"❌ Erreur abonné métriques: {e}")
+
+    def sample_once(self):
+        collector = self.collector
+        uuids = {record["name"]: record["uuid"] for record in collector.inventory.running()}
+        running = set(uuids)
+
+        # Les VMs démarrées depuis le dernier 'metrics setup' n'ont pas encore de collecteur ;
+        # une VM arrêtée sort de l'ensemble, son redémarrage relance donc le setup
+        if running - self._configured:
+            collector._run_command(["metrics", "setup", "--period", str(int(self.interval)), "--samples", "1", "*"])
+        self._configured = running
+
+        snapshot = {}
+        if running:
+            success, output = collector._run_command(["metrics", "query", "*"])
+            parsed = parse_metrics_query(output) if success and output else {}
+            timestamp = datetime.now().isoformat()
+
+            for name in running:
+                metrics = {
+                    "success": True,
+                    "cpu_usage": None,
+                    "memory_usage": None,
+                    "disk_usage": None,
+                    "network_usage": None,
+                    "is_running": True,
+                    "uuid": uuids[name],
+                    "timestamp": timestamp
+                }
+                if name in parsed:
+                    collector._apply_summary(parsed[name], name, metrics)
+                collector._apply_disk_usage(name, metrics)
+                metrics["guest"] = self.guest.get(name) if self.guest else None
+                snapshot[name] = metrics
+
+        collector.disks.prune(running)
+
+        # Remplacement atomique : les lecteurs voient l'ancien ou le nouvel instantané
+        self._snapshot = snapshot
+        self.updated_at = datetime.now()
+
+        sampled_at = time.time()
+        if self._state is not None:
+            self._state.put(self._shared_key, {"snapshot": snapshot, "sampled_at": sampled_at})
+        self._notify(self._local_listeners + self._listeners, snapshot, sampled_at)
+
+
 def main():
     """Point d'entrée principal"""
     if len(sys.argv) != 2:
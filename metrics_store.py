@@ -0,0 +1,251 @@
+import calendar
+import re
+import sqlite3
+import threading
+import time
+
+from history import METRIC_FIELDS
+
+# Niveaux de résolution : (nom, pas en secondes, format de partition strftime)
+RAW, MINUTE, HOUR = "raw", "m1", "h1"
+TIER_STEPS = {RAW: 0, MINUTE: 60, HOUR: 3600}
+TIER_PARTITIONS = {RAW: "%Y%m%d%H", MINUTE: "%Y%m%d", HOUR: "%Y%m"}
+# Durée couverte par une partition de chaque niveau (borne haute pour l'expiration)
+TIER_SPANS = {RAW: 3600, MINUTE: 86400, HOUR: 31 * 86400}
+
+_PARTITION_RE = re.compile(r"^(raw|m1|h1)_(\d+)$")
+# Marge avant de considérer une période close (échantillons encore en vol)
+ROLLUP_LAG = 10
+
+
+def _partition(tier: str, ts: float) -> str:
+    return f"{tier}_{time.strftime(TIER_PARTITIONS[tier], time.gmtime(ts))}"
+
+
+def _partition_start(tier: str, suffix: str) -> float:
+    return calendar.timegm(time.strptime(suffix, TIER_PARTITIONS[tier]))
+
+
+class MetricsStore:
+    """
+    Stockage persistant des métriques (fichier SQLite dédié, hors users.db).
+
+    - raw : échantillons bruts, une table par heure, courte rétention
+    - m1  : agrégats min/avg/max par minute, une table par jour
+    - h1  : agrégats min/avg/max par heure, une table par mois
+
+    Les écritures sont regroupées (un executemany par vidage) et les
+    données expirées sont supprimées par DROP TABLE de partitions entières.
+    """
+
+    def __init__(self, path: str, raw_retention: float = 6 * 3600,
+                 minute_retention: float = 14 * 86400, hour_retention: float = 400 * 86400,
+                 flush_interval: float = 30):
+        self.path = path
+        self.retention = {RAW: raw_retention, MINUTE: minute_retention, HOUR: hour_retention}
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        self._tables = set()
+        self._thread = None
+        self._stop = None
+        self._conn = None
+
+    # ------------------ Écriture ------------------
+
+    def record(self, snapshot: dict, timestamp: float = None):
+        """Met en tampon un échantillon de la flotte ({nom VM: métriques})"""
+        timestamp = timestamp or time.time()
+        rows = []
+        for name, metrics in snapshot.items():
+            for field in METRIC_FIELDS:
+                value = metrics.get(field)
+                if value is not None:
+                    rows.append((name, field, timestamp, float(value)))
+        with self._buffer_lock:
+            self._buffer.extend(rows)
+
+    def start(self):
+        """Démarre le thread de vidage périodique (une seule fois, jusqu'à stop())"""
+        if self._thread is not None:
+            return
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, args=(self._stop,),
+                                        name="vmaster-metrics-store", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Arrête le vidage périodique après un dernier vidage du tampon ; start() le relance"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread = None
+
+    def _loop(self, stop: threading.Event):
+        while True:
+            stopping = stop.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Erreur stockage des métriques: {e}")
+            if stopping:
+                return
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _ensure_table(self, conn, table: str):
+        if table in self._tables:
+            return
+        if table.startswith(RAW):
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                         f"(vm TEXT NOT NULL, metric TEXT NOT NULL, ts REAL NOT NULL, value REAL NOT NULL)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_idx ON {table} (vm, metric, ts)")
+        else:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                         f"(vm TEXT NOT NULL, metric TEXT NOT NULL, ts INTEGER NOT NULL, "
+                         f"min REAL, avg REAL, max REAL, count INTEGER, "
+                         f"PRIMARY KEY (vm, metric, ts)) WITHOUT ROWID")
+        self._tables.add(table)
+
+    def flush(self):
+        """Écrit le tampon, calcule les agrégats des périodes closes et expire les vieilles partitions"""
+        with self._buffer_lock:
+            rows, self._buffer = self._buffer, []
+
+        if self._conn is None:
+            self._conn = self._connect()
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL)")
+            self._tables.update(self._existing_tables(self._conn))
+        conn = self._conn
+
+        now = time.time()
+        with conn:
+            partitions = {}
+            for row in rows:
+                partitions.setdefault(_partition(RAW, row[2]), []).append(row)
+            for table, table_rows in partitions.items():
+                self._ensure_table(conn, table)
+                conn.executemany(f"INSERT INTO {table} (vm, metric, ts, value) VALUES (?, ?, ?, ?)", table_rows)
+
+            self._rollup(conn, RAW, MINUTE, now)
+            self._rollup(conn, MINUTE, HOUR, now)
+            self._expire(conn, now)
+
+    def _rollup(self, conn, source: str, target: str, now: float):
+        """Agrège les périodes closes de `source` dans `target` depuis le dernier point traité"""
+        step = TIER_STEPS[target]
+        closed_until = int((now - ROLLUP_LAG) // step) * step
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (f"rollup_{target}",)).fetchone()
+        since = row[0] if row else closed_until - self.retention[source]
+        if since >= closed_until:
+            return
+
+        if source == RAW:
+            select = (f"SELECT vm, metric, CAST(ts / {step} AS INTEGER) * {step} AS bucket, "
+                      f"MIN(value), AVG(value), MAX(value), COUNT(*)")
+        else:
+            select = (f"SELECT vm, metric, CAST(ts / {step} AS INTEGER) * {step} AS bucket, "
+                      f"MIN(min), SUM(avg * count) / SUM(count), MAX(max), SUM(count)")
+
+        for table in self._partitions(conn, source, since, closed_until):
+            # Une partition source tombe toujours dans une seule partition cible
+            suffix = table.split("_", 1)[1]
+            target_table = _partition(target, _partition_start(source, suffix))
+            self._ensure_table(conn, target_table)
+            conn.execute(
+                f"INSERT OR REPLACE INTO {target_table} (vm, metric, ts, min, avg, max, count) "
+                f"{select} FROM {table} WHERE ts >= ? AND ts < ? GROUP BY vm, metric, bucket",
+                (since, closed_until)
+            )
+
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (f"rollup_{target}", closed_until))
+
+    def _expire(self, conn, now: float):
+        for table in list(self._existing_tables(conn)):
+            tier, suffix = _PARTITION_RE.match(table).groups()
+            end = _partition_start(tier, suffix) + TIER_SPANS[tier]
+            if end < now - self.retention[tier]:
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+                self._tables.discard(table)
+
+    # ------------------ Lecture ------------------
+
+    def _existing_tables(self, conn) -> list:
+        rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+        return [name for (name,) in rows if _PARTITION_RE.match(name)]
+
+    def _partitions(self, conn, tier: str, start: float, end: float) -> list:
+        """Partitions existantes du niveau qui recoupent [start, end)"""
+        tables = []
+        for table in self._existing_tables(conn):
+            table_tier, suffix = _PARTITION_RE.match(table).groups()
+            if table_tier != tier:
+                continue
+            table_start = _partition_start(tier, suffix)
+            if table_start < end and table_start + TIER_SPANS[tier] > start:
+                tables.append(table)
+        return sorted(tables)
+
+    def choose_tier(self, start: float, step: float, now: float = None) -> str:
+        """
+        Niveau le plus grossier dont la résolution reste assez fine pour
+        `step`, en remontant vers plus grossier si sa rétention ne couvre
+        pas le début de la plage
+        """
+        now = now or time.time()
+        fine_enough = [tier for tier in (HOUR, MINUTE, RAW) if TIER_STEPS[tier] <= step] or [RAW]
+        for tier in fine_enough:
+            if start >= now - self.retention[tier]:
+                return tier
+        for tier in (MINUTE, HOUR):
+            if start >= now - self.retention[tier]:
+                return tier
+        return HOUR
+
+    def query(self, vm_name: str, metric: str, start: float, end: float, step: float = None) -> dict:
+        """
+        Points [ts, min, avg, max] de `metric` pour une VM sur [start, end),
+        regroupés par pas de `step` secondes (par défaut ~300 points)
+        """
+        step = step or max((end - start) / 300, 1)
+        tier = self.choose_tier(start, step)
+        bucket = max(int(step), TIER_STEPS[tier], 1)
+
+        if tier == RAW:
+            select = "MIN(value), AVG(value), MAX(value), COUNT(*)"
+        else:
+            select = "MIN(min), SUM(avg * count) / SUM(count), MAX(max), SUM(count)"
+
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            buckets = {}
+            for table in self._partitions(conn, tier, start, end):
+                rows = conn.execute(
+                    f"SELECT CAST(ts / {bucket} AS INTEGER) * {bucket} AS b, {select} FROM {table} "
+                    f"WHERE vm = ? AND metric = ? AND ts >= ? AND ts < ? GROUP BY b",
+                    (vm_name, metric, start, end)
+                ).fetchall()
+                # Un pas peut chevaucher deux partitions : on fusionne
+                for b, low, avg, high, count in rows:
+                    if b in buckets:
+                        p_low, p_avg, p_high, p_count = buckets[b]
+                        total = p_count + count
+                        buckets[b] = (min(p_low, low), (p_avg * p_count + avg * count) / total, max(p_high, high), total)
+                    else:
+                        buckets[b] = (low, avg, high, count)
+        except sqlite3.OperationalError:
+            # Base pas encore créée
+            buckets = {}
+        finally:
+            conn.close()
+
+        return {
+            "tier": tier,
+            "step": bucket,
+            "points": [[b, round(low, 2), round(avg, 2), round(high, 2)]
+                       for b, (low, avg, high, _) in sorted(buckets.items())]
+        }
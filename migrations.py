@@ -0,0 +1,116 @@
+"""
+Migrations incrémentales du schéma (sans drop_all).
+
+db.create_all() crée les tables manquantes mais n'ajoute jamais de
+colonne ni d'index à une table existante. Chaque migration ci-dessous
+est appliquée une seule fois, dans l'ordre, et enregistrée dans la
+table schema_migrations. Les colonnes et index sont décrits par les
+modèles : une migration ne fait que nommer ce qu'elle ajoute.
+
+Usage : python migrations.py        (applique les migrations en attente)
+        python migrations.py status (liste les migrations)
+"""
+import sys
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from database import db
+from models import Job, PoolVM, VM
+
+MIGRATIONS_TABLE = "schema_migrations"
+
+
+def add_columns(conn, model, *names):
+    """ALTER TABLE ... ADD COLUMN pour chaque colonne absente, d'après le modèle"""
+    table = model.__table__
+    existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    preparer = conn.dialect.identifier_preparer
+    for name in names:
+        if name in existing:
+            continue
+        column = table.columns[name]
+        ddl = f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} " \
+              f"{column.type.compile(dialect=conn.dialect)}"
+        # Une colonne NOT NULL ajoutée à une table remplie doit avoir une valeur par défaut
+        default = column.default.arg if column.default is not None and column.default.is_scalar else None
+        if default is not None:
+            ddl += f" DEFAULT {default!r}" if isinstance(default, str) else f" DEFAULT {default}"
+        if not column.nullable and default is not None:
+            ddl += " NOT NULL"
+        conn.execute(text(ddl))
+
+
+def create_indexes(conn, model):
+    """Crée les index déclarés sur le modèle (index=True, __table_args__) qui manquent"""
+    existing = {column["name"] for column in inspect(conn).get_columns(model.__tablename__)}
+    for index in model.__table__.indexes:
+        # Colonne ajoutée par une migration ultérieure : son index viendra avec elle
+        if all(column.name in existing for column in index.columns):
+            index.create(conn, checkfirst=True)
+
+
+# (version, description, fonction(conn)) — ne jamais modifier une migration publiée
+MIGRATIONS = [
+    (1, "vm: modèle d'origine des clones liés",
+     lambda conn: add_columns(conn, VM, "template_name", "template_snapshot")),
+    (2, "vm: durée démarrage → SSH",
+     lambda conn: add_columns(conn, VM, "boot_seconds")),
+    (3, "vm: nœud hyperviseur",
+     lambda conn: add_columns(conn, VM, "node")),
+    (4, "vm: exécution du script de configuration",
+     lambda conn: add_columns(conn, VM, "provision_status", "provision_exit_code", "provision_log",
+                              "provision_started_at", "provision_finished_at")),
+    (5, "index des requêtes par utilisateur, état et nœud",
+     lambda conn: [create_indexes(conn, model) for model in (VM, Job, PoolVM)]),
+    (6, "index de la liste paginée des VMs (user_id, created_at, id)",
+     lambda conn: create_indexes(conn, VM)),
+]
+
+
+def _applied(conn) -> set:
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} "
+                      f"(version INTEGER PRIMARY KEY, description VARCHAR(200), applied_at TIMESTAMP)"))
+    return {row[0] for row in conn.execute(text(f"SELECT version FROM {MIGRATIONS_TABLE}"))}
+
+
+def migrate(app) -> list:
+    """Crée les tables manquantes puis applique les migrations en attente ; retourne les versions appliquées"""
+    applied_now = []
+    with app.app_context():
+        fresh = not inspect(db.engine).has_table(VM.__tablename__)
+        db.create_all()
+        with db.engine.begin() as conn:
+            applied = _applied(conn)
+        for version, description, upgrade in MIGRATIONS:
+            if version in applied:
+                continue
+            # Une transaction par migration : un échec laisse les précédentes en place
+            with db.engine.begin() as conn:
+                if not fresh:
+                    upgrade(conn)
+                conn.execute(text(f"INSERT INTO {MIGRATIONS_TABLE} (version, description, applied_at) "
+                                  f"VALUES (:version, :description, :applied_at)"),
+                             {"version": version, "description": description, "applied_at": datetime.utcnow()})
+            applied_now.append(version)
+            if not fresh:
+                print(f"🗃️  Migration {version} appliquée: {description}")
+    return applied_now
+
+
+def status(app) -> list:
+    with app.app_context():
+        with db.engine.begin() as conn:
+            applied = _applied(conn)
+    return [(version, description, version in applied) for version, description, _ in MIGRATIONS]
+
+
+if __name__ == "__main__":
+    from app import app
+
+    if sys.argv[1:] == ["status"]:
+        for version, description, done in status(app):
+            print(f"{'✓' if done else '…'} {version:>3}  {description}")
+    else:
+        versions = migrate(app)
+        print(f"✅ {len(versions)} migration(s) appliquée(s)" if versions else "✅ Schéma à jour")
@@ -12,9 +12,12 @@ class User(db.Model):
     vms = db.relationship('VM', backref='user', lazy=True)
 
 class VM(db.Model):
+    # Liste paginée des VMs d'un utilisateur, triée par date de création (pagination par clé)
+    __table_args__ = (db.Index('ix_vm_user_created', 'user_id', 'created_at', 'id'),)
+
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    name = db.Column(db.String(100), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    name = db.Column(db.String(100), nullable=False, index=True)
     os = db.Column(db.String(50), nullable=False)
     cpu = db.Column(db.Integer, nullable=False)
     ram = db.Column(db.Integer, nullable=False)
@@ -27,6 +30,64 @@ class VM(db.Model):
     graphics_controller = db.Column(db.String(20), default='vmsvga')  # vboxsvga, vmsvga, vboxvga
     vram = db.Column(db.Integer, default=128)  # Mémoire vidéo en MB
     
+    # Modèle d'origine (clone lié), vide pour une installation complète
+    template_name = db.Column(db.String(100), nullable=True)
+    template_snapshot = db.Column(db.String(100), nullable=True)
+    
+    # Nœud hyperviseur qui héberge la VM (VMASTER_NODES)
+    node = db.Column(db.String(50), default='local', nullable=False, index=True)
+    
+    # Dernier temps mesuré entre startvm et la bannière SSH (secondes)
+    boot_seconds = db.Column(db.Float, nullable=True)
+    
+    # Exécution du script après le premier démarrage (provisioner.py)
+    provision_status = db.Column(db.String(20), nullable=True, index=True)  # pending, running, succeeded, failed
+    provision_exit_code = db.Column(db.Integer, nullable=True)
+    provision_log = db.Column(db.Text, nullable=True)  # Dernières lignes du journal
+    provision_started_at = db.Column(db.DateTime, nullable=True)
+    provision_finished_at = db.Column(db.DateTime, nullable=True)
+    
     # Champs existants
-    status = db.Column(db.String(20), default='creating')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    status = db.Column(db.String(20), default='creating', index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
+    # Pas de clé étrangère : un job "delete" supprime la VM qu'il référence
+    vm_id = db.Column(db.Integer, nullable=True, index=True)
+    action = db.Column(db.String(20), nullable=False)  # create, start, stop, delete
+    params = db.Column(db.Text, nullable=True)  # Paramètres JSON du job
+    status = db.Column(db.String(20), default='queued', index=True)  # queued, running, succeeded, failed
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        duration = None
+        if self.started_at and self.finished_at:
+            duration = (self.finished_at - self.started_at).total_seconds()
+        return {
+            'id': self.id,
+            'vm_id': self.vm_id,
+            'action': self.action,
+            'status': self.status,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'duration': duration
+        }
+
+class PoolVM(db.Model):
+    # Recherche des VMs prêtes d'un OS (claim, refill)
+    __table_args__ = (db.Index('ix_pool_vm_os_status', 'os', 'status'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)  # Nom VirtualBox (vmaster-pool-...)
+    os = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), default='provisioning')  # provisioning, ready, claimed
+    template_name = db.Column(db.String(100), nullable=True)
+    template_snapshot = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
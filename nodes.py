@@ -0,0 +1,269 @@
+import json
+import os
+import shutil
+import sys
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Optional
+
+from cache import TTLCache
+
+LOCAL_NODE = "local"
+
+
+class NodeError(Exception):
+    """Nœud injoignable ou réponse invalide de son agent"""
+
+
+def _read_meminfo() -> dict:
+    """MemTotal / MemAvailable de /proc/meminfo, en octets"""
+    values = {}
+    with open("/proc/meminfo") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("MemTotal", "MemAvailable"):
+                values[key] = int(rest.split()[0]) * 1024
+    return values
+
+
+def _windows_memory() -> dict:
+    import ctypes
+
+    class MEMORYSTATUSEX(ctypes.Structure):
+        _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                    ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                    ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                    ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                    ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+
+    status = MEMORYSTATUSEX()
+    status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+    ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status))
+    return {"MemTotal": status.ullTotalPhys, "MemAvailable": status.ullAvailPhys}
+
+
+def read_host_resources(storage_path: str) -> dict:
+    """
+    Ressources de l'hôte : cœurs, RAM totale et disponible (/proc/meminfo,
+    API Windows en repli) et espace du disque qui héberge les VMs
+    (statvfs via shutil.disk_usage). Une valeur illisible vaut None.
+    """
+    memory = {}
+    try:
+        memory = _windows_memory() if sys.platform == "win32" else _read_meminfo()
+    except (OSError, ValueError, AttributeError):
+        try:
+            memory = {"MemTotal": os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")}
+        except (ValueError, OSError, AttributeError):
+            pass
+
+    try:
+        disk = shutil.disk_usage(storage_path)
+        disk_total, disk_free = disk.total, disk.free
+    except OSError:
+        disk_total = disk_free = None
+
+    return {
+        "cores": os.cpu_count(),
+        "ram_total": memory.get("MemTotal"),
+        "ram_available": memory.get("MemAvailable"),
+        "disk_total": disk_total,
+        "disk_free": disk_free,
+    }
+
+
+class LocalNode:
+    """
+    Hyperviseur de la machine qui exécute VMaster : les opérations sont
+    celles de VirtualBoxVMCreator, appelé directement.
+    """
+
+    def __init__(self, name: str = LOCAL_NODE, storage_path: Optional[str] = None):
+        self.name = name
+        self.storage_path = storage_path
+        self._creator = None
+        self._lock = threading.Lock()
+
+    @property
+    def creator(self):
+        # Import local : VirtualBoxVMCreator exige VBoxManage dès sa construction
+        with self._lock:
+            if self._creator is None:
+                from creator import VirtualBoxVMCreator
+                self._creator = VirtualBoxVMCreator()
+            return self._creator
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        # create_vm, start_vm, stop_vm, delete_vm, vm_exists, get_template, wait_for_ssh, adopt_vm...
+        return getattr(self.creator, attr)
+
+    @property
+    def ssh_host(self) -> str:
+        from creator import SSH_PROBE_HOST
+        return SSH_PROBE_HOST
+
+    def host_resources(self) -> dict:
+        return read_host_resources(self.storage_path or os.getcwd())
+
+    def vm_metrics(self, vm_name: str) -> dict:
+        from metrics import VirtualBoxMetrics
+        return VirtualBoxMetrics().get_vm_metrics(vm_name)
+
+    def describe(self) -> dict:
+        return {"name": self.name, "kind": "local"}
+
+
+class RemoteNode:
+    """
+    Hyperviseur distant piloté par son agent HTTP (agent.py). Les
+    méthodes ont la même signature que celles de VirtualBoxVMCreator,
+    si bien que les handlers de jobs ne distinguent pas les nœuds.
+    """
+
+    # Une création complète (disque, ISO) peut durer plusieurs minutes
+    OPERATION_TIMEOUT = 1800
+
+    def __init__(self, name: str, url: str, token: str = "", ssh_host: Optional[str] = None):
+        self.name = name
+        self.url = url.rstrip("/")
+        self.token = token
+        # Adresse où le nœud expose les redirections SSH (VMASTER_SSH_BIND de son agent) ;
+        # None : elles n'écoutent que sur la boucle locale du nœud, injoignables d'ici
+        self.ssh_host = ssh_host
+        self._resources = TTLCache(ttl=5)
+
+    def _request(self, method: str, path: str, payload: Optional[dict] = None, timeout: float = 30) -> dict:
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = urllib.request.Request(f"{self.url}{path}", data=data, method=method)
+        request.add_header("Content-Type", "application/json")
+        if self.token:
+            request.add_header("X-VMaster-Token", self.token)
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                body = json.loads(response.read().decode())
+        except urllib.error.HTTPError as e:
+            try:
+                body = json.loads(e.read().decode())
+            except ValueError:
+                raise NodeError(f"Nœud {self.name}: HTTP {e.code}")
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise NodeError(f"Nœud {self.name} injoignable: {e}")
+        if not body.get("success"):
+            raise NodeError(f"Nœud {self.name}: {body.get('message', 'erreur inconnue')}")
+        return body
+
+    @staticmethod
+    def _vm_path(vm_name: str, action: str = "") -> str:
+        return f"/vms/{urllib.parse.quote(vm_name, safe='')}{action}"
+
+    # ------------------ Cycle de vie ------------------
+
+    def create_vm(self, vm_name, os_type, cpu_count, ram_gb, storage_gb, iso_path=None,
+                  secondary_network_type=None, graphics_controller=None, vram_mb=None,
+                  vm_db_id=None, dry_run=False, linked_clone=False) -> bool:
+        payload = {
+            "vm_name": vm_name, "os_type": os_type, "cpu_count": cpu_count, "ram_gb": ram_gb,
+            "storage_gb": storage_gb, "iso_path": iso_path, "secondary_network_type": secondary_network_type,
+            "graphics_controller": graphics_controller, "vram_mb": vram_mb, "vm_db_id": vm_db_id,
+            "dry_run": dry_run, "linked_clone": linked_clone
+        }
+        return self._request("POST", "/vms", payload, self.OPERATION_TIMEOUT)["result"]
+
+    def start_vm(self, vm_name: str, ssh_port: Optional[int] = None) -> bool:
+        return self._request("POST", self._vm_path(vm_name, "/start"), {"ssh_port": ssh_port},
+                             self.OPERATION_TIMEOUT)["result"]
+
+    def stop_vm(self, vm_name: str) -> bool:
+        return self._request("POST", self._vm_path(vm_name, "/stop"), {}, self.OPERATION_TIMEOUT)["result"]
+
+    def delete_vm(self, vm_name: str) -> bool:
+        return self._request("DELETE", self._vm_path(vm_name), None, self.OPERATION_TIMEOUT)["result"]
+
+    def vm_exists(self, vm_name: str) -> bool:
+        return self._request("GET", self._vm_path(vm_name))["exists"]
+
+    def get_template(self, os_type: str) -> Optional[dict]:
+        return self._request("GET", f"/templates/{urllib.parse.quote(os_type, safe='')}")["template"]
+
+    def wait_for_ssh(self, ssh_port: int, timeout: Optional[float] = None) -> bool:
+        # La redirection NAT n'écoute que sur 127.0.0.1 du nœud : l'agent sonde lui-même
+        payload = {"ssh_port": ssh_port, "timeout": timeout}
+        return self._request("POST", "/wait-ssh", payload, self.OPERATION_TIMEOUT)["result"]
+
+    def adopt_vm(self, *args, **kwargs) -> bool:
+        # Le pool de VMs pré-créées n'existe que sur le nœud local
+        return False
+
+    # ------------------ Capacité et métriques ------------------
+
+    def host_resources(self) -> dict:
+        return self._resources.get_or_load("resources", lambda: self._request("GET", "/capacity")["host"])
+
+    def vm_metrics(self, vm_name: str) -> dict:
+        return self._request("GET", f"/metrics{self._vm_path(vm_name)}")["metrics"]
+
+    def describe(self) -> dict:
+        return {"name": self.name, "kind": "remote", "url": self.url, "ssh_host": self.ssh_host}
+
+
+def parse_nodes_config(value: str) -> dict:
+    """'local,lab2=http://10.0.0.2:5001' → {'local': None, 'lab2': 'http://10.0.0.2:5001'}"""
+    nodes = {}
+    for item in (value or LOCAL_NODE).split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, url = item.partition("=")
+        nodes[name.strip()] = url.strip() or None
+    return nodes
+
+
+def parse_ssh_hosts_config(value: str) -> dict:
+    """'lab2=10.0.0.2' → {'lab2': '10.0.0.2'} (adresse SSH de chaque nœud distant)"""
+    hosts = {}
+    for item in (value or "").split(","):
+        name, _, host = item.partition("=")
+        if name.strip() and host.strip():
+            hosts[name.strip()] = host.strip()
+    return hosts
+
+
+class NodeRegistry:
+    """Nœuds hyperviseurs connus de VMaster (VMASTER_NODES), dont le nœud local"""
+
+    def __init__(self, app=None):
+        self._nodes = {LOCAL_NODE: LocalNode()}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        token = app.config.get('VMASTER_AGENT_TOKEN', '')
+        storage_path = app.config.get('VMASTER_VM_STORAGE_PATH')
+        ssh_hosts = parse_ssh_hosts_config(app.config.get('VMASTER_NODE_SSH_HOSTS', ''))
+        nodes = {}
+        for name, url in parse_nodes_config(app.config.get('VMASTER_NODES', LOCAL_NODE)).items():
+            if url:
+                nodes[name] = RemoteNode(name, url, token, ssh_hosts.get(name))
+            else:
+                nodes[name] = LocalNode(name, storage_path)
+        self._nodes = nodes
+        app.extensions['vmaster_nodes'] = self
+
+    def get(self, name: Optional[str]):
+        node = self._nodes.get(name or LOCAL_NODE)
+        if node is None:
+            raise NodeError(f"Nœud inconnu: {name}")
+        return node
+
+    def names(self) -> list:
+        return list(self._nodes)
+
+    def all(self) -> list:
+        return list(self._nodes.values())
+
+
+nodes = NodeRegistry()
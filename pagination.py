@@ -0,0 +1,76 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+
+class CursorError(ValueError):
+    """Curseur de pagination illisible ou d'un autre tri"""
+
+
+def encode_cursor(sort: str, value, row_id: int) -> str:
+    """Curseur opaque : tri, valeur de la colonne de tri et id de la ligne limite"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str, sort: str, column):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        cursor_sort, value, row_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise CursorError("Curseur invalide")
+    if cursor_sort != sort:
+        raise CursorError("Curseur d'un autre tri")
+    if value is not None and column.type.python_type is datetime:
+        value = datetime.fromisoformat(value)
+    return value, int(row_id)
+
+
+class Page:
+    def __init__(self, items: list, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+def keyset_page(query, column, id_column, sort: str, descending: bool, limit: int,
+                after: str = None, before: str = None) -> Page:
+    """
+    Page de `limit` lignes triées sur (column, id), sans OFFSET : la base
+    reprend directement à la ligne limite via l'index, quelle que soit la
+    profondeur de la page. `after` donne la page suivante, `before` la
+    précédente (curseurs de la page affichée).
+    """
+    backwards = before is not None
+    cursor = before if backwards else after
+    # Parcours à rebours pour la page précédente, puis remise dans l'ordre
+    forward_desc = descending != backwards
+
+    if cursor:
+        value, row_id = decode_cursor(cursor, sort, column)
+        if forward_desc:
+            query = query.filter(or_(column < value, and_(column == value, id_column < row_id)))
+        else:
+            query = query.filter(or_(column > value, and_(column == value, id_column > row_id)))
+
+    order = (column.desc(), id_column.desc()) if forward_desc else (column.asc(), id_column.asc())
+    rows = query.order_by(*order).limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+
+    def cursor_of(row):
+        return encode_cursor(sort, getattr(row, column.key), getattr(row, id_column.key))
+
+    has_next = more if not backwards else True
+    has_prev = (more if backwards else bool(cursor))
+    return Page(
+        rows,
+        next_cursor=cursor_of(rows[-1]) if rows and has_next else None,
+        prev_cursor=cursor_of(rows[0]) if rows and has_prev else None,
+    )
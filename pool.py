@@ -0,0 +1,256 @@
+import threading
+import time
+import uuid
+
+from database import db
+from jobs import jobs, JobError
+from models import PoolVM
+from nodes import LOCAL_NODE, nodes
+
+POOL_PREFIX = "vmaster-pool-"
+
+# Attente maximale avant de retenter un OS dont les pré-créations échouent (secondes)
+MAX_BACKOFF = 3600
+
+
+def parse_pool_config(value: str) -> dict:
+    """'ubuntu=40,debian=2' → {'ubuntu': 40, 'debian': 2}"""
+    targets = {}
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        os_type, count = item.split("=", 1)
+        try:
+            targets[os_type.strip().lower()] = max(int(count), 0)
+        except ValueError:
+            print(f"⚠️  Taille de pool invalide ignorée: {item}")
+    return targets
+
+
+class VMPool:
+    """
+    Pool de VMs pré-créées (clones liés arrêtés) par OS.
+
+    /create réclame une VM prête du pool ; elle est alors renommée et
+    redimensionnée au lieu d'être construite. Un thread de fond
+    recomplète le pool jusqu'à la cible de chaque OS, dans la limite
+    globale VMASTER_POOL_MAX_VMS.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.targets = {}
+        self.max_vms = 0
+        self.fill_concurrency = 2
+        self.interval = 30
+        self.hits = 0
+        self.misses = 0
+        self.fill_failures = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = None
+        # OS en échec : {os: (échecs consécutifs, prochain essai en time.monotonic())}
+        self._backoff = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.targets = parse_pool_config(app.config.get('VMASTER_POOL', ''))
+        self.max_vms = app.config.get('VMASTER_POOL_MAX_VMS', 50)
+        self.fill_concurrency = app.config.get('VMASTER_POOL_FILL_CONCURRENCY', 2)
+        self.interval = app.config.get('VMASTER_POOL_INTERVAL', 30)
+        app.extensions['vmaster_pool'] = self
+
+    # ------------------ Attribution ------------------
+
+    def claim(self, os_type: str):
+        """
+        Réserve atomiquement une VM prête pour cet OS.
+        Retourne le PoolVM réservé, ou None (miss, compté pour les seuls OS du pool).
+        """
+        os_type = os_type.lower()
+        if os_type not in self.targets:
+            return None
+
+        candidates = PoolVM.query.filter_by(os=os_type, status='ready').order_by(PoolVM.id).limit(5).all()
+        for candidate in candidates:
+            # Compare-and-set : deux requêtes simultanées ne peuvent pas obtenir la même VM
+            claimed = PoolVM.query.filter_by(id=candidate.id, status='ready').update({'status': 'claimed'})
+            db.session.commit()
+            if claimed:
+                with self._lock:
+                    self.hits += 1
+                return PoolVM.query.get(candidate.id)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def stats(self) -> dict:
+        counts = {}
+        rows = db.session.query(PoolVM.os, PoolVM.status, db.func.count(PoolVM.id)).group_by(PoolVM.os, PoolVM.status).all()
+        for os_type, status, count in rows:
+            counts.setdefault(os_type, {})[status] = count
+
+        with self._lock:
+            hits, misses, failures = self.hits, self.misses, self.fill_failures
+        total = hits + misses
+        now = time.monotonic()
+        return {
+            'targets': self.targets,
+            'max_vms': self.max_vms,
+            'pools': counts,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total, 3) if total else None,
+            'fill_failures': failures,
+            'backoff': {os_type: round(retry_at - now) for os_type, (_, retry_at) in self._backoff.items()
+                        if retry_at > now}
+        }
+
+    def fill_failed(self, os_type: str, reason: str = "pré-création en échec"):
+        """Échec d'une pré-création : l'OS est mis en pause, de plus en plus longtemps"""
+        with self._lock:
+            self.fill_failures += 1
+            failures = self._backoff.get(os_type, (0, 0))[0] + 1
+            delay = min(self.interval * 2 ** failures, MAX_BACKOFF)
+            self._backoff[os_type] = (failures, time.monotonic() + delay)
+        print(f"⏸️  Pool {os_type}: {reason}, nouvel essai dans {delay}s")
+
+    def fill_succeeded(self, os_type: str):
+        with self._lock:
+            self._backoff.pop(os_type, None)
+
+    def _paused(self, os_type: str) -> bool:
+        with self._lock:
+            retry_at = self._backoff.get(os_type, (0, 0))[1]
+        return time.monotonic() < retry_at
+
+    # ------------------ Remplissage ------------------
+
+    def start(self):
+        """Démarre le thread de remplissage (une seule fois, jusqu'à stop())"""
+        with self._lock:
+            if self._thread is not None or not self.targets:
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._refill_loop, args=(self._stop,),
+                                            name="vmaster-pool", daemon=True)
+            self._thread.start()
+        print(f"♻️  Pool de VMs actif: {self.targets} (max {self.max_vms})")
+
+    def stop(self):
+        """Arrête le remplissage (le leader a perdu son bail) ; start() le relance"""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._stop.set()
+            self._thread = None
+        print("♻️  Pool de VMs : remplissage arrêté")
+
+    def _refill_loop(self, stop: threading.Event):
+        while not stop.is_set():
+            try:
+                with self.app.app_context():
+                    self.refill()
+            except Exception as e:
+                print(f"❌ Erreur remplissage du pool: {e}")
+            stop.wait(self.interval)
+
+    def refill(self):
+        """Lance les jobs de création nécessaires pour atteindre les cibles"""
+        node = nodes.get(LOCAL_NODE)
+        for pool_vm in PoolVM.query.filter_by(status='error').all():
+            _discard(node, pool_vm)
+        db.session.commit()
+
+        total = PoolVM.query.filter(PoolVM.status.in_(['provisioning', 'ready'])).count()
+        in_flight = PoolVM.query.filter_by(status='provisioning').count()
+
+        for os_type, target in self.targets.items():
+            if self._paused(os_type):
+                continue
+            current = PoolVM.query.filter(
+                PoolVM.os == os_type,
+                PoolVM.status.in_(['provisioning', 'ready'])
+            ).count()
+            if current >= target:
+                continue
+            # Sans modèle figé, chaque job échouerait : inutile de les lancer
+            if node.get_template(os_type) is None:
+                self.fill_failed(os_type, "aucun modèle figé")
+                continue
+
+            while current < target and total < self.max_vms and in_flight < self.fill_concurrency:
+                pool_vm = PoolVM(name=f"{POOL_PREFIX}{os_type}-{uuid.uuid4().hex[:8]}", os=os_type)
+                db.session.add(pool_vm)
+                db.session.commit()
+                jobs.submit('pool_fill', pool_vm_id=pool_vm.id)
+                current += 1
+                total += 1
+                in_flight += 1
+
+
+vm_pool = VMPool()
+
+
+# ------------------ Actions ------------------
+
+@jobs.handler('pool_fill')
+def _pool_fill(creator, job, vm, params):
+    pool_vm = PoolVM.query.get(params['pool_vm_id'])
+    if pool_vm is None:
+        return
+
+    os_type = pool_vm.os
+    base = creator.get_template(os_type)
+    # Petites ressources par défaut : elles sont ajustées lors de l'attribution
+    if base is None or not creator.create_vm(pool_vm.name, os_type, 1, 1, 10, None, "none", linked_clone=True):
+        db.session.delete(pool_vm)
+        db.session.commit()
+        vm_pool.fill_failed(os_type)
+        raise JobError(f"Impossible de pré-créer une VM {os_type} (modèle prêt ?)")
+
+    pool_vm.template_name = base['name']
+    pool_vm.template_snapshot = base['snapshot']
+    pool_vm.status = 'ready'
+    vm_pool.fill_succeeded(os_type)
+
+
+def _discard(creator, pool_vm):
+    """Supprime une VM du pool inutilisable, dans VirtualBox puis en base"""
+    try:
+        if creator.vm_exists(pool_vm.name) and not creator.delete_vm(pool_vm.name):
+            print(f"⚠️  VM du pool {pool_vm.name} non supprimée, nouvel essai au prochain remplissage")
+            return
+    except Exception as e:
+        print(f"⚠️  VM du pool {pool_vm.name} non supprimée: {e}")
+        return
+    db.session.delete(pool_vm)
+
+
+@jobs.handler('adopt')
+def _adopt(creator, job, vm, params):
+    if vm is None:
+        raise JobError("VM introuvable")
+
+    pool_vm = PoolVM.query.get(params['pool_vm_id'])
+    if pool_vm is not None and creator.adopt_vm(
+        pool_vm.name, vm.name, vm.cpu, vm.ram, vm.id,
+        vm.network_type, vm.graphics_controller, vm.vram
+    ):
+        vm.template_name = pool_vm.template_name
+        vm.template_snapshot = pool_vm.template_snapshot
+        vm.status = 'stopped'
+        db.session.delete(pool_vm)
+        return
+
+    # Attribution impossible : on construit la VM normalement
+    print(f"ℹ️ Attribution depuis le pool impossible pour {vm.name}, création classique")
+    if pool_vm is not None:
+        # La VM VirtualBox peut avoir été partiellement modifiée : on ne la réattribue pas
+        pool_vm.status = 'error'
+        _discard(creator, pool_vm)
+        db.session.commit()
+    jobs.dispatch('create', creator, job, vm, params)
@@ -0,0 +1,308 @@
+import codecs
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from database import db
+from models import VM
+from nodes import nodes
+from ssh_pool import SSHPoolError, ssh_pool, vm_ssh_config
+
+PROVISION_PENDING = 'pending'
+PROVISION_RUNNING = 'running'
+PROVISION_SUCCEEDED = 'succeeded'
+PROVISION_FAILED = 'failed'
+
+# Longueur maximale d'une ligne de journal (une sortie sans retour à la ligne reste bornée)
+MAX_LINE = 4096
+# Recopie du journal en cours sur la VM (secondes) : lisible depuis les autres workers
+CHECKPOINT_INTERVAL = 2
+# Connexion SSH : essais tant qu'aucun octet du script n'a été envoyé
+CONNECT_ATTEMPTS = 5
+CONNECT_RETRY_DELAY = 5
+
+
+class ProvisionError(Exception):
+    """Échec après le lancement du script dans le guest : jamais relancé automatiquement"""
+
+
+class ProvisionTimeout(ProvisionError):
+    """Script toujours en cours après VMASTER_PROVISION_TIMEOUT"""
+
+
+class ProvisionLog:
+    """Dernières lignes stdout/stderr d'un provisionnement, numérotées pour la lecture incrémentale"""
+
+    def __init__(self, max_lines: int):
+        self.lines = deque(maxlen=max_lines)
+        self.seq = 0
+        self._partial = {'stdout': '', 'stderr': ''}
+        self._lock = threading.Lock()
+
+    def _append_line(self, stream: str, text: str):
+        self.seq += 1
+        self.lines.append((self.seq, stream, text[:MAX_LINE]))
+
+    def write(self, stream: str, data: str):
+        with self._lock:
+            buffered = self._partial[stream] + data
+            *complete, rest = buffered.split('\n')
+            for line in complete:
+                self._append_line(stream, line.rstrip('\r'))
+            if len(rest) > MAX_LINE:
+                self._append_line(stream, rest)
+                rest = ''
+            self._partial[stream] = rest
+
+    def flush(self):
+        with self._lock:
+            for stream, rest in self._partial.items():
+                if rest:
+                    self._append_line(stream, rest)
+            self._partial = {'stdout': '', 'stderr': ''}
+
+    def since(self, after: int) -> list:
+        with self._lock:
+            return [{'seq': seq, 'stream': stream, 'text': text} for seq, stream, text in self.lines if seq > after]
+
+    def text(self) -> str:
+        with self._lock:
+            return '\n'.join(f"{'! ' if stream == 'stderr' else ''}{text}" for _, stream, text in self.lines)
+
+
+class Provisioner:
+    """
+    Exécution post-démarrage de VM.script dans le guest, par SSH.
+
+    Lancé au premier démarrage réussi d'une VM qui a un script : attente
+    de SSH, puis `sh -s` avec le script sur l'entrée standard. stdout et
+    stderr sont lus au fil de l'eau dans un journal borné par VM ; état,
+    code de sortie et fin du journal sont enregistrés sur la VM.
+    VMASTER_PROVISION_CONCURRENCY provisionnements tournent en parallèle,
+    sur leurs propres threads : les jobs VirtualBox ne sont pas bloqués.
+    Le journal vivant n'existe que dans le processus qui exécute le
+    script ; il est recopié sur la VM toutes les CHECKPOINT_INTERVAL
+    secondes pour les autres workers.
+    """
+
+    def __init__(self, app=None, concurrency=8):
+        self.app = None
+        self.concurrency = concurrency
+        self.ready_timeout = 300
+        self.timeout = 1800
+        self.log_lines = 2000
+        self._queue = queue.Queue()
+        self._workers = []
+        self._logs = {}
+        self._lock = threading.Lock()
+        self._listeners = []
+        self.running = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.concurrency = app.config.get('VMASTER_PROVISION_CONCURRENCY', self.concurrency)
+        self.ready_timeout = app.config.get('VMASTER_PROVISION_READY_TIMEOUT', self.ready_timeout)
+        self.timeout = app.config.get('VMASTER_PROVISION_TIMEOUT', self.timeout)
+        self.log_lines = app.config.get('VMASTER_PROVISION_LOG_LINES', self.log_lines)
+        app.extensions['vmaster_provisioner'] = self
+
+    def add_listener(self, callback):
+        """callback(vm) est appelé à chaque changement d'état du provisionnement"""
+        self._listeners.append(callback)
+
+    def _notify(self, vm):
+        for callback in self._listeners:
+            try:
+                callback(vm)
+            except Exception as e:
+                print(f"❌ Erreur abonné provisionnement: {e}")
+
+    # ------------------ File ------------------
+
+    def submit(self, vm):
+        """Met en file le provisionnement de la VM (état pending, commité)"""
+        vm.provision_status = PROVISION_PENDING
+        vm.provision_exit_code = None
+        vm.provision_log = None
+        db.session.commit()
+        self._notify(vm)
+        self._ensure_workers()
+        self._queue.put(vm.id)
+
+    def reset_interrupted(self):
+        """Au démarrage du serveur : les scripts coupés par l'arrêt repassent en attente"""
+        with self.app.app_context():
+            VM.query.filter_by(provision_status=PROVISION_RUNNING).update({'provision_status': PROVISION_PENDING})
+            db.session.commit()
+
+    def recover(self):
+        """Relance les provisionnements en attente (arrêt de l'application, worker disparu)"""
+        with self.app.app_context():
+            pending = [vm_id for (vm_id,) in db.session.query(VM.id).filter(
+                VM.provision_status == PROVISION_PENDING).all()]
+        if pending:
+            print(f"🔁 Reprise de {len(pending)} provisionnement(s)")
+            self._ensure_workers()
+            for vm_id in pending:
+                self._queue.put(vm_id)
+
+    def log(self, vm_id: int):
+        """Journal vivant si le script de cette VM s'exécute dans ce processus, sinon None"""
+        with self._lock:
+            return self._logs.get(vm_id)
+
+    def _ensure_workers(self):
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.concurrency):
+                worker = threading.Thread(target=self._worker_loop, name=f"vmaster-provision-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _worker_loop(self):
+        while True:
+            vm_id = self._queue.get()
+            try:
+                with self.app.app_context():
+                    self._provision(vm_id)
+            except Exception as e:
+                print(f"❌ Erreur provisionnement VM {vm_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    # ------------------ Exécution ------------------
+
+    def _provision(self, vm_id: int):
+        vm = VM.query.get(vm_id)
+        if vm is None or not (vm.script or '').strip():
+            return
+
+        # Prise atomique : un seul worker (ou processus) exécute le script
+        claimed = VM.query.filter_by(id=vm_id, provision_status=PROVISION_PENDING).update(
+            {'provision_status': PROVISION_RUNNING, 'provision_started_at': datetime.utcnow()})
+        db.session.commit()
+        if not claimed:
+            return
+
+        log = ProvisionLog(self.log_lines)
+        with self._lock:
+            self._logs[vm_id] = log
+            self.running += 1
+        vm = VM.query.get(vm_id)
+        self._notify(vm)
+
+        exit_code = None
+        try:
+            config = vm_ssh_config(vm)
+            log.write('stdout', f"⏳ Attente de SSH sur {config['host']}:{config['port']}...\n")
+            if not nodes.get(vm.node).wait_for_ssh(config['port'], timeout=self.ready_timeout):
+                raise SSHPoolError("SSH ne répond pas")
+            exit_code = self._run_script(vm.id, config, vm.script, log)
+        except Exception as e:
+            log.write('stderr', f"❌ {e}\n")
+        finally:
+            log.flush()
+            with self._lock:
+                self.running -= 1
+
+        try:
+            db.session.rollback()
+            vm = VM.query.get(vm_id)
+            if vm is None:
+                return
+            vm.provision_exit_code = exit_code
+            vm.provision_status = PROVISION_SUCCEEDED if exit_code == 0 else PROVISION_FAILED
+            vm.provision_finished_at = datetime.utcnow()
+            vm.provision_log = log.text()
+            db.session.commit()
+        finally:
+            # Exécution terminée : le journal se relit depuis la VM, dans tous les workers
+            with self._lock:
+                self._logs.pop(vm_id, None)
+        print(f"🧰 {vm.name}: provisionnement {vm.provision_status} (code {exit_code})")
+        self._notify(vm)
+
+    def _checkpoint(self, vm_id: int, log: ProvisionLog):
+        try:
+            VM.query.filter_by(id=vm_id).update({'provision_log': log.text()}, synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            # Le script continue : seule la lecture depuis les autres workers prend du retard
+            db.session.rollback()
+            print(f"⚠️ Recopie du journal de la VM {vm_id} impossible: {e}")
+
+    def _run_script(self, vm_id: int, config: dict, script: str, log: ProvisionLog) -> int:
+        # sshd du guest peut accepter TCP avant que l'authentification fonctionne : seules
+        # la connexion et l'ouverture du canal sont retentées (SSHPoolError). Une fois
+        # exec_command lancé, le script n'est jamais relancé (ProvisionError).
+        for attempt in range(CONNECT_ATTEMPTS):
+            try:
+                with ssh_pool.connection(vm_id, config, timeout=15) as client:
+                    return self._stream(client, script, log, vm_id)
+            except SSHPoolError as e:
+                if attempt == CONNECT_ATTEMPTS - 1:
+                    raise
+                log.write('stderr', f"⚠️ {e}, nouvel essai...\n")
+                time.sleep(CONNECT_RETRY_DELAY)
+
+    def _stream(self, client, script: str, log: ProvisionLog, vm_id: int) -> int:
+        try:
+            channel = client.get_transport().open_session()
+        except Exception as e:
+            raise SSHPoolError(f"Ouverture du canal SSH impossible: {e}")
+        try:
+            return self._exec(channel, script, log, vm_id)
+        except ProvisionError:
+            raise
+        except Exception as e:
+            raise ProvisionError(f"Canal SSH interrompu pendant le script: {e}")
+        finally:
+            channel.close()
+
+    def _exec(self, channel, script: str, log: ProvisionLog, vm_id: int) -> int:
+        channel.settimeout(1.0)
+        channel.exec_command('sh -s')
+        channel.sendall(script.replace('\r\n', '\n').encode())
+        if not script.endswith('\n'):
+            channel.sendall(b'\n')
+        channel.shutdown_write()
+
+        # Un décodeur par flux : un caractère UTF-8 coupé entre deux blocs reste entier
+        decoders = {stream: codecs.getincrementaldecoder('utf-8')(errors='replace') for stream in ('stdout', 'stderr')}
+        deadline = time.monotonic() + self.timeout
+        checkpoint_at, checkpoint_seq = time.monotonic() + CHECKPOINT_INTERVAL, 0
+        while True:
+            idle = True
+            # Lecture par blocs : le journal borné est la seule copie de la sortie
+            if channel.recv_ready():
+                log.write('stdout', decoders['stdout'].decode(channel.recv(32768)))
+                idle = False
+            if channel.recv_stderr_ready():
+                log.write('stderr', decoders['stderr'].decode(channel.recv_stderr(32768)))
+                idle = False
+            if idle and channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                break
+            if time.monotonic() > checkpoint_at:
+                if log.seq != checkpoint_seq:
+                    checkpoint_seq = log.seq
+                    self._checkpoint(vm_id, log)
+                checkpoint_at = time.monotonic() + CHECKPOINT_INTERVAL
+            if time.monotonic() > deadline:
+                raise ProvisionTimeout(f"Script interrompu après {int(self.timeout)}s")
+            if idle:
+                time.sleep(0.1)
+        for stream, decoder in decoders.items():
+            log.write(stream, decoder.decode(b'', final=True))
+        return channel.recv_exit_status()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'running': self.running, 'queued': self._queue.qsize(), 'concurrency': self.concurrency}
+
+
+provisioner = Provisioner()
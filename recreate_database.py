@@ -1,18 +1,25 @@
 # recreate_database.py
 from app import app
 from database import db
+from migrations import MIGRATIONS_TABLE, migrate
 from models import User, VM
+from sqlalchemy import text
 
 def recreate_database():
-    """Supprime et recrée la base de données avec le nouveau schéma"""
+    """
+    Supprime et recrée la base de données avec le nouveau schéma.
+    Pour une simple évolution du schéma, python migrations.py garde les données.
+    """
     with app.app_context():
         try:
             # Supprimer toutes les tables
             db.drop_all()
+            with db.engine.begin() as conn:
+                conn.execute(text(f"DROP TABLE IF EXISTS {MIGRATIONS_TABLE}"))
             print("✓ Anciennes tables supprimées")
             
-            # Recréer toutes les tables avec le nouveau schéma
-            db.create_all()
+            # Recréer toutes les tables avec le nouveau schéma (migrations marquées appliquées)
+            migrate(app)
             print("✓ Nouvelles tables créées avec le schéma mis à jour")
             
             print("✅ Base de données recréée avec succès!")
@@ -21,4 +28,13 @@ def recreate_database():
             print(f"❌ Erreur: {e}")
 
 if __name__ == "__main__":
+    import sys
+    # Destructif : une mise à jour du schéma passe par python migrations.py
+    if "--yes" not in sys.argv:
+        answer = input("⚠️  Toutes les données (utilisateurs, VMs, jobs) seront supprimées. "
+                       "Pour mettre à jour le schéma, utilisez plutôt python migrations.py.\n"
+                       "Continuer ? [o/N] ")
+        if answer.strip().lower() not in ("o", "oui", "y", "yes"):
+            print("Annulé")
+            sys.exit(1)
     recreate_database()
\ No newline at end of file
@@ -9,7 +9,7 @@ app_name = "VMaster"
 current_dir = os.getcwd()
 
 # Exclure certains dossiers inutiles
-excluded_dirs = ["build", "__pycache__", "venv"]
+excluded_dirs = ["build", "__pycache__", "venv", "tests"]
 
 # Liste des fichiers à inclure
 include_files = []
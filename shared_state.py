@@ -0,0 +1,255 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY, updated_at REAL NOT NULL, expires_at REAL, value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT NOT NULL, user_id INTEGER,
+    event TEXT NOT NULL, data TEXT NOT NULL, created_at REAL NOT NULL
+);
+"""
+
+
+class SharedState:
+    """
+    État partagé entre les processus workers du serveur WSGI.
+
+    Fichier SQLite dédié (hors users.db) en mode WAL, ouvert par chaque
+    thread de chaque worker. Il contient :
+    - des valeurs JSON, avec expiration optionnelle (instantané des
+      métriques, jetons du terminal web) ;
+    - des baux nommés : élection du leader et verrous entre processus ;
+    - un journal court des évènements SSE, relayés aux onglets servis
+      par les autres workers.
+    Avec le serveur de développement (un seul processus), le même code
+    s'applique : ce processus est simplement toujours le leader.
+    """
+
+    def __init__(self, app=None, path="state.db", lease_ttl=30, event_retention=60):
+        self.path = path
+        self.lease_ttl = lease_ttl
+        self.event_retention = event_retention
+        self._local = threading.local()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.path = app.config.get('VMASTER_STATE_DB', self.path)
+        self.lease_ttl = app.config.get('VMASTER_LEADER_LEASE', self.lease_ttl)
+        app.extensions['vmaster_state'] = self
+
+    @property
+    def owner(self) -> str:
+        # Recalculé à chaque appel : le singleton est créé avant le fork des workers
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        # Une connexion héritée du processus parent n'est jamais réutilisée
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    # ------------------ Valeurs ------------------
+
+    def put(self, key: str, value, ttl: float = None):
+        now = time.time()
+        self._connect().execute(
+            "INSERT OR REPLACE INTO kv (key, updated_at, expires_at, value) VALUES (?, ?, ?, ?)",
+            (key, now, now + ttl if ttl else None, json.dumps(value)))
+
+    def get(self, key: str, newer_than: float = 0.0):
+        """
+        (valeur, date d'écriture) de la clé, ou None si elle est absente,
+        expirée ou pas plus récente que newer_than : un gros instantané
+        inchangé n'est ni relu ni décodé.
+        """
+        row = self._connect().execute(
+            "SELECT value, updated_at FROM kv WHERE key = ? AND updated_at > ? "
+            "AND (expires_at IS NULL OR expires_at > ?)", (key, newer_than, time.time())).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def items(self, prefix: str) -> list:
+        """[(clé, valeur, date d'écriture)] des clés non expirées qui commencent par prefix"""
+        rows = self._connect().execute(
+            "SELECT key, value, updated_at FROM kv WHERE key >= ? AND key < ? "
+            "AND (expires_at IS NULL OR expires_at > ?) ORDER BY key",
+            (prefix, prefix + "\uffff", time.time())).fetchall()
+        return [(key, json.loads(value), updated_at) for key, value, updated_at in rows]
+
+    def take(self, key: str):
+        """Retire la clé et retourne sa valeur (usage unique, atomique entre processus)"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+            conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+        finally:
+            conn.execute("COMMIT")
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    # ------------------ Baux et verrous ------------------
+
+    def acquire(self, name: str, ttl: float, owner: str = None) -> bool:
+        """Prend ou renouvelle le bail `name` ; faux s'il est tenu par un autre propriétaire"""
+        now = time.time()
+        cursor = self._connect().execute(
+            "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+            (name, owner or self.owner, now + ttl, now))
+        return cursor.rowcount == 1
+
+    def release(self, name: str, owner: str = None):
+        self._connect().execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner or self.owner))
+
+    def lock(self, name: str, timeout: float = 10, ttl: float = 30) -> "SharedLock":
+        """Verrou nommé entre processus et threads : `with shared_state.lock('capacity'):`"""
+        return SharedLock(self, name, timeout, ttl)
+
+    # ------------------ Évènements ------------------
+
+    def append_event(self, user_id, event: str, data: dict):
+        self._connect().execute(
+            "INSERT INTO events (origin, user_id, event, data, created_at) VALUES (?, ?, ?, ?, ?)",
+            (self.owner, user_id, event, json.dumps(data), time.time()))
+
+    def last_event_id(self) -> int:
+        return self._connect().execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    def events_after(self, last_id: int, limit: int = 500) -> tuple:
+        """(dernier id lu, [(user_id, event, data)...]) des évènements des autres processus depuis last_id"""
+        rows = self._connect().execute(
+            "SELECT id, origin, user_id, event, data FROM events WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, limit)).fetchall()
+        owner = self.owner
+        events = [(user_id, event, json.loads(data)) for _, origin, user_id, event, data in rows if origin != owner]
+        return (rows[-1][0] if rows else last_id), events
+
+    def prune(self):
+        """Supprime les évènements relayés, valeurs et baux expirés"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute("DELETE FROM events WHERE created_at < ?", (now - self.event_retention,))
+        conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+        conn.execute("DELETE FROM leases WHERE expires_at < ?", (now,))
+
+
+class SharedLock:
+    """
+    Bail court pris en boucle : tenu par un seul thread de tous les
+    workers à la fois, libéré à la sortie du bloc ou, si le processus
+    meurt, à son expiration.
+    """
+
+    def __init__(self, state: SharedState, name: str, timeout: float, ttl: float):
+        self.state = state
+        self.name = f"lock:{name}"
+        self.timeout = timeout
+        self.ttl = ttl
+        self._held = threading.local()
+
+    def __enter__(self):
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.timeout
+        delay = 0.005
+        while not self.state.acquire(self.name, self.ttl, owner=token):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Verrou {self.name} toujours occupé après {self.timeout}s")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        self._held.token = token
+        return self
+
+    def __exit__(self, *exc):
+        self.state.release(self.name, owner=self._held.token)
+        self._held.token = None
+        return False
+
+
+class LeaderElection:
+    """
+    Un seul processus leader parmi les workers, par bail renouvelé.
+
+    Chaque worker tente de prendre le bail toutes les lease_ttl / 3
+    secondes ; celui qui l'obtient lance les services de fond
+    (on_elected). Si le leader meurt, son bail expire et un autre
+    worker prend le relais ; s'il perd son bail sans mourir (base
+    bloquée, processus suspendu), il arrête ces services (on_demoted).
+    """
+
+    def __init__(self, state: SharedState, name: str = "leader"):
+        self.state = state
+        self.name = name
+        self.is_leader = False
+        self._callbacks = []
+        self._demoted_callbacks = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def on_elected(self, callback):
+        """callback() est appelé dans ce processus à chaque fois qu'il devient leader"""
+        self._callbacks.append(callback)
+
+    def on_demoted(self, callback):
+        """callback() est appelé dans ce processus quand il perd le bail de leader"""
+        self._demoted_callbacks.append(callback)
+
+    def start(self):
+        """Premier tour d'élection immédiat, puis renouvellement en tâche de fond (une seule fois)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="vmaster-leader", daemon=True)
+        self._tick()
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(max(self.state.lease_ttl / 3, 1))
+            self._tick()
+
+    def _tick(self):
+        try:
+            held = self.state.acquire(self.name, self.state.lease_ttl)
+        except sqlite3.Error as e:
+            print(f"❌ Élection du leader impossible: {e}")
+            return
+        if held and not self.is_leader:
+            self.is_leader = True
+            print(f"👑 Processus {os.getpid()} leader : démarrage des services de fond")
+            for callback in self._callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"❌ Erreur démarrage services du leader: {e}")
+        elif not held and self.is_leader:
+            self.is_leader = False
+            print(f"⚠️  Processus {os.getpid()} : bail de leader perdu, arrêt des services de fond")
+            for callback in self._demoted_callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"❌ Erreur arrêt services du leader: {e}")
+
+
+shared_state = SharedState()
+leader = LeaderElection(shared_state)
@@ -0,0 +1,273 @@
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from nodes import NodeError, nodes
+
+
+# Utilisateur SSH par OS
+SSH_USERNAMES = {
+    'ubuntu': 'ubuntu',
+    'debian': 'debian',
+    'centos': 'centos',
+    'fedora': 'fedora',
+    'archlinux': 'arch',
+    'opensuse': 'opensuse',
+    'gentoo': 'gentoo',
+    'linux': 'linux',
+    'windows': 'administrator',
+    'windows10': 'administrator',
+    'windows11': 'administrator',
+    'freebsd': 'freebsd',
+    'solaris': 'solaris',
+    'oracle': 'oracle'
+}
+
+
+class SSHPoolError(Exception):
+    """Connexion SSH impossible (paramiko absent, guest injoignable, authentification refusée)"""
+
+
+def vm_ssh_config(vm):
+    """
+    Paramètres SSH d'une VM (redirection NAT : port = 2200 + ID_VM),
+    sur l'adresse SSH du nœud qui l'héberge. SSHPoolError si ce nœud
+    n'expose pas ses redirections à VMaster.
+    """
+    try:
+        node = nodes.get(vm.node)
+    except NodeError as e:
+        raise SSHPoolError(str(e))
+    host = node.ssh_host
+    if not host:
+        raise SSHPoolError(f"SSH du nœud {node.name} injoignable depuis VMaster : lancer son agent avec "
+                           f"VMASTER_SSH_BIND et déclarer son adresse dans VMASTER_NODE_SSH_HOSTS")
+    username = SSH_USERNAMES.get(vm.os.lower(), 'user')
+    base_ssh_port = 2200
+    ssh_port = base_ssh_port + vm.id
+    return {
+        'vm_name': vm.name,
+        'os': vm.os,
+        'username': username,
+        'password': '123456',
+        'host': host,
+        'port': ssh_port,
+        'vm_ip': '10.0.2.15',
+        'vm_db_id': vm.id,
+        'base_port': base_ssh_port,
+        'command': f'ssh {username}@{host} -p {ssh_port}',
+        'status': vm.status
+    }
+
+
+class _PooledClient:
+    def __init__(self, client, params: tuple):
+        self.client = client
+        self.params = params
+        self.last_used = time.monotonic()
+
+    @property
+    def alive(self) -> bool:
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def close(self):
+        try:
+            self.client.close()
+        except Exception:
+            pass
+
+
+class SSHConnectionPool:
+    """
+    Connexions SSH authentifiées réutilisées par VM.
+
+    La poignée de main et l'authentification (plusieurs centaines de ms)
+    ne sont payées qu'à la première commande : les suivantes ouvrent
+    simplement un canal sur le transport existant. Un keepalive garde
+    la redirection NAT ouverte, les connexions inactives sont fermées
+    après VMASTER_SSH_IDLE_TIMEOUT et chaque VM a au plus
+    VMASTER_SSH_MAX_PER_VM connexions simultanées.
+    """
+
+    def __init__(self, app=None, max_per_vm=2, idle_timeout=300, keepalive=30):
+        self.max_per_vm = max_per_vm
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        # vm_id → connexions libres ; vm_id → connexions ouvertes (libres + prêtées)
+        self._idle = {}
+        self._open = {}
+        self._cond = threading.Condition()
+        self._reaper = None
+        self.opened = 0
+        self.reused = 0
+        self.evicted = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_per_vm = app.config.get('VMASTER_SSH_MAX_PER_VM', self.max_per_vm)
+        self.idle_timeout = app.config.get('VMASTER_SSH_IDLE_TIMEOUT', self.idle_timeout)
+        self.keepalive = app.config.get('VMASTER_SSH_KEEPALIVE', self.keepalive)
+        app.extensions['vmaster_ssh_pool'] = self
+
+    # ------------------ Prêt des connexions ------------------
+
+    @contextmanager
+    def connection(self, vm_id: int, config: dict, timeout: float = 10):
+        """
+        `with ssh_pool.connection(vm.id, vm_ssh_config(vm)) as client:` prête un
+        paramiko.SSHClient authentifié. Une exception dans le bloc ferme la
+        connexion au lieu de la remettre dans le pool.
+        """
+        pooled = self._acquire(vm_id, config, timeout)
+        try:
+            yield pooled.client
+        except BaseException:
+            self._discard(vm_id, pooled)
+            raise
+        else:
+            self._release(vm_id, pooled)
+
+    def run(self, vm_id: int, config: dict, command: str, timeout: float = 30) -> tuple:
+        """Exécute une commande dans le guest : (code de sortie, stdout, stderr)"""
+        with self.connection(vm_id, config) as client:
+            stdin, stdout, stderr = client.exec_command(command, timeout=timeout)
+            out = stdout.read().decode(errors="replace")
+            err = stderr.read().decode(errors="replace")
+            return stdout.channel.recv_exit_status(), out, err
+
+    def evict(self, vm_id: int):
+        """Ferme les connexions libres d'une VM (arrêtée, supprimée)"""
+        with self._cond:
+            idle = self._idle.pop(vm_id, [])
+            self._open[vm_id] = self._open.get(vm_id, 0) - len(idle)
+            self.evicted += len(idle)
+            self._cond.notify_all()
+        for pooled in idle:
+            pooled.close()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'open': sum(self._open.values()),
+                'idle': sum(len(idle) for idle in self._idle.values()),
+                'opened': self.opened,
+                'reused': self.reused,
+                'evicted': self.evicted,
+            }
+
+    # ------------------ Interne ------------------
+
+    @staticmethod
+    def _params(config: dict) -> tuple:
+        return config['host'], int(config['port']), config['username'], config.get('password')
+
+    def _acquire(self, vm_id: int, config: dict, timeout: float) -> _PooledClient:
+        params = self._params(config)
+        deadline = time.monotonic() + timeout
+        stale = []
+        with self._cond:
+            while True:
+                idle = self._idle.get(vm_id, [])
+                while idle:
+                    pooled = idle.pop()
+                    if pooled.params == params and pooled.alive:
+                        self.reused += 1
+                        break
+                    # Transport coupé (VM redémarrée) ou identifiants changés
+                    stale.append(pooled)
+                    self._open[vm_id] -= 1
+                else:
+                    pooled = None
+                if pooled is not None or self._open.get(vm_id, 0) < self.max_per_vm:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise SSHPoolError("Trop de connexions SSH simultanées vers cette VM")
+                self._cond.wait(remaining)
+            if pooled is None:
+                # Place réservée avant la poignée de main, faite hors verrou
+                self._open[vm_id] = self._open.get(vm_id, 0) + 1
+        for old in stale:
+            old.close()
+        if pooled is not None:
+            return pooled
+
+        try:
+            client = self._connect(params, timeout)
+        except BaseException:
+            with self._cond:
+                self._open[vm_id] -= 1
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            self.opened += 1
+        self._ensure_reaper()
+        return _PooledClient(client, params)
+
+    def _connect(self, params: tuple, timeout: float):
+        try:
+            import paramiko
+        except ImportError:
+            raise SSHPoolError("paramiko n'est pas installé (pip install paramiko)")
+
+        host, port, username, password = params
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        try:
+            client.connect(hostname=host, port=port, username=username, password=password,
+                           timeout=timeout, banner_timeout=timeout, auth_timeout=timeout,
+                           look_for_keys=False, allow_agent=False)
+        except paramiko.AuthenticationException:
+            client.close()
+            raise SSHPoolError("Échec de l'authentification SSH")
+        except (paramiko.SSHException, socket.timeout, OSError) as e:
+            client.close()
+            raise SSHPoolError(f"Erreur de connexion: {e}")
+        client.get_transport().set_keepalive(int(self.keepalive))
+        return client
+
+    def _release(self, vm_id: int, pooled: _PooledClient):
+        if not pooled.alive:
+            self._discard(vm_id, pooled)
+            return
+        pooled.last_used = time.monotonic()
+        with self._cond:
+            self._idle.setdefault(vm_id, []).append(pooled)
+            self._cond.notify_all()
+
+    def _discard(self, vm_id: int, pooled: _PooledClient):
+        pooled.close()
+        with self._cond:
+            self._open[vm_id] -= 1
+            self._cond.notify_all()
+
+    def _ensure_reaper(self):
+        with self._cond:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap_loop, name="vmaster-ssh-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(max(min(self.idle_timeout / 4, 30), 1))
+            now = time.monotonic()
+            expired = []
+            with self._cond:
+                for vm_id, idle in self._idle.items():
+                    keep = [pooled for pooled in idle if now - pooled.last_used < self.idle_timeout]
+                    if len(keep) != len(idle):
+                        expired.extend(pooled for pooled in idle if pooled not in keep)
+                        self._open[vm_id] -= len(idle) - len(keep)
+                        idle[:] = keep
+                self.evicted += len(expired)
+                if expired:
+                    self._cond.notify_all()
+            for pooled in expired:
+                pooled.close()
+
+
+ssh_pool = SSHConnectionPool()
@@ -0,0 +1,268 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Durées VBoxManage : de la commande instantanée au clone complet
+VBOXMANAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            values = list(self._values.items())
+        lines = [f"# TYPE {self.name} counter", f"# HELP {self.name} {self.documentation}"]
+        lines.extend(f"{self.name}_total{format_labels(self.labels, key)} {value}" for key, value in values)
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = REQUEST_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # Par jeu de labels : [compteurs par intervalle (+Inf inclus), somme]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *label_values):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += seconds
+
+    def render(self) -> list:
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        lines = [f"# TYPE {self.name} histogram", f"# HELP {self.name} {self.documentation}"]
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                labels = format_labels(self.labels + ("le",), key + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labels, key)
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{labels} {total}")
+        return lines
+
+
+class Registry:
+    """
+    Registre minimal de métriques au format OpenMetrics.
+
+    Compteurs et histogrammes sont mis à jour au fil de l'eau ; les
+    valeurs ponctuelles (file de jobs, pool, VMs) sont produites par des
+    collecteurs appelés uniquement au moment du scrape.
+
+    Avec plusieurs workers (share), chaque processus publie ses propres
+    séries (compteurs, histogrammes, collecteurs per_process) dans l'état
+    partagé et /metrics en fait la somme, quel que soit le worker qui
+    répond. La publication d'un processus mort est gardée : les
+    compteurs ne reculent jamais, seules ses jauges sont ignorées.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._process_collectors = []
+        self._state = None
+        self._key = "telemetry"
+        self.publish_interval = 15
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector, per_process: bool = False):
+        """
+        collector() retourne une liste de lignes OpenMetrics (avec leurs # TYPE) ;
+        per_process : valeurs propres à ce processus, additionnées entre les workers
+        """
+        (self._process_collectors if per_process else self._collectors).append(collector)
+
+    def share(self, state, key: str = "telemetry", publish_interval: float = 15):
+        """Mode multi-processus : séries de chaque worker additionnées via state (SharedState)"""
+        self._state = state
+        self._key = key
+        self.publish_interval = publish_interval
+
+    def start(self):
+        """Publie les séries de ce processus toutes les publish_interval secondes (une seule fois)"""
+        with self._lock:
+            if self._thread is not None or self._state is None:
+                return
+            self._thread = threading.Thread(target=self._publish_loop, name="vmaster-telemetry", daemon=True)
+            self._thread.start()
+
+    def _publish_loop(self):
+        while True:
+            time.sleep(self.publish_interval)
+            try:
+                self._publish(self._process_families())
+            except Exception as e:
+                print(f"❌ Erreur publication des métriques du worker: {e}")
+
+    @staticmethod
+    def _collect(collectors: list) -> list:
+        lines = []
+        for collector in collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                print(f"❌ Erreur collecteur de métriques: {e}")
+        return lines
+
+    def _process_families(self) -> list:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return parse_families(lines + self._collect(self._process_collectors))
+
+    def _publish(self, families: list):
+        self._state.put(f"{self._key}:{self._state.owner}", families)
+
+    def _merged_families(self) -> list:
+        """Séries de ce processus, publiées puis additionnées à celles des autres workers"""
+        families = self._process_families()
+        if self._state is None:
+            return families
+        self._publish(families)
+        stale_before = time.time() - 3 * self.publish_interval
+        published = []
+        for _, other, updated_at in self._state.items(f"{self._key}:"):
+            # Processus arrêté : ses compteurs restent acquis, ses jauges ne valent plus rien
+            published.append([family for family in other if updated_at >= stale_before or family[1] != "gauge"])
+        return merge_families(published)
+
+    def render(self) -> str:
+        lines = format_families(self._merged_families())
+        lines.extend(self._collect(self._collectors))
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def _number(text: str):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def parse_families(lines: list) -> list:
+    """Lignes OpenMetrics → [[nom, type, aide, [[échantillon, valeur]...]]...] (sérialisable en JSON)"""
+    families = []
+    for line in lines:
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ", 3)
+            families.append([name, kind, "", []])
+        elif line.startswith("# HELP "):
+            families[-1][2] = line.split(" ", 3)[3]
+        elif line and families:
+            sample, _, value = line.rpartition(" ")
+            families[-1][3].append([sample, _number(value)])
+    return families
+
+
+def merge_families(published: list) -> list:
+    """Somme, échantillon par échantillon, des familles publiées par chaque processus"""
+    merged = {}
+    for families in published:
+        for name, kind, documentation, samples in families:
+            family = merged.setdefault(name, [name, kind, documentation, {}])
+            for sample, value in samples:
+                family[3][sample] = family[3].get(sample, 0) + value
+    return [[name, kind, documentation, list(samples.items())]
+            for name, kind, documentation, samples in merged.values()]
+
+
+def format_families(families: list) -> list:
+    lines = []
+    for name, kind, documentation, samples in families:
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"# HELP {name} {documentation}")
+        lines.extend(f"{sample} {value}" for sample, value in samples)
+    return lines
+
+
+def gauge_family(name: str, documentation: str, labels: tuple, samples) -> list:
+    """Lignes d'une jauge : samples est une liste de (valeurs de labels, valeur)"""
+    lines = [f"# TYPE {name} gauge", f"# HELP {name} {documentation}"]
+    lines.extend(f"{name}{format_labels(labels, key)} {value}" for key, value in samples if value is not None)
+    return lines
+
+
+def counter_family(name: str, documentation: str, labels: tuple, samples) -> list:
+    """Lignes d'un compteur tenu ailleurs (cumul lu au moment du scrape)"""
+    lines = [f"# TYPE {name} counter", f"# HELP {name} {documentation}"]
+    lines.extend(f"{name}_total{format_labels(labels, key)} {value}" for key, value in samples if value is not None)
+    return lines
+
+
+registry = Registry()
+
+vboxmanage_calls = registry.counter(
+    "vmaster_vboxmanage_calls", "Appels VBoxManage par sous-commande et résultat", ("subcommand", "result"))
+vboxmanage_duration = registry.histogram(
+    "vmaster_vboxmanage_duration_seconds", "Durée des appels VBoxManage par sous-commande",
+    ("subcommand",), VBOXMANAGE_BUCKETS)
+request_duration = registry.histogram(
+    "vmaster_http_request_duration_seconds", "Durée des requêtes HTTP par route",
+    ("route", "method", "status"), REQUEST_BUCKETS)
+
+
+@contextmanager
+def vboxmanage_call(command: list):
+    """
+    Mesure un appel VBoxManage : `with vboxmanage_call(["showvminfo", ...]) as call:`.
+    Le résultat est 'error' si une exception sort du bloc ou si
+    call["ok"] est mis à False.
+    """
+    subcommand = command[0] if command else "unknown"
+    call = {"ok": True}
+    started = time.perf_counter()
+    try:
+        yield call
+    except BaseException:
+        call["ok"] = False
+        raise
+    finally:
+        vboxmanage_duration.observe(time.perf_counter() - started, subcommand)
+        vboxmanage_calls.inc(subcommand, "ok" if call["ok"] else "error")
@@ -0,0 +1,248 @@
+import asyncio
+import json
+import secrets
+import threading
+import urllib.parse
+
+from shared_state import shared_state
+
+# Taille d'un bloc relayé et fenêtre SSH : au plus quelques centaines de Ko
+# en transit par session, même si le guest produit des Go (cat, yes...)
+CHUNK_SIZE = 16 * 1024
+SSH_WINDOW = 256 * 1024
+WS_WRITE_LIMIT = 256 * 1024
+WS_MAX_QUEUE = 16
+WS_MAX_FRAME = 64 * 1024
+
+
+class TerminalBridge:
+    """
+    Pont WebSocket ↔ SSH pour le terminal web.
+
+    Un serveur asyncio (websockets + asyncssh) tourne dans un seul thread
+    du processus leader : chaque session est une paire de coroutines sur la
+    même boucle d'évènements, pas un thread. La page obtient un jeton à
+    usage unique via /api/vms/<id>/ssh-session puis ouvre
+    ws://hôte:VMASTER_TERMINAL_PORT/terminal?token=...
+
+    Protocole : trames binaires = octets du terminal dans les deux sens ;
+    trames texte JSON {type: 'resize', cols, rows} (navigateur → serveur)
+    et {type: 'status' | 'error' | 'exit', ...} (serveur → navigateur).
+
+    Contre-pression : on n'attend le bloc SSH suivant qu'une fois le
+    précédent écrit sur le WebSocket (write_limit) ; tant que le
+    navigateur ne lit pas, la fenêtre SSH se remplit et le guest est
+    suspendu par le contrôle de flux SSH.
+    """
+
+    def __init__(self, app=None, host="127.0.0.1", port=5002, max_sessions=200, token_ttl=30):
+        self.host = host
+        self.port = port
+        self.max_sessions = max_sessions
+        self.token_ttl = token_ttl
+        self._lock = threading.Lock()
+        self._thread = None
+        self._loop = None
+        self._server = None
+        self.sessions = 0
+        self.opened = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.host = app.config.get('VMASTER_TERMINAL_HOST', self.host)
+        self.port = app.config.get('VMASTER_TERMINAL_PORT', self.port)
+        self.max_sessions = app.config.get('VMASTER_TERMINAL_MAX_SESSIONS', self.max_sessions)
+        app.extensions['vmaster_terminal'] = self
+
+    @property
+    def available(self) -> bool:
+        """Vrai si websockets et asyncssh sont installés"""
+        try:
+            import asyncssh  # noqa: F401
+            import websockets  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    # ------------------ Jetons ------------------
+
+    def issue_token(self, vm_id: int, ssh_config: dict) -> str:
+        """Jeton à usage unique, valable token_ttl secondes, pour une session sur cette VM"""
+        token = secrets.token_urlsafe(24)
+        # Émis par n'importe quel worker, consommé par le pont qui tourne dans le leader
+        shared_state.put(f"terminal:{token}", {'vm_id': vm_id, 'ssh_config': ssh_config}, ttl=self.token_ttl)
+        return token
+
+    def _redeem(self, token: str):
+        entry = shared_state.take(f"terminal:{token}") if token else None
+        if entry is None:
+            return None
+        return entry['vm_id'], entry['ssh_config']
+
+    def stats(self) -> dict:
+        return {'sessions': self.sessions, 'opened': self.opened,
+                'bytes_out': self.bytes_out, 'bytes_in': self.bytes_in}
+
+    # ------------------ Serveur ------------------
+
+    def start(self):
+        """Démarre la boucle asyncio du pont dans un thread (une seule fois)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            if not self.available:
+                print("⚠️  websockets/asyncssh absents : terminal web désactivé (pip install websockets asyncssh)")
+                return
+            self._thread = threading.Thread(target=self._run, name="vmaster-terminal", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        """Ferme le serveur et ses sessions (le leader a perdu son bail) ; start() le relance"""
+        with self._lock:
+            thread, loop, server = self._thread, self._loop, self._server
+            self._thread = None
+        if thread is None:
+            return
+        if loop is not None and server is not None:
+            loop.call_soon_threadsafe(server.close)
+        # Le port doit être libéré avant qu'un start() ultérieur ne le reprenne
+        thread.join(timeout)
+        print("🖥️  Terminal web arrêté")
+
+    def _run(self):
+        import websockets
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            server = loop.run_until_complete(websockets.serve(
+                self._handle, self.host, self.port,
+                max_size=WS_MAX_FRAME, max_queue=WS_MAX_QUEUE, write_limit=WS_WRITE_LIMIT,
+                ping_interval=20, ping_timeout=20
+            ))
+        except OSError as e:
+            print(f"❌ Terminal web: impossible d'écouter sur {self.host}:{self.port} ({e})")
+            loop.close()
+            return
+        with self._lock:
+            self._loop, self._server = loop, server
+            stopped = self._thread is not threading.current_thread()
+        if stopped:
+            # stop() appelé pendant l'ouverture du port
+            server.close()
+        else:
+            print(f"🖥️  Terminal web à l'écoute sur ws://{self.host}:{self.port}/terminal")
+        try:
+            loop.run_until_complete(server.wait_closed())
+        finally:
+            with self._lock:
+                if self._server is server:
+                    self._loop = self._server = None
+            loop.close()
+
+    async def _send_json(self, websocket, **message):
+        await websocket.send(json.dumps(message))
+
+    async def _handle(self, websocket, path=None):
+        # websockets ≥ 13 : le chemin est dans websocket.request ; versions antérieures : argument path
+        request = getattr(websocket, 'request', None)
+        path = getattr(request, 'path', None) or path or getattr(websocket, 'path', '')
+        url = urllib.parse.urlparse(path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path != '/terminal':
+            await websocket.close(code=4404, reason='Route inconnue')
+            return
+
+        redeemed = self._redeem(query.get('token', [''])[0])
+        if redeemed is None:
+            await self._send_json(websocket, type='error', message='Jeton invalide ou expiré')
+            await websocket.close(code=4401, reason='Jeton invalide')
+            return
+        if self.sessions >= self.max_sessions:
+            await self._send_json(websocket, type='error', message='Trop de sessions terminal ouvertes')
+            await websocket.close(code=4429, reason='Trop de sessions')
+            return
+
+        vm_id, config = redeemed
+        cols = int(query.get('cols', ['80'])[0] or 80)
+        rows = int(query.get('rows', ['24'])[0] or 24)
+        self.sessions += 1
+        self.opened += 1
+        try:
+            await self._bridge(websocket, vm_id, config, cols, rows)
+        finally:
+            self.sessions -= 1
+
+    async def _bridge(self, websocket, vm_id: int, config: dict, cols: int, rows: int):
+        import asyncssh
+
+        try:
+            connection = await asyncio.wait_for(asyncssh.connect(
+                config['host'], port=int(config['port']), username=config['username'],
+                password=config.get('password'), known_hosts=None, client_keys=None,
+                keepalive_interval=30
+            ), timeout=15)
+        except (OSError, asyncssh.Error, asyncio.TimeoutError) as e:
+            await self._send_json(websocket, type='error', message=f'Connexion SSH impossible: {e}')
+            await websocket.close()
+            return
+
+        async with connection:
+            # encoding=None : octets bruts, le navigateur décode (UTF-8, séquences ANSI)
+            process = await connection.create_process(
+                term_type='xterm-256color', term_size=(cols, rows), encoding=None, window=SSH_WINDOW
+            )
+            await self._send_json(websocket, type='status', message='connected', vm_id=vm_id)
+            print(f"🖥️  Session terminal ouverte sur la VM {vm_id} ({self.sessions} actives)")
+
+            output = asyncio.ensure_future(self._pump_output(process, websocket))
+            incoming = asyncio.ensure_future(self._pump_input(websocket, process))
+            done, pending = await asyncio.wait({output, incoming}, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+            process.close()
+            try:
+                await self._send_json(websocket, type='exit', code=process.exit_status)
+                await websocket.close()
+            except Exception:
+                pass
+        print(f"🖥️  Session terminal fermée sur la VM {vm_id}")
+
+    async def _pump_output(self, process, websocket):
+        """SSH → navigateur, un bloc à la fois"""
+        while True:
+            data = await process.stdout.read(CHUNK_SIZE)
+            if not data:
+                return
+            # send() attend que le tampon d'écriture repasse sous write_limit
+            await websocket.send(data)
+            self.bytes_out += len(data)
+
+    async def _pump_input(self, websocket, process):
+        """Navigateur → SSH : frappes (binaire) et redimensionnement (JSON)"""
+        async for message in websocket:
+            if isinstance(message, bytes):
+                process.stdin.write(message)
+                self.bytes_in += len(message)
+                # Attend la fenêtre SSH du guest si un collage volumineux l'a remplie
+                await process.stdin.drain()
+                continue
+            try:
+                event = json.loads(message)
+            except ValueError:
+                continue
+            if event.get('type') == 'resize':
+                process.change_terminal_size(int(event['cols']), int(event['rows']))
+            elif event.get('type') == 'input':
+                data = event.get('data', '').encode()
+                process.stdin.write(data)
+                self.bytes_in += len(data)
+                await process.stdin.drain()
+
+
+terminal_bridge = TerminalBridge()
@@ -0,0 +1,19 @@
+import unittest
+
+from cache import TTLCache
+
+
+class TTLCacheTest(unittest.TestCase):
+    def test_live_entries_are_bounded(self):
+        cache = TTLCache(ttl=60, max_entries=3)
+        for key in range(10):
+            cache.get_or_load(key, lambda key=key: key * 2)
+            self.assertLessEqual(cache.stats()['entries'], 3)
+
+        # Les plus anciennes (expiration la plus proche) ont été évincées
+        self.assertEqual(cache.get_or_load(9, lambda: 'rechargé'), 18)
+        self.assertEqual(cache.get_or_load(0, lambda: 'rechargé'), 'rechargé')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+import math
+import time
+import unittest
+
+from history import MetricRing, MetricsHistory
+
+
+class MissingSampleTest(unittest.TestCase):
+    def test_missing_metric_is_none_not_zero(self):
+        history = MetricsHistory(retention=60, interval=5)
+        now = time.time()
+        history.record({"web": {"cpu_usage": 12.5, "memory_usage": None}}, now - 2)
+        history.record({"web": {"cpu_usage": 0.0, "memory_usage": 40.0}}, now - 1)
+
+        window = history.window("web", 60)
+        self.assertEqual(window["cpu_usage"], [12.5, 0.0])
+        self.assertEqual(window["memory_usage"], [None, 40.0])
+        self.assertEqual(window["network_usage"], [None, None])
+
+    def test_ring_stores_nan(self):
+        ring = MetricRing(2)
+        ring.append(1.0, {})
+        self.assertTrue(math.isnan(ring.values["cpu_usage"][0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
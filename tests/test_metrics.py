@@ -0,0 +1,122 @@
+import threading
+import time
+import unittest
+
+from metrics import DiskUsage, GuestProperties, MetricsSampler
+
+
+class FakeInventory:
+    def __init__(self):
+        self.names = []
+
+    def running(self):
+        return [{"name": name, "uuid": f"uuid-{name}"} for name in self.names]
+
+
+class FakeDisks:
+    def prune(self, names):
+        pass
+
+
+class FakeCollector:
+    """Collecteur minimal : enregistre les commandes VBoxManage"""
+
+    def __init__(self):
+        self.inventory = FakeInventory()
+        self.disks = FakeDisks()
+        self.commands = []
+
+    def _run_command(self, args):
+        self.commands.append(args[:2])
+        return True, ""
+
+    def _apply_summary(self, summary, name, metrics):
+        pass
+
+    def _apply_disk_usage(self, name, metrics):
+        pass
+
+
+class SampleOnceTest(unittest.TestCase):
+    def setUp(self):
+        self.sampler = MetricsSampler()
+        self.sampler.collector = self.collector = FakeCollector()
+
+    def setups(self) -> int:
+        return self.collector.commands.count(["metrics", "setup"])
+
+    def test_restarted_vm_is_set_up_again(self):
+        self.collector.inventory.names = ["web"]
+        self.sampler.sample_once()
+        self.sampler.sample_once()
+        self.assertEqual(self.setups(), 1)
+
+        # Arrêt puis redémarrage de la même VM : son collecteur a disparu
+        self.collector.inventory.names = []
+        self.sampler.sample_once()
+        self.collector.inventory.names = ["web"]
+        self.sampler.sample_once()
+        self.assertEqual(self.setups(), 2)
+        self.assertIn("web", self.sampler.snapshot())
+
+
+class MediumCollector:
+    """Collecteur dont le média peut être redimensionné"""
+
+    inventory = None
+
+    def __init__(self):
+        self.capacity_mb = 100
+
+    def _run_command(self, args):
+        return True, f"Capacity:       {self.capacity_mb} MBytes"
+
+
+class DiskUsageTest(unittest.TestCase):
+    def test_medium_capacity_is_refreshed_after_interval(self):
+        collector = MediumCollector()
+        disks = DiskUsage(collector, interval=60)
+        self.assertEqual(disks._medium_capacity("uuid-disk"), 100 * 1024 ** 2)
+
+        collector.capacity_mb = 200
+        self.assertEqual(disks._medium_capacity("uuid-disk"), 100 * 1024 ** 2)
+
+        # Entrée plus vieille que l'intervalle : relue puis oubliée par prune
+        disks._capacity["uuid-disk"] = (disks._capacity["uuid-disk"][0] - 61, 100 * 1024 ** 2)
+        self.assertEqual(disks._medium_capacity("uuid-disk"), 200 * 1024 ** 2)
+        disks._capacity["uuid-disk"] = (disks._capacity["uuid-disk"][0] - 61, 200 * 1024 ** 2)
+        disks.prune(set())
+        self.assertEqual(disks._capacity, {})
+
+
+class GuestPropertiesTest(unittest.TestCase):
+    def test_stop_ends_polling_and_start_resumes_it(self):
+        collector = FakeCollector()
+        collector.inventory.names = ["web"]
+        refreshed = threading.Event()
+
+        def run_command(args):
+            refreshed.set()
+            return True, ""
+
+        collector._run_command = run_command
+        guest = GuestProperties(collector, interval=0.01)
+
+        guest.start()
+        self.assertTrue(refreshed.wait(1))
+        thread = guest._thread
+        guest.stop()
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+
+        refreshed.clear()
+        time.sleep(0.05)
+        self.assertFalse(refreshed.is_set())
+
+        guest.start()
+        self.assertTrue(refreshed.wait(1))
+        guest.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
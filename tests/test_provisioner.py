@@ -0,0 +1,107 @@
+import unittest
+from contextlib import contextmanager
+from unittest import mock
+
+import provisioner as provisioner_module
+from provisioner import Provisioner, ProvisionLog, ProvisionTimeout
+from ssh_pool import SSHPoolError
+
+
+class FakeChannel:
+    """Canal paramiko minimal : le script ne se termine jamais (ou sort avec exit_code)"""
+
+    def __init__(self, runs: list, exit_code=None, stdout=()):
+        self.runs = runs
+        self.exit_code = exit_code
+        self.stdout = list(stdout)
+        self.closed = False
+
+    def settimeout(self, timeout):
+        pass
+
+    def exec_command(self, command):
+        self.runs.append(command)
+
+    def sendall(self, data):
+        pass
+
+    def shutdown_write(self):
+        pass
+
+    def recv_ready(self):
+        return bool(self.stdout)
+
+    def recv(self, size):
+        return self.stdout.pop(0)
+
+    def recv_stderr_ready(self):
+        return False
+
+    def exit_status_ready(self):
+        return self.exit_code is not None
+
+    def recv_exit_status(self):
+        return self.exit_code
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    def __init__(self, channel):
+        self.channel = channel
+
+    def get_transport(self):
+        return self
+
+    def open_session(self):
+        return self.channel
+
+
+class RunScriptTest(unittest.TestCase):
+    def setUp(self):
+        self.provisioner = Provisioner()
+        self.provisioner.timeout = 0.3
+        self.runs = []
+        self.connect_failures = 0
+        patches = [
+            mock.patch.object(provisioner_module, 'CONNECT_RETRY_DELAY', 0),
+            mock.patch.object(Provisioner, '_checkpoint', lambda *args: None),
+            mock.patch.object(provisioner_module.ssh_pool, 'connection', self._connection),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    @contextmanager
+    def _connection(self, vm_id, config, timeout=10):
+        if self.connect_failures:
+            self.connect_failures -= 1
+            raise SSHPoolError("Échec de l'authentification SSH")
+        yield FakeClient(self.channel)
+
+    def test_hanging_script_runs_once(self):
+        self.channel = FakeChannel(self.runs)
+        with self.assertRaises(ProvisionTimeout):
+            self.provisioner._run_script(1, {}, 'sleep 3600', ProvisionLog(100))
+        self.assertEqual(len(self.runs), 1)
+        self.assertTrue(self.channel.closed)
+
+    def test_connect_failures_are_retried_before_the_script_starts(self):
+        self.channel = FakeChannel(self.runs, exit_code=0)
+        self.connect_failures = 2
+        exit_code = self.provisioner._run_script(1, {}, 'true', ProvisionLog(100))
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(len(self.runs), 1)
+
+    def test_utf8_character_split_across_chunks(self):
+        text = 'Installation terminée ✓\n'.encode()
+        cut = text.index('✓'.encode()) + 1
+        self.channel = FakeChannel(self.runs, exit_code=0, stdout=[text[:cut], text[cut:]])
+        log = ProvisionLog(100)
+        self.provisioner._run_script(1, {}, 'true', log)
+        self.assertEqual(log.text(), 'Installation terminée ✓')
+
+
+if __name__ == '__main__':
+    unittest.main()
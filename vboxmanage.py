@@ -0,0 +1,131 @@
+"""
+Localisation de VBoxManage, résolue une fois puis mise en cache.
+
+Ordre de recherche : VMASTER_VBOXMANAGE (autre installation, ou
+fake_vboxmanage.py), le PATH, puis les emplacements d'installation
+habituels de chaque OS. Une sonde `VBoxManage --version` réussie est
+gardée en mémoire pour le processus et sur disque (VMASTER_VBOXMANAGE_CACHE),
+indexée par chemin, date de modification et taille du binaire : un
+lancement de creator.py ou metrics.py ne relance la sonde qu'après une
+mise à jour de VirtualBox. Un échec n'est jamais mémorisé.
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+from typing import NamedTuple, Optional
+
+if sys.platform == "win32":
+    INSTALL_PATHS = [
+        os.path.join(os.environ.get("VBOX_MSI_INSTALL_PATH", ""), "VBoxManage.exe"),
+        "C:\\Program Files\\Oracle\\VirtualBox\\VBoxManage.exe",
+    ]
+    CACHE_DIR = os.path.join(os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "VMaster")
+elif sys.platform == "darwin":
+    INSTALL_PATHS = ["/Applications/VirtualBox.app/Contents/MacOS/VBoxManage", "/usr/local/bin/VBoxManage"]
+    CACHE_DIR = os.path.join(os.path.expanduser("~"), "Library", "Caches", "vmaster")
+else:
+    INSTALL_PATHS = ["/usr/bin/VBoxManage", "/usr/local/bin/VBoxManage", "/usr/lib/virtualbox/VBoxManage"]
+    CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "vmaster")
+
+PROBE_TIMEOUT = 15
+
+
+class VBoxManage(NamedTuple):
+    path: str
+    version: str
+
+
+_resolved = {}
+_lock = threading.Lock()
+
+
+def cache_path() -> str:
+    return os.environ.get("VMASTER_VBOXMANAGE_CACHE") or os.path.join(CACHE_DIR, "vboxmanage.json")
+
+
+def _candidates(explicit: Optional[str]) -> list:
+    names = [explicit] if explicit else []
+    names.append("VBoxManage")
+    names.extend(INSTALL_PATHS)
+    paths = []
+    for name in names:
+        # shutil.which : chemin exécutable tel quel, ou recherche dans le PATH pour un nom nu
+        path = shutil.which(name) if name else None
+        if path:
+            path = os.path.abspath(path)
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def _load_cache() -> dict:
+    try:
+        with open(cache_path(), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(entries: dict):
+    path = cache_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entries, f)
+        os.replace(tmp, path)
+    except OSError:
+        # Cache en lecture seule : la sonde sera simplement relancée au prochain démarrage
+        pass
+
+
+def _probe(path: str) -> Optional[str]:
+    try:
+        result = subprocess.run([path, "--version"], capture_output=True, text=True,
+                                timeout=PROBE_TIMEOUT, encoding="utf-8", errors="replace")
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip() or "unknown"
+
+
+def find_vboxmanage(explicit: Optional[str] = None) -> Optional[VBoxManage]:
+    """Premier VBoxManage utilisable (chemin, version), ou None si VirtualBox est introuvable"""
+    explicit = explicit or os.environ.get("VMASTER_VBOXMANAGE")
+    with _lock:
+        if explicit in _resolved:
+            return _resolved[explicit]
+
+        cache = _load_cache()
+        found, changed = None, False
+        for path in _candidates(explicit):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            key = [stat.st_mtime_ns, stat.st_size]
+            entry = cache.get(path)
+            if entry is None or entry.get("key") != key or not entry.get("version"):
+                # Binaire inconnu ou modifié (mise à jour de VirtualBox) : nouvelle sonde
+                version = _probe(path)
+                if version is None:
+                    # Échec non mémorisé : VirtualBox peut être réparé sans toucher au binaire
+                    if cache.pop(path, None) is not None:
+                        changed = True
+                    continue
+                entry = {"key": key, "version": version}
+                cache[path] = entry
+                changed = True
+            found = VBoxManage(path, entry["version"])
+            break
+
+        if changed:
+            _save_cache(cache)
+        if found is not None:
+            # Introuvable : un appel suivant (installation en cours) relance la recherche
+            _resolved[explicit] = found
+        return found
@@ -0,0 +1,16 @@
+"""
+Point d'entrée WSGI de production (plusieurs processus workers) :
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+gunicorn.conf.py prépare la base une seule fois, dans le processus maître,
+puis démarre les services de chaque worker. Avec un autre serveur WSGI,
+lancer d'abord `python wsgi.py` (migrations + reprise) à chaque démarrage.
+"""
+from app import app, prepare_database
+
+application = app
+
+if __name__ == '__main__':
+    prepare_database()
+    print("✅ Base prête : le serveur WSGI peut être lancé")